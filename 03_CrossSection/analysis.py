@@ -1,27 +1,26 @@
 
-import uproot
+import os
+import sys
 import numpy as np
 import argparse
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../functions"))
+from histstore import HistStore
 
-def get_hist(proc, hName, norm=False, lumi=150e6):
-    with uproot.open(f"output/{proc}.root") as f:
-        hist = f[hName].to_numpy() # tuple (hist vals, hist edges)
-        xsec = f["crossSection"].value
-        nevents = f["eventsProcessed"].value
-        if norm:
-            scale_factor = lumi * xsec / nevents
-            hist = (hist[0] * scale_factor, hist[1])
-    return hist, xsec, nevents
 
-def yields():
-    procs = ["wzp6_ee_mumu_ecm91p2", "wzp6_ee_tautau_ecm91p2", "p8_ee_gaga_mumu_ecm91p2"]
+procs = ["wzp6_ee_mumu_ecm91p2", "wzp6_ee_tautau_ecm91p2", "p8_ee_gaga_mumu_ecm91p2"]
+
+def get_hist(store, proc, hName, norm=False, lumi=150e6):
+    hist = store.get(proc, hName, lumi=lumi if norm else None) # tuple (hist vals, hist edges)
+    return hist, store.xsec(proc), store.nevents(proc)
+
+def yields(store):
     luminosity = 44.84 # LEP=44.84, FCC=100e6
 
     print(f"Integrated luminosity used: {luminosity} pb-1\n")
     for proc in procs:
-        hist, xsec, nevents = get_hist(proc, "cutFlow")
-        hist_scaled, xsec, nevents = get_hist(proc, "cutFlow", norm=True, lumi=luminosity)
+        hist, xsec, nevents = get_hist(store, proc, "cutFlow")
+        hist_scaled, xsec, nevents = get_hist(store, proc, "cutFlow", norm=True, lumi=luminosity)
         yields = hist[0][4]
         yields_scaled = hist_scaled[0][4]
         print(f"Process {proc} xsec={xsec:.2f} pb, nevents={nevents}")
@@ -29,13 +28,43 @@ def yields():
         print(f"   Normalized yields: {yields_scaled:.2f}")
 
 
-def acceptance():
+def acceptance(store):
     proc = "wzp6_ee_mumu_ecm91p2"
-    hist, xsec, nevents = get_hist(proc, "cutFlow")
-    n_tot = hist[0][0] # events before any cut
-    n_sel = hist[0][4] # events after all cuts
+    values, sumw2, edges = store.get(proc, "cutFlow", variances=True)
+    raw = store.get(proc, "cutFlow_raw")[0] # raw number of events per cut
+    n_tot = values[0] # events before any cut
+    n_sel = values[4] # events after all cuts
     acc = n_sel / n_tot
-    print(f"Acceptance for {proc} = {acc:.03f}")
+
+    # binomial error for weighted events, using the sum of squared weights stored in the cutFlow errors
+    acc_err = ((1-2*acc)*sumw2[4] + acc**2*sumw2[0])**0.5 / n_tot
+    print(f"Acceptance for {proc} = {acc:.03f} +/- {acc_err:.03f} ({raw[4]:.0f} of {raw[0]:.0f} events)")
+
+
+def cross_section_toys(store, ntoys, chunk=1000, seed=None):
+    # pseudo-experiments of the normalized cutFlow (signal + backgrounds), with the cross-section
+    # sigma = (n_obs - n_bkg) / (A * L) and its error sqrt(n_obs) / (A * L) per toy
+    import toys
+    lumis = {"LEP": 44.84, "FCC-ee": 100e6}
+    signal, backgrounds = procs[0], procs[1:]
+    L = np.array(list(lumis.values()))
+    values = store.get(signal, "cutFlow")[0]
+    acc = values[4] / values[0]
+
+    expected = np.stack([sum(store.get(proc, "cutFlow", lumi=lumi)[0] for proc in procs) for lumi in L])
+    n_bkg = np.array([sum(store.get(proc, "cutFlow", lumi=lumi)[0][4] for proc in backgrounds) for lumi in L])
+    truth = (expected[:, 4] - n_bkg) / (acc*L)
+
+    def estimator(toyHists):
+        n_obs = toyHists[..., 4]
+        return {"xsec": ((n_obs - n_bkg) / (acc*L), np.sqrt(n_obs) / (acc*L))}
+
+    xsecs, errs = toys.run(expected, estimator, ntoys, chunk=chunk, seed=seed)["xsec"]
+    stats = toys.summarize(xsecs, errs, truth)
+    print(f"Cross-section toys for {signal} ({ntoys} pseudo-experiments), acceptance {acc:.3f}")
+    for iL, lumiName in enumerate(lumis):
+        print(f"   {lumiName}: expected = {truth[iL]:.3f} pb, bias = {stats['bias'][iL]:.2e} pb, RMS = {stats['rms'][iL]:.3e} pb, mean error = {stats['mean_err'][iL]:.3e} pb")
+        print(f"   {' '*len(lumiName)}  pull mean = {stats['pull_mean'][iL]:.3f}, pull width = {stats['pull_width'][iL]:.3f}, coverage = {stats['coverage'][iL]:.3f}")
 
 
 
@@ -44,9 +73,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--yields", action="store_true", help="Calculate event yields")
     parser.add_argument("--acceptance", action="store_true", help="Calculate acceptance")
+    parser.add_argument("--toys", type=int, default=0, help="Number of pseudo-experiments for the cross-section bias and pull study")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed of the toys")
     args = parser.parse_args()
 
+    # all histograms are read once (and cached in output/.histcache)
+    store = HistStore(procs, ["cutFlow", "cutFlow_raw"] if args.acceptance else ["cutFlow"])
+
     if args.yields:
-        yields()
+        yields(store)
     elif args.acceptance:
-        acceptance()
+        acceptance(store)
+    elif args.toys > 0:
+        cross_section_toys(store, args.toys, seed=args.seed)
@@ -1,34 +1,32 @@
-import uproot
+import os
+import sys
 #import hist
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import mplhep as hep 
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../functions"))
+from histstore import HistStore
+from plotting import Plot, render
+
 hep.style.use("CMS")
 plt.style.use(hep.style.CMS)
 
 
-def plot_invariant_mass():
+def plot_invariant_mass(data, style):
     fig = plt.figure()
     ax = fig.subplots()
 
-    hists = []
-    for i,proc in enumerate(procs):
-        file = uproot.open(f"output/{proc}.root")
-        #print(file.keys())
-        h = file["invariant_mass"]
-        h = h.to_hist()
-        #print(h)
-        hists.append(h)
-
-
     hep.histplot(
-        hists,
+        list(data["values"]),
+        bins=data["edges"],
         stack=True,
         histtype="fill",
         color=["#7FBF7F", "#7F7FFF", "w"],
         edgecolor=["k", "k", "r"],
         linewidth=1,
-        label=labels,
+        label=style["labels"],
         ax=ax,
     )
 
@@ -39,35 +37,24 @@ def plot_invariant_mass():
     ax.set_xlabel("Invariant mass (GeV)")
 
     hep.label.exp_label(exp="FCC-ee", ax=ax, data=False, rlabel="100 $\mathrm{ab^{-1}}$ (91.2 GeV)")
-
-    fig.savefig(f"{outDir}/invariant_mass_mpl4hep.png", bbox_inches="tight")
-    fig.savefig(f"{outDir}/invariant_mass_mpl4hep.pdf", bbox_inches="tight")
+    return fig
 
 
-def plot_cutflow():
+def plot_cutflow(data, style):
     fig = plt.figure()
     ax = fig.subplots()
 
     cut_names = ["All events", "$\geq 1 \mu$", "$\geq 2 \mu^\pm$", "$2~\\text{OS}~\mu$", "$\\text{p}_\mu^{\\text{max}} > 0.6~\\text{p}_{\\text{beam}}$"]
 
-    hists = []
-    for i,proc in enumerate(procs):
-        file = uproot.open(f"output/{proc}.root")
-        #print(file.keys())
-        h = file["cutFlow"]
-        h = h.to_hist()
-        #print(h)
-        hists.append(h)
-
-
     hep.histplot(
-        hists,
+        list(data["values"]),
+        bins=data["edges"],
         stack=True,
         histtype="fill",
         color=["#7FBF7F", "#7F7FFF", "w"],
         edgecolor=["k", "k", "r"],
         linewidth=1,
-        label=labels,
+        label=style["labels"],
         ax=ax,
     )
 
@@ -81,9 +68,7 @@ def plot_cutflow():
     ax.margins(y=0.25)
 
     hep.label.exp_label(exp="FCC-ee", ax=ax, data=False, rlabel="44.84 $\mathrm{pb^{-1}}$ (91.2 GeV)")
-
-    fig.savefig(f"{outDir}/cutFlow_mpl4hep.png", bbox_inches="tight")
-    fig.savefig(f"{outDir}/cutFlow_mpl4hep.pdf", bbox_inches="tight")
+    return fig
 
 
 if __name__ == "__main__":
@@ -91,6 +76,11 @@ if __name__ == "__main__":
     outDir = "/home/submit/jaeyserm/public_html/fccee/tutorials/z_mumu_xsec/"
     procs = ["p8_ee_gaga_mumu_ecm91p2", "wzp6_ee_tautau_ecm91p2", "wzp6_ee_mumu_ecm91p2"]
     labels = ["$e^+e^-\\to e^+e^-qq$", "$e^+e^-\\to\\tau^+\\tau^-$", "$e^+e^-\\to\mu^+\mu^-$"]
-
-    plot_invariant_mass()
-    plot_cutflow()
+    store = HistStore(procs, ["invariant_mass", "cutFlow"])
+
+    # each figure and format is rendered in a separate process, unchanged figures are skipped
+    plots = []
+    for name, draw in [("invariant_mass", plot_invariant_mass), ("cutFlow", plot_cutflow)]:
+        values, edges = store.stack(name, procs)
+        plots.append(Plot(f"{name}_mpl4hep", draw, {"values": values, "edges": edges}, {"labels": labels}))
+    render(plots, outDir)
@@ -1,7 +1,14 @@
 
+import os
+import sys
 import ROOT
 ROOT.TH1.SetDefaultSumw2(ROOT.kTRUE)
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../functions"))
+from cutflow import CutFlow
+from variations import parameters
+from library import include_paths
+
 
 
 # list of all guns
@@ -16,8 +23,15 @@ processList = {
 inputDir = "/ceph/submit/data/group/fcc/ee/generation/DelphesEvents/winter2023/IDEA/"
 procDict = "/ceph/submit/data/group/fcc/ee/generation/DelphesEvents/winter2023/IDEA/samplesDict.json"
 
-# additional/custom C++ functions
-includePaths = ["../functions/functions.h", "../functions/functions_gen.h"]
+# additional/custom C++ functions, also precompiled into includeLibrary (python ../functions/library.py):
+# when it is built and up to date, it is loaded here and the headers it replaces are not JIT-compiled,
+# by the runner, its workers and `fccanalysis run` alike
+includeLibrary = "../functions/build/libFCCPhysicsFunctions.so"
+includePaths = include_paths(["../functions/functions.h", "../functions/functions_gen.h"], includeLibrary, __file__)
+
+# events without reconstructed muons fail CUT 1 and fill no histogram: with `runner.py --prescan`,
+# they are only counted (CUT 0, eventsProcessed, sum of weights), not read (see functions/prescan.py)
+prescan = ("Muon#0.index", 1)
 
 
 # output directory
@@ -48,12 +62,42 @@ bins_norm = (200, 0, 2)
 bins_nparticles = (200, 0, 200)
 bins_aco = (800,-4,4)
 
-def build_graph(df, dataset):
+# labels of the cut flow bins
+cutFlowLabels = ["All events", "#geq 1 #mu", "#geq 2 #mu^{#pm}", "2 OS #mu", "p_{#mu}^{max} > 0.6 p_{beam}"]
 
-    hists = []
+# selection parameters, defined as columns so that the variations below can shift them
+selection = {
+    "costheta_max": 0.97,  # muon acceptance |cos(theta)|
+    "p_beam": 45.6,  # beam momentum for the normalization of the muon momentum
+    "p_max_norm_min": 0.6,
+    "muon_scale": 1.,  # muon momentum scale
+    "muon_smear": 0.,  # additional relative muon momentum resolution
+}
+
+# systematic variations, booked in the same event loop: name: (parameter, {tag: value})
+variations = {
+    "acceptance": ("costheta_max", {"up": 0.98, "down": 0.96}),
+    "beamMomentum": ("p_beam", {"up": 45.7, "down": 45.5}),
+    "pMaxCut": ("p_max_norm_min", {"up": 0.65, "down": 0.55}),
+    "muonScale": ("muon_scale", {"up": 1.0001, "down": 0.9999}),
+    "muonSmear": ("muon_smear", {"up": 0.001}),
+}
+
+# histograms also written for every variation, as {name}_{variation}{Up,Down}
+variedHists = ["cutFlow", "invariant_mass"]
+
+# columns written by the skim stage, everything build_analysis needs
+skimColumns = ["weight", "event_seed", "muons_p", "muons_theta", "muons_q", "muons_no", "muons_px", "muons_py", "muons_pz", "muons_m"]
+
+# early selection (up to CUT 3), can be cached with `runner.py --skim`
+def build_skim(df, hists):
 
     df = df.Define("weight", "1.0")
     weightsum = df.Sum("weight")
+    # seed of the muonSmear variation, from the event number and input file rather than the entry number
+    df = df.Define("event_seed", "FCCAnalyses::event_seed(EventHeader.eventNumber, rdfsampleinfo_.GetSampleName())")
+    cutFlow = CutFlow(cutFlowLabels)
+    hists += [cutFlow, cutFlow.raw]
 
     df = df.Alias("Particle0", "Particle#0.index")
     df = df.Alias("Particle1", "Particle#1.index")
@@ -63,43 +107,48 @@ def build_graph(df, dataset):
 
     # reco muons
     df = df.Define("muons_all", "FCCAnalyses::ReconstructedParticle::get(Muons, ReconstructedParticles)")
-    df = df.Define("muons_all_p", "FCCAnalyses::ReconstructedParticle::get_p(muons_all)")
-    df = df.Define("muons_all_theta", "FCCAnalyses::ReconstructedParticle::get_theta(muons_all)")
-    df = df.Define("muons_all_costheta", "FCCAnalyses::get_costheta(muons_all)")
-    df = df.Define("muons_all_phi", "FCCAnalyses::ReconstructedParticle::get_phi(muons_all)")
-    df = df.Define("muons_all_q", "FCCAnalyses::ReconstructedParticle::get_charge(muons_all)")
-    df = df.Define("muons_all_no", "FCCAnalyses::ReconstructedParticle::get_n(muons_all)")
+    # all muon kinematics in one pass, the columns below are views on its arrays
+    df = df.Define("muons_all_kin", "FCCAnalyses::get_kinematics(muons_all)")
+    df = df.Define("muons_all_p", "muons_all_kin.p()")
+    df = df.Define("muons_all_theta", "muons_all_kin.theta()")
+    df = df.Define("muons_all_costheta", "muons_all_kin.costheta()")
+    df = df.Define("muons_all_phi", "muons_all_kin.phi()")
+    df = df.Define("muons_all_q", "muons_all_kin.q()")
+    df = df.Define("muons_all_no", "muons_all_kin.n")
 
     # define cos(theta) of the muons
     hists.append(df.Histo1D(("muons_all_costheta", "", *bins_cos), "muons_all_costheta"))
-    df = df.Define("muons", "FCCAnalyses::sel_range(0, 0.97, true)(muons_all, muons_all_costheta)")
-    df = df.Define("muons_p", "FCCAnalyses::ReconstructedParticle::get_p(muons)")
-    df = df.Define("muons_theta", "FCCAnalyses::ReconstructedParticle::get_theta(muons)")
-    df = df.Define("muons_no", "FCCAnalyses::ReconstructedParticle::get_n(muons)")
-    df = df.Define("muons_q", "FCCAnalyses::ReconstructedParticle::get_charge(muons)")
+    df = parameters(df, selection, variations, ["costheta_max"])
+    df = df.Define("muons_sel", "FCCAnalyses::sel_range(0, costheta_max, true).mask(muons_all_costheta)")
+    df = df.Define("muons_kin", "FCCAnalyses::get_kinematics(muons_all_kin, muons_sel)")
+    df = df.Define("muons_p", "muons_kin.p()")
+    df = df.Define("muons_theta", "muons_kin.theta()")
+    df = df.Define("muons_no", "muons_kin.n")
+    df = df.Define("muons_q", "muons_kin.q()")
+    df = df.Define("muons_px", "muons_kin.px()")
+    df = df.Define("muons_py", "muons_kin.py()")
+    df = df.Define("muons_pz", "muons_kin.pz()")
+    df = df.Define("muons_m", "muons_kin.m()")
 
 
     #########
     ### CUT 0: all events
     #########
-    df = df.Define("cut0", "0")
-    hists.append(df.Histo1D(("cutFlow", "", *bins_count), "cut0"))
+    cutFlow.add(df, 0)
 
     #########
     ### CUT 1: select at least 1 muon
     #########
     df = df.Filter("muons_no >= 1")
 
-    df = df.Define("cut1", "1")
-    hists.append(df.Histo1D(("cutFlow", "", *bins_count), "cut1"))
+    cutFlow.add(df, 1)
 
     #########
     ### CUT 2: select at least 2 muons
     #########
     df = df.Filter("muons_no >= 2")
 
-    df = df.Define("cut2", "2")
-    hists.append(df.Histo1D(("cutFlow", "", *bins_count), "cut2"))
+    cutFlow.add(df, 2)
 
 
     #########
@@ -107,32 +156,48 @@ def build_graph(df, dataset):
     #########
     df = df.Filter("muons_no == 2 && (muons_q[0] + muons_q[1]) == 0")
 
-    df = df.Define("cut3", "3")
-    hists.append(df.Histo1D(("cutFlow", "", *bins_count), "cut3"))
+    cutFlow.add(df, 3)
+
+    return df, weightsum
+
+
+# late selection, only uses the skimColumns
+def build_analysis(df, hists):
 
+    cutFlow = CutFlow(cutFlowLabels)
+    hists += [cutFlow, cutFlow.raw]
+
+    df = parameters(df, selection, variations, ["p_beam", "p_max_norm_min", "muon_scale", "muon_smear"])
+    # muon momentum scale and resolution corrections (factors of 1 for the nominal selection)
+    df = df.Define("muons_p_factors", "FCCAnalyses::momentum_factors(muons_no, muon_scale, muon_smear, event_seed)")
+    df = df.Define("muons_p_corr", "muons_p*muons_p_factors")
 
     #########
     ### CUT 4: max normalized muon momentum > 0.6
     #########
-    df = df.Define("muon_max_p", "(muons_p[0] > muons_p[1]) ? muons_p[0] : muons_p[1]")
-    df = df.Define("muon_max_p_norm", "muon_max_p/45.6")
+    df = df.Define("muon_max_p", "(muons_p_corr[0] > muons_p_corr[1]) ? muons_p_corr[0] : muons_p_corr[1]")
+    df = df.Define("muon_max_p_norm", "muon_max_p/p_beam")
     hists.append(df.Histo1D(("muon_max_p_norm", "", *bins_norm), "muon_max_p_norm"))
-    df = df.Filter("muon_max_p_norm > 0.6")
+    df = df.Filter("muon_max_p_norm > p_max_norm_min")
 
-    df = df.Define("cut4", "4")
-    hists.append(df.Histo1D(("cutFlow", "", *bins_count), "cut4"))
+    cutFlow.add(df, 4)
 
 
     ############################################################################
     # acolinearity between 2 muons
-    df = df.Define("acolinearity", "FCCAnalyses::acolinearity(muons)")
+    df = df.Define("acolinearity", "FCCAnalyses::acolinearity(muons_px, muons_py, muons_pz)")
     hists.append(df.Histo1D(("acolinearity", "", *bins_aco), "acolinearity"))
 
     # plot invariant mass of both muons
-    df = df.Define("leps_tlv", "FCCAnalyses::makeLorentzVectors(muons)")
+    df = df.Define("leps_tlv", "FCCAnalyses::makeLorentzVectorsPxPyPzM(muons_px*muons_p_factors, muons_py*muons_p_factors, muons_pz*muons_p_factors, muons_m)")
     df = df.Define("invariant_mass", "(leps_tlv[0]+leps_tlv[1]).M()")
     hists.append(df.Histo1D(("invariant_mass", "", *bins_m_ll), "invariant_mass"))
 
 
+def build_graph(df, dataset):
+
+    hists = []
+    df, weightsum = build_skim(df, hists)
+    build_analysis(df, hists)
 
     return hists, weightsum
@@ -1,6 +1,10 @@
 
 import sys,array,ROOT,math,os,copy
 import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../functions"))
+import afb
 
 ROOT.gROOT.SetBatch(True)
 ROOT.gStyle.SetOptStat(0)
@@ -9,17 +13,178 @@ ROOT.gStyle.SetOptTitle(0)
 parser = argparse.ArgumentParser()
 parser.add_argument("-o", "--outDir", type=str, default="/home/submit/jaeyserm/public_html/fccee/tutorials/afb/", help="Output directory")
 parser.add_argument("-p", "--proc", type=str, default="wzp6_ee_mumu_ecm91p2", choices=["wzp6_ee_mumu_ecm91p2", "kkmcee_ee_mumu_ecm91p2", "p8_ee_Zmumu_ecm91"], help="MC process")
+parser.add_argument("-l", "--lumi", type=float, default=44.84, help="Integrated luminosity in pb-1 (LEP=44.84, FCC-ee=100e6)")
+parser.add_argument("--summary", action="store_true", help="Print A_FB for all processes, luminosities and rebin factors")
+parser.add_argument("--scan", action="store_true", help="Scan A_FB and its error over |cos(theta_c)| windows and rebin factors")
+parser.add_argument("--scanStep", type=float, default=0.05, help="Step of the |cos(theta_c)| window boundaries in the scan")
+parser.add_argument("--scanRebin", type=int, nargs="+", default=[1, 2, 4, 5], help="Rebin factors in the scan")
+parser.add_argument("--unbinned", action="store_true", help="Unbinned A_FB (counting, method of moments, likelihood) from the cosThetac moments")
+parser.add_argument("--unfold", action="store_true", help="Unfold cosThetac to gen level with the response matrix (requires bookResponse = True in z_mumu_afb.py)")
+parser.add_argument("--tau", type=float, nargs="+", default=[1e-3, 1e-2, 1e-1], help="Regularization strengths of the Tikhonov unfolding")
+parser.add_argument("--toys", type=int, default=0, help="Number of pseudo-experiments for the bias and pull study at the LEP and FCC-ee luminosities")
+parser.add_argument("--toyChunk", type=int, default=1000, help="Number of toys generated at once")
+parser.add_argument("--seed", type=int, default=None, help="Random seed of the toys")
 args = parser.parse_args()
 
+
+def summary():
+    # all processes, luminosities and rebin factors in one batched computation
+    from histstore import HistStore
+    procs = ["wzp6_ee_mumu_ecm91p2", "kkmcee_ee_mumu_ecm91p2", "p8_ee_Zmumu_ecm91"]
+    lumis = {"LEP": 44.84, "FCC-ee": 100e6}
+    rebins = [1, 2, 4, 5, 10]
+    store = HistStore(procs, ["cosThetac"])
+    values, edges = store.stack("cosThetac", procs)
+    results = afb.scan(values, edges, lumis=list(lumis.values()), rebins=rebins, window=(0, 0.9))
+
+    print(f"{'process':<25} {'lumi':<7} {'rebin':>5} {'A_FB (int.)':>24} {'A_FB (fit)':>24}")
+    for iP, proc in enumerate(procs):
+        for iL, lumiName in enumerate(lumis):
+            for r in rebins:
+                count, fit = results[r]
+                print(f"{proc:<25} {lumiName:<7} {r:>5} {count['afb'][iP,iL]:>11.6f} +/- {count['afb_err'][iP,iL]:.3e} {fit['afb'][iP,iL]:>11.6f} +/- {fit['afb_err'][iP,iL]:.3e}")
+
+
+def scan():
+    # A_FB for all windows bounds[i] <= |cos(theta_c)| <= bounds[j], each from two prefix sums over the bins
+    from histstore import HistStore
+    store = HistStore([args.proc], ["cosThetac"])
+    values, edges = store.get(args.proc, "cosThetac")
+    values = values*args.lumi
+    step = args.scanStep
+    bounds = np.round(np.arange(0, 1+step/2, step), 6)
+    nb = len(bounds)
+
+    for r in args.scanRebin:
+        v, e = afb.rebin(values, edges, r)
+        count, fit = afb.window_scan(v, e, bounds)
+
+        print(f"##################   rebin {r}")
+        print(f"{'|cos| min':>9} {'|cos| max':>9} {'A_FB (int.)':>24} {'A_FB (fit)':>24} {'chi2/ndf':>10}")
+        err = np.where(np.isfinite(fit["afb_err"]), fit["afb_err"], np.inf)
+        for k in np.argsort(err, axis=None)[:10]:
+            i, j = np.unravel_index(k, err.shape)
+            if not np.isfinite(err[i, j]):
+                break
+            print(f"{bounds[i]:>9.3f} {bounds[j]:>9.3f} {count['afb'][i,j]:>11.6f} +/- {count['afb_err'][i,j]:.3e} {fit['afb'][i,j]:>11.6f} +/- {fit['afb_err'][i,j]:.3e} {fit['chi2'][i,j]:>6.1f}/{fit['ndf'][i,j]:.0f}")
+
+        h = ROOT.TH2D(f"scan_rebin{r}", "", nb, bounds[0]-step/2, bounds[-1]+step/2, nb, bounds[0]-step/2, bounds[-1]+step/2)
+        for i in range(nb):
+            for j in range(nb):
+                if np.isfinite(fit["afb_err"][i, j]):
+                    h.SetBinContent(i+1, j+1, fit["afb_err"][i, j])
+        h.GetXaxis().SetTitle("|cos(#theta_{c})| min")
+        h.GetYaxis().SetTitle("|cos(#theta_{c})| max")
+        h.GetZaxis().SetTitle("#sigma(A_{FB}) (fit)")
+        h.SetMinimum(np.min(err))
+
+        c = ROOT.TCanvas("c", "c", 1000, 1000)
+        c.SetRightMargin(0.18)
+        c.SetLeftMargin(0.13)
+        c.SetLogz()
+        h.Draw("COLZ")
+        c.SaveAs(f"{args.outDir}/{args.proc}_scan_rebin{r}.png")
+        c.SaveAs(f"{args.outDir}/{args.proc}_scan_rebin{r}.pdf")
+
+
+def unbinned():
+    # estimators from the per-event moments accumulated in the event loop, for each |cos(theta_c)| window
+    from histstore import HistStore
+    import z_mumu_afb
+    windows = z_mumu_afb.afbWindows
+    store = HistStore([args.proc], ["cosThetac_moments", "gen_cosThetac_moments"])
+    print(f"{'':<5} {'|cos| max':>9} {'':<10} {'A_FB':>11} {'error':>10}")
+    for name, label in [("cosThetac_moments", "reco"), ("gen_cosThetac_moments", "gen")]:
+        values = store.get(args.proc, name)[0] * args.lumi
+        results = afb.unbinned(values, windows)
+        for iW, window in enumerate(windows):
+            for method, res in zip(["counting", "moments", "likelihood"], results):
+                print(f"{label:<5} {window:>9.3f} {method:<10} {res['afb'][iW]:>11.6f} {res['afb_err'][iW]:>10.3e}")
+
+
+def unfolding():
+    # all processes unfolded at once, by matrix inversion and with Tikhonov regularization
+    from histstore import HistStore
+    import unfold
+    procs = ["wzp6_ee_mumu_ecm91p2", "kkmcee_ee_mumu_ecm91p2", "p8_ee_Zmumu_ecm91"]
+    store = HistStore(procs, ["cosThetac", "gen_cosThetac", "cosThetac_response"])
+    reco, edges = store.stack("cosThetac", procs)
+    gen = store.stack("gen_cosThetac", procs)[0] * args.lumi
+    reco = reco * args.lumi
+    R = unfold.response(store.stack("cosThetac_response", procs)[0].reshape(len(procs), len(edges)-1, len(edges)-1))
+
+    results = {"inversion": unfold.invert(R, reco)}
+    gen_tau, cov_tau = unfold.tikhonov(R, reco, args.tau)
+    for iT, tau in enumerate(args.tau):
+        results[f"tau = {tau:g}"] = (gen_tau[:, iT], cov_tau[:, iT])
+
+    # counting A_FB and its error from the covariance of the unfolded bins
+    sign = np.where(afb.centers(edges) >= 0, 1., -1.)
+    def counting(values, cov):
+        N = values.sum(axis=-1)
+        A = (values*sign).sum(axis=-1)/N
+        grad = (sign - A[..., None])/N[..., None]
+        return A, np.sqrt(np.einsum("...i,...ij,...j->...", grad, cov, grad))
+
+    for iP, proc in enumerate(procs):
+        print(f"##################   {proc}")
+        print(f"{'reco':<15} {afb.counting(reco[iP], edges)['afb']:>11.6f}")
+        print(f"{'gen':<15} {afb.counting(gen[iP], edges)['afb']:>11.6f}")
+        for name, (values, cov) in results.items():
+            A, A_err = counting(values[iP], cov[iP])
+            print(f"{name:<15} {A:>11.6f} +/- {A_err:.3e}")
+
+
+def run_toys():
+    # Poisson fluctuations of the normalized cosThetac histogram, refitted with the closed-form estimators
+    from histstore import HistStore
+    import toys
+    store = HistStore([args.proc], ["cosThetac"])
+    values, edges = store.get(args.proc, "cosThetac")
+    lumis = {"LEP": 44.84, "FCC-ee": 100e6}
+    window = (0, 0.9)
+    mask = afb.window_mask(edges, window)[:, None]
+    expected = values[None, :] * np.array(list(lumis.values()))[:, None]
+
+    def estimator(toyHists):
+        count, fit = afb.solve((afb.moments(toyHists, edges) * mask).sum(axis=-2))
+        return {"int.": (count["afb"], count["afb_err"]), "fit": (fit["afb"], fit["afb_err"])}
+
+    truth = {"int.": afb.counting(expected, edges, window)["afb"], "fit": afb.fit(expected, edges, window)["afb"]}
+    results = toys.run(expected, estimator, args.toys, chunk=args.toyChunk, seed=args.seed)
+
+    print(f"{'lumi':<7} {'A_FB':<5} {'expected':>10} {'bias':>10} {'RMS':>10} {'mean err':>10} {'pull mean':>10} {'pull width':>10} {'coverage':>9}")
+    for name, (afbs, errs) in results.items():
+        stats = toys.summarize(afbs, errs, truth[name])
+        for iL, lumiName in enumerate(lumis):
+            print(f"{lumiName:<7} {name:<5} {truth[name][iL]:>10.6f} {stats['bias'][iL]:>10.2e} {stats['rms'][iL]:>10.3e} {stats['mean_err'][iL]:>10.3e} {stats['pull_mean'][iL]:>10.3f} {stats['pull_width'][iL]:>10.3f} {stats['coverage'][iL]:>9.3f}")
+
+
 if __name__ == "__main__":
 
+    if args.toys > 0:
+        run_toys()
+        sys.exit(0)
+    if args.unfold:
+        unfolding()
+        sys.exit(0)
+    if args.unbinned:
+        unbinned()
+        sys.exit(0)
+    if args.summary:
+        summary()
+        sys.exit(0)
+    if args.scan:
+        scan()
+        sys.exit(0)
+
     fIn = ROOT.TFile(f"output/{args.proc}.root")
 
     # sample/lumi
     #xsec = 1692.4238 # pb
     lumi_lep = 44.84 # /pb
     lumi_fccee = 100e6 # /pb
-    lumi = lumi_lep
+    lumi = args.lumi
 
     # cuts
     costhetac_abs_min, costhetac_abs_max = 0, 0.9
@@ -30,41 +195,34 @@ if __name__ == "__main__":
     #nevents_sim = h_meta.GetBinContent(1) # number of simulated events
     h_costhetac.Scale(lumi)
 
-    # construct TGraph with errors sqrt(s) of the bin content
-    N_F, N_B = 0, 0
-    g_costhetac = ROOT.TGraphErrors()
+    # bin contents and edges as arrays
+    nBins = h_costhetac.GetNbinsX()
+    values = np.frombuffer(h_costhetac.GetArray(), dtype=np.float64, count=nBins+2)[1:-1].copy()
+    edges = np.array([h_costhetac.GetXaxis().GetBinLowEdge(i) for i in range(1, nBins+2)])
+    window = (costhetac_abs_min, costhetac_abs_max)
+
+    count = afb.counting(values, edges, window)
+    N_F, N_B = count["N_F"], count["N_B"]
+    N_TOT = N_F + N_B
+    A_FB, A_FB_err = count["afb"], count["afb_err"]
+
+    # the fit model [0]*(3(1+x^2)/8 + [1]*x) is linear in its coefficients and is solved exactly
+    res = afb.fit(values, edges, window)
+    A_FB_fit, A_FB_fit_err = res["afb"], res["afb_err"]
+
+    # construct TGraph with errors sqrt(s) of the bin content, for drawing
+    mask = afb.window_mask(edges, window)
+    x, y = afb.centers(edges)[mask], values[mask]
+    g_costhetac = ROOT.TGraphErrors(len(x), x, y, np.zeros(len(x)), np.sqrt(y))
     g_costhetac.SetLineColor(ROOT.kBlack)
     g_costhetac.SetMarkerStyle(20)
     g_costhetac.SetMarkerColor(ROOT.kBlack)
     g_costhetac.SetLineColor(ROOT.kBlack)
 
-    iP = 0
-    for iBin in range(1, h_costhetac.GetNbinsX()+1):
-        x, y = h_costhetac.GetBinCenter(iBin), h_costhetac.GetBinContent(iBin)
-        if abs(x) > costhetac_abs_max or abs(x) < costhetac_abs_min:
-            continue
-        print(iP, x, y)
-        g_costhetac.SetPoint(iP, x, y)
-        g_costhetac.SetPointError(iP, 0, y**0.5) # set the bin error equal to the data statistics
-        #print(x, y, y**0.5, h_costhetac.GetBinError(iBin))
-        if x < 0: N_B += y
-        else: N_F += y
-        iP += 1
-
-    N_TOT = N_F + N_B
-    A_FB = (N_F-N_B)/(N_F+N_B)
-
-    A_FB_err = (4*N_F*N_B/(N_F+N_B)**3)**0.5
-
-    # fit with parabola
     fit = ROOT.TF1("fit", "[0]*(3.*(1+x*x)/8. + [1]*x)", -costhetac_abs_max, costhetac_abs_max)
-    fit.SetParameter(0, N_TOT)
-    fit.SetParameter(1, 8.01962e-02)
-    g_costhetac.Fit("fit", "NSE", "", -costhetac_abs_max, costhetac_abs_max)
+    fit.SetParameters(res["norm"], A_FB_fit)
     fit.SetLineColor(ROOT.kRed)
 
-    A_FB_fit, A_FB_fit_err = fit.GetParameter(1), fit.GetParError(1)
-
     c = ROOT.TCanvas("c", "c", 1000, 1000)
     c.SetTopMargin(0.055)
     c.SetRightMargin(0.05)
@@ -121,3 +279,4 @@ if __name__ == "__main__":
 
     print("A_FB:       %.6e +/- %.3e" % (A_FB, A_FB_err))
     print("A_FB_fit:   %.6e +/- %.3e" % (A_FB_fit, A_FB_fit_err))
+    print(f"chi2/ndf:   {res['chi2']:.2f}/{res['ndf']:.0f}")
@@ -1,7 +1,15 @@
 
+import os
+import sys
 import ROOT
 ROOT.TH1.SetDefaultSumw2(ROOT.kTRUE)
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../functions"))
+from cutflow import CutFlow
+from afb import book_moments
+from variations import parameters
+from library import include_paths
+
 
 
 # list of all guns
@@ -18,8 +26,15 @@ procDict = "/ceph/submit/data/group/fcc/ee/generation/DelphesEvents/winter2023/I
 
 
 
-# additional/custom C++ functions
-includePaths = ["../functions/functions.h", "../functions/functions_gen.h"]
+# additional/custom C++ functions, also precompiled into includeLibrary (python ../functions/library.py):
+# when it is built and up to date, it is loaded here and the headers it replaces are not JIT-compiled,
+# by the runner, its workers and `fccanalysis run` alike
+includeLibrary = "../functions/build/libFCCPhysicsFunctions.so"
+includePaths = include_paths(["../functions/functions.h", "../functions/functions_gen.h"], includeLibrary, __file__)
+
+# events without reconstructed muons fail CUT 1 and fill no histogram: with `runner.py --prescan`,
+# they are only counted (CUT 0, eventsProcessed, sum of weights), not read (see functions/prescan.py)
+prescan = ("Muon#0.index", 1)
 
 
 # output directory
@@ -50,12 +65,51 @@ bins_norm = (200, 0, 2)
 bins_nparticles = (200, 0, 200)
 bins_aco = (800,-4,4)
 
-def build_graph(df, dataset):
+# |cos(theta_c)| windows of the unbinned A_FB moments
+afbWindows = [0.9, 1.0]
 
-    hists = []
+# book the gen vs reco cos(theta_c) response matrix for the unfolding (analysis.py --unfold)
+bookResponse = False
+
+# labels of the cut flow bins
+cutFlowLabels = ["All events", "#geq 1 #mu", "#geq 2 #mu^{#pm}", "2 OS #mu", "p_{#mu}^{max} > 0.6 p_{beam}", "acolinearity < 15^{#circ}"]
+
+# selection parameters, defined as columns so that the variations below can shift them
+selection = {
+    "costheta_max": 0.97,  # muon acceptance |cos(theta)|
+    "p_beam": 45.6,  # beam momentum for the normalization of the muon momentum
+    "p_max_norm_min": 0.6,
+    "acolinearity_max": 0.261799388,  # 15 degrees
+    "muon_scale": 1.,  # muon momentum scale
+    "muon_smear": 0.,  # additional relative muon momentum resolution
+}
+
+# systematic variations, booked in the same event loop: name: (parameter, {tag: value})
+variations = {
+    "acceptance": ("costheta_max", {"up": 0.98, "down": 0.96}),
+    "beamMomentum": ("p_beam", {"up": 45.7, "down": 45.5}),
+    "pMaxCut": ("p_max_norm_min", {"up": 0.65, "down": 0.55}),
+    "acolinearityCut": ("acolinearity_max", {"up": 0.349065850, "down": 0.174532925}),  # 20 and 10 degrees
+    "muonScale": ("muon_scale", {"up": 1.0001, "down": 0.9999}),
+    "muonSmear": ("muon_smear", {"up": 0.001}),
+}
+
+# histograms also written for every variation, as {name}_{variation}{Up,Down}
+variedHists = ["cutFlow", "invariant_mass", "cosThetac"]
+
+# columns written by the skim stage, everything build_analysis needs
+skimColumns = ["weight", "event_seed", "muons_p", "muons_theta", "muons_q", "muons_no", "muons_px", "muons_py", "muons_pz", "muons_m",
+               "gen_muons_p", "gen_muons_theta", "gen_muons_phi", "gen_muons_q", "gen_muons_no", "muons_gen_unmatched"]
+
+# early selection (up to CUT 3), can be cached with `runner.py --skim`
+def build_skim(df, hists):
 
     df = df.Define("weight", "1.0")
     weightsum = df.Sum("weight")
+    # seed of the muonSmear variation, from the event number and input file rather than the entry number
+    df = df.Define("event_seed", "FCCAnalyses::event_seed(EventHeader.eventNumber, rdfsampleinfo_.GetSampleName())")
+    cutFlow = CutFlow(cutFlowLabels)
+    hists += [cutFlow, cutFlow.raw]
 
     df = df.Alias("Particle0", "Particle#0.index")
     df = df.Alias("Particle1", "Particle#1.index")
@@ -65,43 +119,48 @@ def build_graph(df, dataset):
 
     # reco muons
     df = df.Define("muons_all", "FCCAnalyses::ReconstructedParticle::get(Muons, ReconstructedParticles)")
-    df = df.Define("muons_all_p", "FCCAnalyses::ReconstructedParticle::get_p(muons_all)")
-    df = df.Define("muons_all_theta", "FCCAnalyses::ReconstructedParticle::get_theta(muons_all)")
-    df = df.Define("muons_all_costheta", "FCCAnalyses::get_costheta(muons_all)")
-    df = df.Define("muons_all_phi", "FCCAnalyses::ReconstructedParticle::get_phi(muons_all)")
-    df = df.Define("muons_all_q", "FCCAnalyses::ReconstructedParticle::get_charge(muons_all)")
-    df = df.Define("muons_all_no", "FCCAnalyses::ReconstructedParticle::get_n(muons_all)")
+    # all muon kinematics in one pass, the columns below are views on its arrays
+    df = df.Define("muons_all_kin", "FCCAnalyses::get_kinematics(muons_all)")
+    df = df.Define("muons_all_p", "muons_all_kin.p()")
+    df = df.Define("muons_all_theta", "muons_all_kin.theta()")
+    df = df.Define("muons_all_costheta", "muons_all_kin.costheta()")
+    df = df.Define("muons_all_phi", "muons_all_kin.phi()")
+    df = df.Define("muons_all_q", "muons_all_kin.q()")
+    df = df.Define("muons_all_no", "muons_all_kin.n")
 
     # define cos(theta) of the muons
     hists.append(df.Histo1D(("muons_all_costheta", "", *bins_cos), "muons_all_costheta"))
-    df = df.Define("muons", "FCCAnalyses::sel_range(0, 0.97, true)(muons_all, muons_all_costheta)")
-    df = df.Define("muons_p", "FCCAnalyses::ReconstructedParticle::get_p(muons)")
-    df = df.Define("muons_theta", "FCCAnalyses::ReconstructedParticle::get_theta(muons)")
-    df = df.Define("muons_no", "FCCAnalyses::ReconstructedParticle::get_n(muons)")
-    df = df.Define("muons_q", "FCCAnalyses::ReconstructedParticle::get_charge(muons)")
+    df = parameters(df, selection, variations, ["costheta_max"])
+    df = df.Define("muons_sel", "FCCAnalyses::sel_range(0, costheta_max, true).mask(muons_all_costheta)")
+    df = df.Define("muons_kin", "FCCAnalyses::get_kinematics(muons_all_kin, muons_sel)")
+    df = df.Define("muons_p", "muons_kin.p()")
+    df = df.Define("muons_theta", "muons_kin.theta()")
+    df = df.Define("muons_no", "muons_kin.n")
+    df = df.Define("muons_q", "muons_kin.q()")
+    df = df.Define("muons_px", "muons_kin.px()")
+    df = df.Define("muons_py", "muons_kin.py()")
+    df = df.Define("muons_pz", "muons_kin.pz()")
+    df = df.Define("muons_m", "muons_kin.m()")
 
 
     #########
     ### CUT 0: all events
     #########
-    df = df.Define("cut0", "0")
-    hists.append(df.Histo1D(("cutFlow", "", *bins_count), "cut0"))
+    cutFlow.add(df, 0)
 
     #########
     ### CUT 1: select at least 1 muon
     #########
     df = df.Filter("muons_no >= 1")
 
-    df = df.Define("cut1", "1")
-    hists.append(df.Histo1D(("cutFlow", "", *bins_count), "cut1"))
+    cutFlow.add(df, 1)
 
     #########
     ### CUT 2: select at least 2 muons
     #########
     df = df.Filter("muons_no >= 2")
 
-    df = df.Define("cut2", "2")
-    hists.append(df.Histo1D(("cutFlow", "", *bins_count), "cut2"))
+    cutFlow.add(df, 2)
 
 
     #########
@@ -109,36 +168,60 @@ def build_graph(df, dataset):
     #########
     df = df.Filter("muons_no == 2 && (muons_q[0] + muons_q[1]) == 0")
 
-    df = df.Define("cut3", "3")
-    hists.append(df.Histo1D(("cutFlow", "", *bins_count), "cut3"))
+    cutFlow.add(df, 3)
+
+    # select the corresponding gen-level muons
+    df = df.Define("muons", "muons_all[muons_sel]")
+    df = df.Define("reco2mc", "FCCAnalyses::getTrack2MC_indices(MCRecoAssociations0, MCRecoAssociations1, ReconstructedParticles)")
+    df = df.Define("muons_gen", "FCCAnalyses::getRP2MC(muons, reco2mc, Particle)")
+    df = df.Define("muons_gen_unmatched", "FCCAnalyses::getRP2MC_unmatched(muons, reco2mc, Particle)")
+    df = df.Define("muons_gen_tlv", "FCCAnalyses::makeLorentzVectors(muons_gen)")
 
+    df = df.Define("gen_muons_p", "FCCAnalyses::MCParticle::get_p(muons_gen)")
+    df = df.Define("gen_muons_theta", "FCCAnalyses::MCParticle::get_theta(muons_gen)")
+    df = df.Define("gen_muons_phi", "FCCAnalyses::MCParticle::get_phi(muons_gen)")
+    df = df.Define("gen_muons_no", "FCCAnalyses::MCParticle::get_n(muons_gen)")
+    df = df.Define("gen_muons_q", "FCCAnalyses::MCParticle::get_charge(muons_gen)")
+
+    return df, weightsum
+
+
+# late selection, only uses the skimColumns
+def build_analysis(df, hists):
+
+    cutFlow = CutFlow(cutFlowLabels)
+    hists += [cutFlow, cutFlow.raw]
+
+    df = parameters(df, selection, variations, ["p_beam", "p_max_norm_min", "muon_scale", "muon_smear"])
+    # muon momentum scale and resolution corrections (factors of 1 for the nominal selection)
+    df = df.Define("muons_p_factors", "FCCAnalyses::momentum_factors(muons_no, muon_scale, muon_smear, event_seed)")
+    df = df.Define("muons_p_corr", "muons_p*muons_p_factors")
 
     #########
     ### CUT 4: max normalized muon momentum > 0.6
     #########
-    df = df.Define("muon_max_p", "(muons_p[0] > muons_p[1]) ? muons_p[0] : muons_p[1]")
-    df = df.Define("muon_max_p_norm", "muon_max_p/45.6")
+    df = df.Define("muon_max_p", "(muons_p_corr[0] > muons_p_corr[1]) ? muons_p_corr[0] : muons_p_corr[1]")
+    df = df.Define("muon_max_p_norm", "muon_max_p/p_beam")
     hists.append(df.Histo1D(("muon_max_p_norm", "", *bins_norm), "muon_max_p_norm"))
-    df = df.Filter("muon_max_p_norm > 0.6")
+    df = df.Filter("muon_max_p_norm > p_max_norm_min")
 
-    df = df.Define("cut4", "4")
-    hists.append(df.Histo1D(("cutFlow", "", *bins_count), "cut4"))
+    cutFlow.add(df, 4)
 
 
     #########
     ### CUT 5: acolinearity < 15 degrees
     #########
     # acolinearity between 2 muons
-    df = df.Define("acolinearity", "FCCAnalyses::acolinearity(muons)")
+    df = df.Define("acolinearity", "FCCAnalyses::acolinearity(muons_px, muons_py, muons_pz)")
     hists.append(df.Histo1D(("acolinearity", "", *bins_aco), "acolinearity"))
-    df = df.Filter("acolinearity < 0.261799388")
+    df = parameters(df, selection, variations, ["acolinearity_max"])
+    df = df.Filter("acolinearity < acolinearity_max")
 
-    df = df.Define("cut5", "5")
-    hists.append(df.Histo1D(("cutFlow", "", *bins_count), "cut5"))
+    cutFlow.add(df, 5)
 
     ############################################################################
     # plot invariant mass of both muons
-    df = df.Define("leps_tlv", "FCCAnalyses::makeLorentzVectors(muons)")
+    df = df.Define("leps_tlv", "FCCAnalyses::makeLorentzVectorsPxPyPzM(muons_px*muons_p_factors, muons_py*muons_p_factors, muons_pz*muons_p_factors, muons_m)")
     df = df.Define("invariant_mass", "(leps_tlv[0]+leps_tlv[1]).M()")
     hists.append(df.Histo1D(("invariant_mass", "", *bins_m_ll), "invariant_mass"))
 
@@ -156,20 +239,13 @@ def build_graph(df, dataset):
     hists.append(df.Histo1D(("cos_theta_plus", "", *bins_cos), "cos_theta_plus"))
     hists.append(df.Histo1D(("cos_theta_minus", "", *bins_cos), "cos_theta_minus"))
     hists.append(df.Histo1D(("cosThetac", "", *bins_cos), "cosThetac"))
+    # per-event moments for the unbinned A_FB estimators, independent of bins_cos
+    hists.append(book_moments(df, "cosThetac", afbWindows))
 
 
 
-    # do gen-level analysis
-
-    # select the corresponding gen-level muons
-    df = df.Define("muons_gen", "FCCAnalyses::getRP2MC(muons, MCRecoAssociations0, MCRecoAssociations1, ReconstructedParticles, Particle)")
-    df = df.Define("muons_gen_tlv", "FCCAnalyses::makeLorentzVectors(muons_gen)")
-
-    df = df.Define("gen_muons_p", "FCCAnalyses::MCParticle::get_p(muons_gen)")
-    df = df.Define("gen_muons_theta", "FCCAnalyses::MCParticle::get_theta(muons_gen)")
-    df = df.Define("gen_muons_phi", "FCCAnalyses::MCParticle::get_phi(muons_gen)")
-    df = df.Define("gen_muons_no", "FCCAnalyses::MCParticle::get_n(muons_gen)")
-    df = df.Define("gen_muons_q", "FCCAnalyses::MCParticle::get_charge(muons_gen)")
+    # do gen-level analysis (gen-level muons are selected in build_skim)
+    hists.append(df.Histo1D(("muons_gen_unmatched", "", *bins_count), "muons_gen_unmatched"))
 
     # calculate the angles (gen)
     df = df.Define("gen_theta_plus", "(gen_muons_q[0] > 0) ? gen_muons_theta[0] : gen_muons_theta[1]")
@@ -183,6 +259,16 @@ def build_graph(df, dataset):
     hists.append(df.Histo1D(("gen_cos_theta_plus", "", *bins_cos), "gen_cos_theta_plus"))
     hists.append(df.Histo1D(("gen_cos_theta_minus", "", *bins_cos), "gen_cos_theta_minus"))
     hists.append(df.Histo1D(("gen_cosThetac", "", *bins_cos), "gen_cosThetac"))
+    hists.append(book_moments(df, "gen_cosThetac", afbWindows))
+
+    if bookResponse:
+        hists.append(df.Histo2D(("cosThetac_response", "", *bins_cos, *bins_cos), "gen_cosThetac", "cosThetac"))
 
 
+def build_graph(df, dataset):
+
+    hists = []
+    df, weightsum = build_skim(df, hists)
+    build_analysis(df, hists)
+
     return hists, weightsum
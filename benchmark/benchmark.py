@@ -0,0 +1,210 @@
+"""
+Throughput benchmarks of the analysis modules and of the functions.h kernels,
+on the synthetic samples written by generate.py.
+
+For every thread count, a separate process:
+  - runs z_mumu_xsec.py and z_mumu_afb.py with functions/runner.py on the
+    generated samples (inputDir, procDict and outputDir are overridden), and
+    reports the events per second of the whole run,
+  - evaluates every kernel on the generated Z->mumu events in one event loop
+    profiled with functions/profiling.py, and reports the time per event of
+    each kernel (summed over threads) and the corresponding events per second.
+
+    python benchmark/generate.py --outDir /tmp/fccbench
+    python benchmark/benchmark.py --inputDir /tmp/fccbench --threads 1 4 8 --out results.json
+    python benchmark/benchmark.py --inputDir /tmp/fccbench --threads 1 4 8 --baseline results.json
+
+With --baseline, the events per second are compared to a previous results
+file and the exit code is 1 if any of them dropped by more than --tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+baseDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(baseDir, "../functions"))
+
+modules = ["../03_CrossSection/z_mumu_xsec.py", "../04_FBAsymmetry/z_mumu_afb.py"]
+
+# columns the kernels read, on top of the input branches
+inputs = [
+    ("Muons", "Muon#0.index"),
+    ("MCRecoAssociations0", "MCRecoAssociations#0.index"),
+    ("MCRecoAssociations1", "MCRecoAssociations#1.index"),
+    ("muons_all", "FCCAnalyses::ReconstructedParticle::get(Muons, ReconstructedParticles)"),
+    ("muons_all_kin", "FCCAnalyses::get_kinematics(muons_all)"),
+    ("muons_all_costheta", "muons_all_kin.costheta()"),
+    ("reco2mc", "FCCAnalyses::getTrack2MC_indices(MCRecoAssociations0, MCRecoAssociations1, ReconstructedParticles)"),
+    ("event_seed", "FCCAnalyses::event_seed(EventHeader.eventNumber, rdfsampleinfo_.GetSampleName())"),
+]
+
+kernels = {
+    "makeLorentzVectors": "FCCAnalyses::makeLorentzVectors(ReconstructedParticles)",
+    "get_kinematics": "FCCAnalyses::get_kinematics(muons_all)",
+    "sel_range": "FCCAnalyses::sel_range(0, 0.97, true)(muons_all, muons_all_costheta)",
+    "sel_range_mask": "FCCAnalyses::sel_range(0, 0.97, true).mask(muons_all_costheta)",
+    "acolinearity": "FCCAnalyses::acolinearity(muons_all)",
+    "acoplanarity": "FCCAnalyses::acoplanarity(muons_all)",
+    "visibleEnergy": "FCCAnalyses::visibleEnergy(ReconstructedParticles)",
+    "missingEnergy": "FCCAnalyses::missingEnergy(91.2, ReconstructedParticles)",
+    "visibleMass": "FCCAnalyses::visibleMass(ReconstructedParticles)",
+    "missingMass": "FCCAnalyses::missingMass(91.2, ReconstructedParticles)",
+    "energy_imbalance": "FCCAnalyses::energy_imbalance(ReconstructedParticles)",
+    "eventSummary": "FCCAnalyses::eventSummary(91.2, ReconstructedParticles)",
+    "getTrack2MC_indices": "FCCAnalyses::getTrack2MC_indices(MCRecoAssociations0, MCRecoAssociations1, ReconstructedParticles)",
+    "getRP2MC": "FCCAnalyses::getRP2MC(muons_all, reco2mc, Particle)",
+    "momentum_factors": "FCCAnalyses::momentum_factors(muons_all_kin.n, 1.0001, 0.001, event_seed)",
+    "coneIsolation": "FCCAnalyses::coneIsolation(0.01, 0.5)(muons_all, ReconstructedParticles)",
+    "resonanceBuilder_pairs": "FCCAnalyses::resonanceBuilder_pairs(91.2, 0, 0, 91.2, false)(muons_all, reco2mc, Particle)",
+}
+
+
+def load_samples(inputDir):
+    with open(f"{inputDir}/samplesDict.json") as f:
+        return json.load(f)
+
+
+def bench_module(path, inputDir, threads):
+    import runner
+
+    samples = load_samples(inputDir)
+    module = runner.load_module(os.path.join(baseDir, path))
+    procs = [proc for proc in module.processList if proc in samples]
+    if not procs:
+        raise RuntimeError(f"No generated sample for {module.__name__}, run generate.py with {list(module.processList)}")
+    module.processList = {proc: {"fraction": 1} for proc in procs}
+    module.inputDir = inputDir
+    module.procDict = f"{inputDir}/samplesDict.json"
+    module.nCPUS = threads
+    with tempfile.TemporaryDirectory() as tmpDir:
+        module.outputDir = tmpDir
+        start = time.perf_counter()
+        runner.run([module])
+        elapsed = time.perf_counter() - start
+    nEvents = sum(samples[proc]["numberOfEvents"] for proc in procs)
+    return {"events": nEvents, "time": elapsed, "events_per_s": nEvents/elapsed}
+
+
+def bench_kernels(inputDir, threads, proc):
+    import ROOT
+    import runner
+    from rdfgraph import Graph
+    from profiling import Profiler
+
+    module = runner.load_module(os.path.join(baseDir, modules[0]))
+    module.nCPUS = threads
+    runner.setup_root([module])
+
+    df = ROOT.RDataFrame("events", runner.get_files(inputDir, proc))
+    graph = Graph(df, Profiler(df.GetNSlots()))
+    node = graph.root
+    for name, expr in inputs:
+        node = node.Alias(name, expr) if "#" in expr else node.Define(name, expr)
+    for name, expr in kernels.items():
+        node = node.Define(f"bench_{name}", expr)
+    # all filters pass, they only force the evaluation of every kernel in every event
+    for name in kernels:
+        node = node.Filter(f"((void)bench_{name}, true)")
+    count = node.Count()
+    graph.materialize()
+
+    start = time.perf_counter()
+    nEvents = count.GetValue()
+    elapsed = time.perf_counter() - start
+
+    report = graph.profiler.report()
+    results = {"events": nEvents, "time": elapsed, "events_per_s": nEvents/elapsed, "kernels": {}}
+    for entry in report["nodes"]:
+        if entry["op"] != "Define" or not entry["label"].startswith("Define bench_"):
+            continue
+        ns = entry["time"]*1e9/max(entry["events_in"], 1)
+        results["kernels"][entry["label"][len("Define bench_"):]] = {"ns_per_event": ns, "events_per_s": 1e9/ns if ns > 0 else None}
+    return results
+
+
+def worker(args):
+    # one thread count, in its own process as the ROOT thread pool is set once per process
+    results = {"modules": {}, "kernels": None}
+    for path in modules:
+        name = os.path.splitext(os.path.basename(path))[0]
+        results["modules"][name] = bench_module(path, args.inputDir, args.worker)
+    results["kernels"] = bench_kernels(args.inputDir, args.worker, args.kernelSample)
+    print("RESULT " + json.dumps(results))
+
+
+def flatten(results):
+    # events per second keyed on "module/{name}/{threads}", "loop/{threads}" and "kernel/{name}/{threads}"
+    flat = {}
+    for threads, res in results["threads"].items():
+        for name, r in res["modules"].items():
+            flat[f"module/{name}/{threads}"] = r["events_per_s"]
+        flat[f"loop/{threads}"] = res["kernels"]["events_per_s"]
+        for name, r in res["kernels"]["kernels"].items():
+            flat[f"kernel/{name}/{threads}"] = r["events_per_s"]
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    print(f"{'benchmark':<40} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for key in sorted(current):
+        if key not in previous or not previous[key] or not current[key]:
+            continue
+        ratio = current[key]/previous[key]
+        flag = ""
+        if ratio < 1 - tolerance:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key:<40} {previous[key]:>12.4g} {current[key]:>12.4g} {ratio:>7.2f}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputDir", type=str, required=True, help="Directory with the samples of generate.py")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4], help="Thread counts")
+    parser.add_argument("--kernelSample", type=str, default="wzp6_ee_mumu_ecm91p2", help="Sample used for the kernel benchmarks")
+    parser.add_argument("--out", type=str, default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=str, default=None, help="Results of a previous run to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative drop of the events per second")
+    parser.add_argument("--worker", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.inputDir = os.path.abspath(args.inputDir)
+
+    if args.worker is not None:
+        worker(args)
+        sys.exit(0)
+
+    results = {"inputDir": args.inputDir, "samples": load_samples(args.inputDir), "threads": {}}
+    for threads in args.threads:
+        cmd = [sys.executable, os.path.abspath(__file__), "--inputDir", args.inputDir, "--kernelSample", args.kernelSample, "--worker", str(threads)]
+        out = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, check=True).stdout
+        res = json.loads([l for l in out.splitlines() if l.startswith("RESULT ")][-1][len("RESULT "):])
+        results["threads"][str(threads)] = res
+
+        print(f"--> {threads} thread(s)")
+        for name, r in res["modules"].items():
+            print(f"    {name:<28} {r['events_per_s']:>12.0f} events/s")
+        print(f"    {'kernel loop':<28} {res['kernels']['events_per_s']:>12.0f} events/s")
+        for name, r in sorted(res["kernels"]["kernels"].items(), key=lambda x: -x[1]["ns_per_event"]):
+            print(f"      {name:<26} {r['ns_per_event']:>10.1f} ns/event")
+
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=1)
+        print(f"--> written {args.out}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"--> {len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("--> no regressions")
@@ -0,0 +1,70 @@
+"""
+Generate synthetic EDM4hep-style samples for the benchmarks (see generator.h).
+
+The samples carry the names used by the tutorial analyses, and a
+samplesDict.json with their metadata is written next to them, so the analysis
+modules run unchanged on the generated inputDir:
+
+    python benchmark/generate.py --outDir /tmp/fccbench --events 200000 --files 4
+"""
+
+import os
+import json
+import argparse
+
+import ROOT
+
+ROOT.gROOT.SetBatch(True)
+
+# sample name: (process of the generator, cross-section in pb)
+samples = {
+    "wzp6_ee_mumu_ecm91p2": ("mumu", 1462.09),
+    "kkmcee_ee_mumu_ecm91p2": ("mumu", 1521.5),
+    "p8_ee_Zmumu_ecm91": ("mumu", 1462.09),
+    "wzp6_ee_tautau_ecm91p2": ("tautau", 1476.58),
+    "p8_ee_gaga_mumu_ecm91p2": ("gaga", 1.5),
+}
+
+
+def generate(outDir, proc, nEvents, nFiles, seed, cfg):
+    process, xsec = samples[proc]
+    os.makedirs(f"{outDir}/{proc}", exist_ok=True)
+    for i in range(nFiles):
+        gen = ROOT.FCCBenchmark.Generator(process, seed*1000 + i)
+        gen.ecm, gen.afb, gen.nExtra, gen.resolution = cfg["ecm"], cfg["afb"], cfg["nExtra"], cfg["resolution"]
+        n = nEvents // nFiles + (1 if i < nEvents % nFiles else 0)
+        gen.write(f"{outDir}/{proc}/events_{i:03d}.root", n)
+    print(f"--> {proc}: {nEvents} events in {nFiles} files")
+    return {"numberOfEvents": nEvents, "sumOfWeights": nEvents, "crossSection": xsec, "kfactor": 1.0, "matchingEfficiency": 1.0}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--outDir", type=str, required=True, help="Output directory, used as inputDir of the analyses")
+    parser.add_argument("--procs", type=str, nargs="+", default=list(samples), choices=list(samples), help="Samples to generate")
+    parser.add_argument("--events", type=int, default=100000, help="Number of events per sample")
+    parser.add_argument("--files", type=int, default=4, help="Number of files per sample")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument("--ecm", type=float, default=91.2, help="Center-of-mass energy (GeV)")
+    parser.add_argument("--afb", type=float, default=0.02, help="Forward-backward asymmetry of the generated pairs")
+    parser.add_argument("--nExtra", type=float, default=3, help="Mean number of additional soft particles per event")
+    parser.add_argument("--resolution", type=float, default=1e-3, help="Relative momentum resolution")
+    args = parser.parse_args()
+
+    ROOT.gSystem.Load("libedm4hep")
+    header = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generator.h")
+    if not ROOT.gInterpreter.Declare(f'#include "{header}"'):
+        raise RuntimeError(f"Cannot include {header}")
+
+    cfg = {"ecm": args.ecm, "afb": args.afb, "nExtra": args.nExtra, "resolution": args.resolution}
+    procDict = {}
+    for i, proc in enumerate(args.procs):
+        procDict[proc] = generate(args.outDir, proc, args.events, args.files, args.seed + i, cfg)
+
+    # merge with the metadata of previously generated samples
+    path = f"{args.outDir}/samplesDict.json"
+    if os.path.isfile(path):
+        with open(path) as f:
+            procDict = {**json.load(f), **procDict}
+    with open(path, "w") as f:
+        json.dump(procDict, f, indent=4)
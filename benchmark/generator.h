@@ -0,0 +1,155 @@
+#ifndef FCCBenchmarkGenerator_H
+#define FCCBenchmarkGenerator_H
+
+#include <cmath>
+#include <random>
+#include <string>
+#include <vector>
+
+#include "TFile.h"
+#include "TTree.h"
+#include "edm4hep/EventHeaderData.h"
+#include "edm4hep/MCParticleData.h"
+#include "edm4hep/ReconstructedParticleData.h"
+#include "podio/ObjectID.h"
+
+namespace FCCBenchmark {
+
+// synthetic events with the collections read by the tutorial analyses:
+//   EventHeader (event numbers, from 0 in every file), ReconstructedParticles, Muon#0 (ObjectIDs of the reco muons),
+//   MCRecoAssociations#0/#1 (reco/MC indices), Particle (stable MC particles), Particle#0/#1 (parents/daughters, left empty)
+// processes: "mumu" (Z->mumu with ISR and A_FB), "tautau" (Z->tautau, muonic or pionic tau decays)
+// and "gaga" (low-mass forward muon pairs); on top, nExtra (Poisson mean) soft pions and photons per event
+struct Generator {
+
+    std::string process;
+    float ecm = 91.2;
+    float afb = 0.02;
+    float nExtra = 3;
+    float resolution = 1e-3;  // relative momentum resolution
+    float acceptance = 0.99;  // |cos(theta)| of the tracker
+
+    std::mt19937_64 rng;
+    std::uniform_real_distribution<double> uniform{0., 1.};
+    std::normal_distribution<double> gauss{0., 1.};
+
+    std::vector<edm4hep::EventHeaderData> header{1};
+    std::vector<edm4hep::ReconstructedParticleData> reco;
+    std::vector<edm4hep::MCParticleData> mc;
+    std::vector<podio::ObjectID> muons, assocReco, assocMC, parents, daughters;
+
+    Generator(std::string arg_process, unsigned long seed) : process(arg_process), rng(seed) {};
+
+    // cos(theta) distributed as 3(1+c^2)/8 + afb*c
+    double costheta() {
+        while(true) {
+            double c = 2*uniform(rng) - 1;
+            if(uniform(rng)*(0.75 + std::abs(afb)) < 3*(1 + c*c)/8 + afb*c) return c;
+        }
+    }
+
+    void add(int pdg, float charge, double mass, double p, double c, double phi) {
+        double s = std::sqrt(1 - c*c);
+        edm4hep::MCParticleData g;
+        g.PDG = pdg;
+        g.generatorStatus = 1;
+        g.charge = charge;
+        g.mass = mass;
+        g.momentum.x = p*s*std::cos(phi);
+        g.momentum.y = p*s*std::sin(phi);
+        g.momentum.z = p*c;
+        mc.push_back(g);
+
+        if(std::abs(c) > acceptance || p < 0.1) return;
+        double pr = p*(1 + resolution*gauss(rng));
+        edm4hep::ReconstructedParticleData r;
+        r.type = pdg;
+        r.charge = charge;
+        r.mass = mass;
+        r.momentum.x = pr*s*std::cos(phi);
+        r.momentum.y = pr*s*std::sin(phi);
+        r.momentum.z = pr*c;
+        r.energy = std::sqrt(pr*pr + mass*mass);
+        int index = reco.size();
+        reco.push_back(r);
+
+        podio::ObjectID id;
+        id.collectionID = 0;
+        id.index = index;
+        assocReco.push_back(id);
+        id.index = mc.size() - 1;
+        assocMC.push_back(id);
+        if(std::abs(pdg) == 13) {
+            id.index = index;
+            muons.push_back(id);
+        }
+    }
+
+    // back-to-back pair of fermions (pdg of the negative one), after initial-state radiation
+    void pair(int pdg, double mass, double p, double c, double phi) {
+        add(pdg, -1, mass, p, c, phi);
+        add(-pdg, 1, mass, p, -c, phi + M_PI);
+    }
+
+    void tau_decay(float charge, double p, double c, double phi) {
+        // muonic (17%) or single charged pion, with a fraction of the tau momentum and a small opening angle
+        bool muonic = uniform(rng) < 0.174;
+        double z = muonic ? uniform(rng) : 0.2 + 0.8*uniform(rng);
+        double cd = std::max(-1., std::min(1., c + 0.02*gauss(rng)));
+        if(muonic) add(charge < 0 ? 13 : -13, charge, 0.10566, z*p, cd, phi + 0.02*gauss(rng));
+        else add(charge < 0 ? -211 : 211, charge, 0.13957, z*p, cd, phi + 0.02*gauss(rng));
+    }
+
+    void event() {
+        reco.clear(); mc.clear(); muons.clear(); assocReco.clear(); assocMC.clear();
+        double phi = 2*M_PI*uniform(rng);
+        double isr = (uniform(rng) < 0.2) ? 0.3*std::pow(uniform(rng), 2) : 0.;
+        double e = ecm/2*(1 - isr);
+        if(process == "mumu") {
+            pair(13, 0.10566, std::sqrt(e*e - 0.10566*0.10566), costheta(), phi);
+        }
+        else if(process == "tautau") {
+            double p = std::sqrt(e*e - 1.777*1.777);
+            double c = costheta();
+            tau_decay(-1, p, c, phi);
+            tau_decay(1, p, -c, phi + M_PI);
+        }
+        else if(process == "gaga") {
+            double c = (1 - 0.05*std::abs(gauss(rng)))*(uniform(rng) < 0.5 ? 1 : -1);
+            add(13, -1, 0.10566, ecm/2*(0.02 + 0.3*uniform(rng)), c, phi);
+            add(-13, 1, 0.10566, ecm/2*(0.02 + 0.3*uniform(rng)), -c, phi + M_PI + 0.3*gauss(rng));
+        }
+        std::poisson_distribution<int> extra(nExtra);
+        for(int i = extra(rng); i > 0; --i) {
+            double r = uniform(rng);
+            int pdg = (r < 0.4) ? 22 : (r < 0.7) ? 211 : -211;
+            add(pdg, (pdg == 22) ? 0 : (pdg > 0 ? 1 : -1), (pdg == 22) ? 0 : 0.13957, -std::log(1 - uniform(rng)), 2*uniform(rng) - 1, 2*M_PI*uniform(rng));
+        }
+    }
+
+    // write nEvents events to the tree "events" of path
+    long write(const std::string & path, long nEvents) {
+        TFile fOut(path.c_str(), "RECREATE");
+        TTree tree("events", "events");
+        tree.Branch("EventHeader", &header);
+        tree.Branch("ReconstructedParticles", &reco);
+        tree.Branch("Muon#0", &muons);
+        tree.Branch("MCRecoAssociations#0", &assocReco);
+        tree.Branch("MCRecoAssociations#1", &assocMC);
+        tree.Branch("Particle", &mc);
+        tree.Branch("Particle#0", &parents);
+        tree.Branch("Particle#1", &daughters);
+        for(long i = 0; i < nEvents; ++i) {
+            header[0].eventNumber = i;
+            event();
+            tree.Fill();
+        }
+        tree.Write();
+        fOut.Close();
+        return nEvents;
+    }
+};
+
+}
+
+#endif
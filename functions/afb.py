@@ -0,0 +1,162 @@
+"""
+Forward-backward asymmetry from cos(theta) histograms, with NumPy.
+
+The angular distribution is fitted with the model
+
+    y(x) = p0 * (3(1+x^2)/8 + p1*x)
+
+as in 04_FBAsymmetry/analysis.py, with A_FB = p1. The model is linear in
+a = p0 and b = p0*p1, so the chi2 fit with bin errors sqrt(y) is solved
+exactly by weighted least squares (weights 1/y), and the error on
+A_FB = b/a follows from the covariance of (a, b). Empty bins are skipped, as
+they have no error.
+
+All functions work on arrays of histograms: the bin contents are along the
+last axis and any leading axes (processes, luminosities, ...) are fitted in
+one go, e.g.
+
+    values, edges = store.stack("cosThetac", procs)           # (nproc, nbins)
+    res = fit(values[:, None] * np.array([44.84, 100e6])[:, None], edges, window=(0, 0.9))
+    res["afb"], res["afb_err"]                                 # (nproc, nlumi)
+"""
+
+import numpy as np
+
+
+def centers(edges):
+    edges = np.asarray(edges, dtype=np.float64)
+    return 0.5*(edges[1:] + edges[:-1])
+
+
+def rebin(values, edges, factor):
+    # merge groups of factor bins along the last axis (trailing bins that do not fill a group are dropped)
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[-1] // factor * factor
+    values = values[..., :n].reshape(values.shape[:-1] + (n//factor, factor)).sum(axis=-1)
+    return values, np.asarray(edges)[:n+1:factor]
+
+
+def window_mask(edges, window):
+    # bins with the bin center inside the |cos(theta)| window
+    x = np.abs(centers(edges))
+    return (x >= window[0]) & (x <= window[1])
+
+
+# per-bin terms of the counting and of the normal equations of the fit
+MOMENTS = ("N_F", "N_B", "Sff", "Sfx", "Sxx", "Sfy", "Sxy", "Sy", "n")
+
+
+def moments(values, edges):
+    # per-bin moments, shape values.shape + (len(MOMENTS),); sums over any set of bins give the
+    # inputs of the counting and of the fit on those bins (empty bins do not enter the fit)
+    values = np.asarray(values, dtype=np.float64)
+    x = centers(edges)
+    f = 3*(1 + x*x)/8
+    use = values > 0
+    with np.errstate(divide="ignore"):
+        w = np.where(use, 1/values, 0)
+    # sum(w*y*f) = sum(f) over the used bins since w = 1/y, and likewise sum(w*y*y) = sum(y)
+    return np.stack([values*(x >= 0), values*(x < 0), w*f*f, w*f*x, w*x*x, use*f, use*x, values, use*1.], axis=-1)
+
+
+def solve(M):
+    # counting and fitted A_FB from summed moments M[..., len(MOMENTS)]
+    N_F, N_B, Sff, Sfx, Sxx, Sfy, Sxy, Sy, n = np.moveaxis(M, -1, 0)
+    N = N_F + N_B
+    det = Sff*Sxx - Sfx*Sfx
+    with np.errstate(divide="ignore", invalid="ignore"):
+        count = {"afb": (N_F - N_B)/N, "afb_err": np.sqrt(4*N_F*N_B/N**3), "N_F": N_F, "N_B": N_B}
+        a = (Sxx*Sfy - Sfx*Sxy) / det
+        b = (Sff*Sxy - Sfx*Sfy) / det
+        cov = np.stack([np.stack([Sxx, -Sfx], axis=-1), np.stack([-Sfx, Sff], axis=-1)], axis=-2) / det[..., None, None]
+        afb = b / a
+        # error propagation of b/a
+        afb_err = np.sqrt(cov[..., 1, 1]/a**2 + b**2*cov[..., 0, 0]/a**4 - 2*b*cov[..., 0, 1]/a**3)
+        chi2 = Sy - 2*(a*Sfy + b*Sxy) + a*a*Sff + 2*a*b*Sfx + b*b*Sxx
+    fit = {"afb": afb, "afb_err": afb_err, "norm": a, "params": np.stack([a, b], axis=-1), "cov": cov, "chi2": chi2, "ndf": n - 2}
+    return count, fit
+
+
+def counting(values, edges, window=(0, 1)):
+    # A_FB = (N_F-N_B)/(N_F+N_B) with the binomial error, per histogram
+    return solve((moments(values, edges) * window_mask(edges, window)[:, None]).sum(axis=-2))[0]
+
+
+def fit(values, edges, window=(0, 1)):
+    # closed-form weighted least squares fit of the model, per histogram
+    return solve((moments(values, edges) * window_mask(edges, window)[:, None]).sum(axis=-2))[1]
+
+
+def window_scan(values, edges, bounds):
+    # counting and fit for all windows bounds[i] <= |cos(theta)| <= bounds[j] with i < j.
+    # The bins are ordered by |x| and the moments accumulated, so each window is the difference
+    # of two prefix sums. Returns (count, fit) with arrays of shape values.shape[:-1] + (nb, nb),
+    # the windows with i >= j are NaN.
+    bounds = np.asarray(bounds, dtype=np.float64)
+    absx = np.abs(centers(edges))
+    order = np.argsort(absx, kind="stable")
+    M = np.take(moments(values, edges), order, axis=-2)
+    C = np.concatenate([np.zeros_like(M[..., :1, :]), np.cumsum(M, axis=-2)], axis=-2)
+    lo = np.searchsorted(absx[order], bounds, side="left")
+    hi = np.searchsorted(absx[order], bounds, side="right")
+    W = C[..., hi[None, :], :] - C[..., lo[:, None], :]
+    valid = bounds[:, None] < bounds[None, :]
+    W = np.where(valid[..., None], W, np.nan)
+    return solve(W)
+
+
+def scan(values, edges, lumis=(1,), rebins=(1,), window=(0, 1)):
+    # counting and fitted A_FB for all luminosities and rebin factors,
+    # returns {rebin: (counting, fit)} with result arrays of shape values.shape[:-1] + (len(lumis),)
+    values = np.asarray(values, dtype=np.float64)
+    lumis = np.asarray(lumis, dtype=np.float64)
+    results = {}
+    for factor in rebins:
+        v, e = rebin(values, edges, factor)
+        v = v[..., None, :] * lumis[:, None]
+        results[factor] = solve((moments(v, e) * window_mask(e, window)[:, None]).sum(axis=-2))
+    return results
+
+
+# unbinned estimators, from the moments accumulated in the event loop by FCCAnalyses::afb_moments:
+# per |cos(theta)| window [N_F, N_B, sum c, sum c^2, sum t^1 .. sum t^order] with t = c/(3(1+c^2)/8)
+
+def book_moments(df, column, windows, order=10, weight="weight", name=None):
+    # book the moments histogram of column (e.g. cosThetac) on the node df
+    name = f"{column}_moments" if name is None else name
+    moments = f"FCCAnalyses::afb_moments({{{', '.join(str(w) for w in windows)}}}, {order})"
+    n = len(windows)*(4 + order)
+    df = df.Define(f"{name}_index", f"{moments}.index()")
+    df = df.Define(f"{name}_weights", f"{moments}({column}, {weight})")
+    return df.Histo1D((name, "", n, 0, n), f"{name}_index", f"{name}_weights")
+
+
+def unbinned(values, windows, order=10, iterations=20):
+    # counting, method-of-moments and unbinned maximum likelihood A_FB per window,
+    # values: (..., len(windows)*(4+order)) contents of the moments histogram
+    values = np.asarray(values, dtype=np.float64)
+    v = values.reshape(values.shape[:-1] + (len(windows), 4 + order))
+    N_F, N_B, S1, S2, T = v[..., 0], v[..., 1], v[..., 2], v[..., 3], v[..., 4:]
+    m = np.asarray(windows, dtype=np.float64)
+    N = N_F + N_B
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        count = {"afb": (N_F - N_B)/N, "afb_err": np.sqrt(4*N_F*N_B/N**3), "N_F": N_F, "N_B": N_B}
+
+        # <c> = A * int(c^2) / int(3(1+c^2)/8) over the window
+        scale = 3*(2*m + 2*m**3/3)/8 / (2*m**3/3)
+        mean = S1/N
+        moments = {"afb": scale*mean, "afb_err": scale*np.sqrt((S2/N - mean**2)/N)}
+
+        # log L(A) = sum log(1 + A t) = sum_k (-1)^(k+1) A^k T_k / k, maximized with Newton's method
+        # (the series converges for |A| < 3/4, and is exact up to O((4A/3)^(order+1)))
+        k = np.arange(1, order + 1)
+        sign = (-1.)**(k + 1)
+        A = moments["afb"]
+        for i in range(iterations):
+            powers = A[..., None]**np.maximum(k - 2, 0)
+            d1 = (sign*A[..., None]**(k - 1)*T).sum(axis=-1)
+            d2 = (sign*(k - 1)*powers*T).sum(axis=-1)
+            A = A - d1/d2
+        likelihood = {"afb": A, "afb_err": np.sqrt(-1/d2)}
+    return count, moments, likelihood
@@ -0,0 +1,388 @@
+"""
+Columnar backend for the Z->mumu selection of z_mumu_xsec.py and z_mumu_afb.py.
+
+The selection (reco muons, |cos(theta)| acceptance, opposite-sign pair,
+muon_max_p_norm and acolinearity cuts, cos(theta_c)) is computed with NumPy
+on chunks of the input trees read with uproot, so nothing is JIT-compiled.
+Chunks are processed by a pool of processes.
+
+The histograms to fill, their binning and the cut after which each one is
+filled are taken from the module itself: build_graph is recorded on a Graph
+(see rdfgraph.py) without an RDataFrame behind it. Histograms of columns the
+backend does not compute (gen-level, unbinned moments, response matrix) and
+the systematic variations are skipped. The output/{proc}.root files have the
+layout of the runner (histograms, eventsProcessed, crossSection, ...).
+
+The float arithmetic of functions.h and of the module expressions is
+reproduced. The math functions are evaluated with NumPy in double, which can
+differ in the last bit from the C math library ones (atan2f, cosf, sinf, acos)
+used by the compiled code: values close to a bin edge or a cut are computed
+again with the C math library, so the bin contents match the RDataFrame ones
+exactly (the means and RMS can differ in the last digits). --compare checks
+the contents against an RDF output:
+
+    cd 03_CrossSection
+    python ../functions/columnar.py z_mumu_xsec.py -j 16 --outputDir output_columnar/ --compare output/
+"""
+
+import os
+import math
+import time
+import ctypes
+import argparse
+import functools
+import ctypes.util
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from rdfgraph import Graph
+from cutflow import CutFlow, RawCounts
+
+BRANCHES = ["ReconstructedParticles.momentum.x", "ReconstructedParticles.momentum.y", "ReconstructedParticles.momentum.z",
+            "ReconstructedParticles.mass", "ReconstructedParticles.charge", "Muon#0.index"]
+
+# the filters of the modules, in order: a histogram below k of them is filled for the events passing cuts 1..k
+CUTS = ["muons_no >= 1", "muons_no >= 2", "muons_no == 2 && (muons_q[0] + muons_q[1]) == 0",
+        "muon_max_p_norm > p_max_norm_min", "acolinearity < acolinearity_max"]
+
+# columns computed by the backend: per muon (before the acceptance) or per event
+MUON_COLUMNS = ["muons_all_costheta"]
+ANGLE_COLUMNS = ["theta_plus", "theta_minus", "cos_theta_plus", "cos_theta_minus", "cosThetac"]
+EVENT_COLUMNS = ["muon_max_p_norm", "acolinearity", "invariant_mass"] + ANGLE_COLUMNS
+
+# nominal selection, overridden by the selection dict of the module
+DEFAULTS = {"costheta_max": 0.97, "p_beam": 45.6, "p_max_norm_min": 0.6, "acolinearity_max": 0.261799388}
+
+
+def stage(node):
+    # number of cuts above node, the filters must be the CUTS of the backend
+    filters = []
+    parent = node.parent
+    while parent is not None:
+        if parent.op == "Filter":
+            filters.append(parent.args[0])
+        parent = parent.parent
+    filters = filters[::-1]
+    if filters != CUTS[:len(filters)]:
+        raise NotImplementedError(f"Selection not supported by the columnar backend: {filters}")
+    return len(filters)
+
+
+def booking(module, proc):
+    # (name, title, nbins, xmin, xmax, column, stage) of the supported histograms and (name, labels, cuts, raw) of the
+    # cut flows, raw if their raw counts are booked as well
+    hists, cutflows, raws = [], [], set()
+    graph = Graph(None)
+    for h in module.build_graph(graph.root, proc)[0]:
+        if isinstance(h, CutFlow):
+            cuts = {cut: stage(s) for cut, s in h.stats.items()}
+            if any(cut != st for cut, st in cuts.items()):
+                raise NotImplementedError(f"Cut flow {h.name} does not follow the selection of the columnar backend")
+            cutflows.append((h.name, h.labels, sorted(cuts)))
+        elif isinstance(h, RawCounts):
+            raws.add(h.cutFlow.name)
+        elif h.op == "Histo1D" and len(h.args) == 2 and isinstance(h.args[0], tuple) and h.args[1] in MUON_COLUMNS + EVENT_COLUMNS:
+            hists.append((*h.args[0], h.args[1], stage(h)))
+        else:
+            print(f"--> {module.__name__}: {h.GetName()} is not computed by the columnar backend, skipped")
+    return hists, [(name, labels, cuts, name in raws) for name, labels, cuts in cutflows]
+
+
+def fill(x, nbins, xmin, xmax):
+    # contents (with under/overflow) and statistics of a unit-weight TH1D filled with x, bins as TAxis::FindBin
+    x = np.asarray(x, dtype=np.float64)
+    bins = np.full(len(x), nbins + 1, dtype=np.int64)
+    bins[x < xmin] = 0
+    inside = (x >= xmin) & (x < xmax)
+    bins[inside] = 1 + (nbins*(x[inside] - xmin)/(xmax - xmin)).astype(np.int64)
+    counts = np.bincount(bins, minlength=nbins + 2).astype(np.float64)
+    xin = x[(bins >= 1) & (bins <= nbins)]
+    stats = np.array([len(xin), len(xin), xin.sum(), (xin*xin).sum(), len(x)], dtype=np.float64)
+    return counts, stats
+
+
+# tolerance of near_edge, far above the last-bit differences between the double and float math functions
+EDGE_TOL = 1e-5
+
+
+def near_edge(x, binnings, cuts=()):
+    # values within EDGE_TOL*(1 + |x|) of a bin edge of the (nbins, xmin, xmax) binnings or of a cut value
+    x = np.asarray(x, dtype=np.float64)
+    tol = EDGE_TOL*(1 + np.abs(x))
+    near = np.zeros(len(x), dtype=bool)
+    with np.errstate(invalid="ignore"):
+        for nbins, xmin, xmax in binnings:
+            width = (xmax - xmin)/nbins
+            u = (x - xmin)/width
+            near |= (u > -1) & (u < nbins + 1) & (np.abs(u - np.rint(u))*width < tol)
+        for cut in cuts:
+            near |= np.abs(x - cut) < tol
+    return near
+
+
+def approx(name, *args):
+    # float math function from its double version, can differ in the last bit from the C math library one
+    f = {"atan2f": np.arctan2, "cosf": np.cos, "sinf": np.sin, "acos": np.arccos}[name]
+    return f(*(np.asarray(a, dtype=np.float64) for a in args))
+
+
+@functools.lru_cache(None)
+def libm():
+    # the functions of the C math library behind std::atan2, std::cos, std::sin (float) and std::acos (double)
+    lib = ctypes.CDLL(ctypes.util.find_library("m"))
+    funcs = {"acos": np.frompyfunc(math.acos, 1, 1)}
+    for name, nargs in (("atan2f", 2), ("cosf", 1), ("sinf", 1)):
+        f = getattr(lib, name)
+        f.restype = ctypes.c_float
+        f.argtypes = [ctypes.c_float]*nargs
+        funcs[name] = np.frompyfunc(f, nargs, 1)
+    return funcs
+
+
+def exact(name, *args):
+    # same as approx, with the C math library, one call per value
+    if not len(args[0]):
+        return np.zeros(0)
+    return libm()[name](*args).astype(np.float64)
+
+
+def angles(pt, pz, q, f):
+    # theta of the legs (get_kinematics) and the angle columns, in float with the math functions f(name, *args);
+    # pt, pz and q are (leg a, leg b) pairs
+    theta = [f("atan2f", pt[i], pz[i]).astype(np.float32) for i in range(2)]
+    tp = np.where(q[0] > 0, theta[0], theta[1])
+    tm = np.where(q[0] < 0, theta[0], theta[1])
+    cos = lambda v: f("cosf", v).astype(np.float32)
+    sin = lambda v: f("sinf", v).astype(np.float32)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cosThetac = sin(tp - tm)/(sin(tp) + sin(tm))
+    return {"theta_plus": tp, "theta_minus": tm, "cos_theta_plus": cos(tp), "cos_theta_minus": cos(tm), "cosThetac": cosThetac}
+
+
+def select(rp, index, rpCounts, muonCounts, sel, binnings=None):
+    # the columns of the backend and the event masks after each cut, from the flat reconstructed particle
+    # arrays (rp: px, py, pz, mass, charge), the flat Muon#0.index and the per-event counts; binnings are
+    # the (nbins, xmin, xmax) of the histograms of each column
+    binnings = binnings or {}
+    nEvents = len(rpCounts)
+    offsets = np.concatenate([[0], np.cumsum(rpCounts)[:-1]]).astype(np.int64)
+    event = np.repeat(np.arange(nEvents), muonCounts)
+    muon = offsets[event] + index
+    px, py, pz, m, q = (np.asarray(a, dtype=np.float32)[muon] for a in rp)
+
+    # get_kinematics, in float
+    pt2 = px*px + py*py
+    p = np.sqrt(pt2 + pz*pz)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        costheta = np.where(p == 0, np.float32(1), pz/p).astype(np.float32)
+    columns = {"muons_all_costheta": costheta}
+
+    # sel_range(0, costheta_max, true).mask
+    keep = (np.abs(costheta) > 0) & (np.abs(costheta) < np.float32(sel["costheta_max"]))
+    n = np.bincount(event[keep], minlength=nEvents)
+    first = np.concatenate([[0], np.cumsum(n)[:-1]]).astype(np.int64)
+    px, py, pz, m, q, p, pt = (a[keep] for a in (px, py, pz, m, q, p, np.sqrt(pt2)))
+
+    masks = [np.ones(nEvents, dtype=bool), n >= 1, n >= 2]
+    pair = n == 2
+    i0 = first[pair]
+    pair[pair] = (q[i0] + q[i0 + 1]) == 0
+    masks.append(pair)
+
+    # events with the opposite-sign pair, legs a and b
+    a = first[pair]
+    b = a + 1
+    pmax = np.where(p[a] > p[b], p[a], p[b])
+    columns["muon_max_p_norm"] = pmax.astype(np.float64)/sel["p_beam"]
+    pass4 = columns["muon_max_p_norm"] > sel["p_max_norm_min"]
+
+    # acolinearity(px, py, pz), in double; values close to a bin edge or to the cut use the C math library acos
+    xa, ya, za, xb, yb, zb = (v.astype(np.float64) for v in (px[a], py[a], pz[a], px[b], py[b], pz[b]))
+    dot = xa*xb + ya*yb + za*zb
+    mag = np.sqrt(xa*xa + ya*ya + za*za)*np.sqrt(xb*xb + yb*yb + zb*zb)
+    with np.errstate(invalid="ignore"):
+        cos = dot/mag*(-1.)
+        aco = approx("acos", cos).astype(np.float32)
+        near = near_edge(aco, binnings.get("acolinearity", []), [sel["acolinearity_max"]])
+        aco[near] = exact("acos", cos[near])
+    columns["acolinearity"] = aco
+    pass5 = pass4 & (aco.astype(np.float64) < sel["acolinearity_max"])
+
+    # invariant mass of TLorentzVector::SetXYZM legs
+    ma, mb = m[a].astype(np.float64), m[b].astype(np.float64)
+    ea = np.sqrt(xa*xa + ya*ya + za*za + ma*ma)
+    eb = np.sqrt(xb*xb + yb*yb + zb*zb + mb*mb)
+    x, y, z, e = xa + xb, ya + yb, za + zb, ea + eb
+    mm = e*e - (x*x + y*y + z*z)
+    columns["invariant_mass"] = np.where(mm < 0, -np.sqrt(np.abs(mm)), np.sqrt(np.abs(mm)))
+
+    # angles of the legs; the pairs with a value close to a bin edge, or a small denominator of cosThetac,
+    # are computed again with the float functions of the C math library, so that they fall in the same bins
+    legs = (pt[a], pt[b]), (pz[a], pz[b]), (q[a], q[b])
+    columns.update(angles(*legs, approx))
+    near = approx("sinf", columns["theta_plus"]) + approx("sinf", columns["theta_minus"]) < 0.1
+    for column in ANGLE_COLUMNS:
+        near |= near_edge(columns[column], binnings.get(column, []))
+    for column, values in angles(*([v[near] for v in leg] for leg in legs), exact).items():
+        columns[column][near] = values
+
+    # event masks per stage, and per-pair masks for the columns defined after cut 3
+    pairMasks = [None, None, None, np.ones(len(a), dtype=bool), pass4, pass5]
+    masks += [masks[3].copy(), masks[3].copy()]
+    masks[4][masks[3]] = pass4
+    masks[5][masks[3]] = pass5
+    return columns, event, masks, pairMasks
+
+
+def process(task):
+    # histograms and cut flows of one chunk of a file
+    import uproot
+    import awkward as ak
+
+    path, start, stop, hists, cutflows, sel = task
+    with uproot.open(path) as f:
+        arrays = f["events"].arrays(filter_name=BRANCHES, entry_start=start, entry_stop=stop, library="ak")
+    rpCounts = ak.to_numpy(ak.num(arrays["ReconstructedParticles.momentum.x"]))
+    muonCounts = ak.to_numpy(ak.num(arrays["Muon#0.index"]))
+    rp = [ak.to_numpy(ak.flatten(arrays[b])) for b in BRANCHES[:5]]
+    index = ak.to_numpy(ak.flatten(arrays["Muon#0.index"]))
+    binnings = {}
+    for name, title, nbins, xmin, xmax, column, st in hists:
+        binnings.setdefault(column, []).append((nbins, xmin, xmax))
+    columns, event, masks, pairMasks = select(rp, index, rpCounts, muonCounts, sel, binnings)
+
+    result = {"events": stop - start, "hists": [], "cutflows": []}
+    for name, title, nbins, xmin, xmax, column, st in hists:
+        if column in MUON_COLUMNS:
+            values = columns[column][masks[st][event]]
+        else:
+            values = columns[column][pairMasks[st]]
+        result["hists"].append(fill(values, nbins, xmin, xmax))
+    for name, labels, cuts, raw in cutflows:
+        result["cutflows"].append(np.array([masks[cut].sum() for cut in cuts], dtype=np.float64))
+    return result
+
+
+def tasks(files, hists, cutflows, sel, step):
+    import uproot
+
+    for path in files:
+        with uproot.open(path) as f:
+            nEntries = f["events"].num_entries
+        for start in range(0, nEntries, step):
+            yield (path, start, min(start + step, nEntries), hists, cutflows, sel)
+
+
+class Stat:
+    # counts of one cut, with the TStatistic interface used by CutFlow
+
+    def __init__(self, n):
+        self.n = n
+
+    def GetValue(self):
+        return self
+
+    def GetN(self):
+        return self.n
+
+    def GetW(self):
+        return self.n
+
+    def GetW2(self):
+        return self.n
+
+
+def to_th1(name, title, nbins, xmin, xmax, counts, stats):
+    import ROOT
+
+    h = ROOT.TH1D(name, title, nbins, xmin, xmax)
+    h.SetDirectory(0)
+    if h.GetSumw2N() == 0:
+        h.Sumw2()
+    sumw2 = h.GetSumw2()
+    for i, c in enumerate(counts):
+        h.SetBinContent(i, c)
+        sumw2.SetAt(c, i)
+    h.PutStats(np.ascontiguousarray(stats[:4]))
+    h.SetEntries(stats[4])
+    return h
+
+
+def run(module, nProcs=8, step=500000):
+    import runner
+
+    module.procDictData = runner.load_procdict(module)
+    sel = {**DEFAULTS, **getattr(module, "selection", {})}
+    print(f"--> {module.__name__}: the gen-level histograms, unbinned moments, response matrix and systematic variations "
+          "are not produced by the columnar backend, run the runner for them")
+    for proc, cfg in module.processList.items():
+        start = time.time()
+        hists, cutflows = booking(module, proc)
+        files = runner.get_files(module.inputDir, proc, cfg.get("fraction", 1))
+        nEvents = 0
+        contents = [(np.zeros(h[2] + 2), np.zeros(5)) for h in hists]
+        cuts = [np.zeros(len(c[2])) for c in cutflows]
+        with ProcessPoolExecutor(nProcs) as pool:
+            for result in pool.map(process, tasks(files, hists, cutflows, sel, step)):
+                nEvents += result["events"]
+                for (counts, stats), (c, s) in zip(contents, result["hists"]):
+                    counts += c
+                    stats += s
+                for total, c in zip(cuts, result["cutflows"]):
+                    total += c
+
+        results = []
+        for (name, title, nbins, xmin, xmax, column, st), (counts, stats) in zip(hists, contents):
+            results.append(runner.StoredResult(to_th1(name, title, nbins, xmin, xmax, counts, stats)))
+        for (name, labels, cutList, raw), total in zip(cutflows, cuts):
+            cutFlow = CutFlow(labels, name)
+            cutFlow.stats = {cut: Stat(n) for cut, n in zip(cutList, total)}
+            results += [cutFlow, cutFlow.raw] if raw else [cutFlow]
+        runner.write_output(module, proc, results, nEvents, float(nEvents))
+        print(f"--> {proc}: {nEvents} events in {time.time() - start:.1f} s")
+
+
+def compare(module, refDir):
+    # bin-by-bin comparison of the written histograms with those of another output directory
+    import ROOT
+    import runner
+
+    ok = True
+    for proc in module.processList:
+        fOut = ROOT.TFile(f"{runner.output_dir(module)}/{proc}.root")
+        fRef = ROOT.TFile(f"{runner.module_path(module, refDir)}/{proc}.root")
+        for key in fOut.GetListOfKeys():
+            h = key.ReadObj()
+            if not h.InheritsFrom("TH1"):
+                continue
+            ref = fRef.Get(h.GetName())
+            if not ref:
+                print(f"    {proc}: {h.GetName()} not in {refDir}")
+                ok = False
+                continue
+            diff = [i for i in range(h.GetNcells()) if h.GetBinContent(i) != ref.GetBinContent(i)]
+            ok &= not diff
+            print(f"    {proc}: {h.GetName():<20} {'identical' if not diff else f'{len(diff)} bins differ, e.g. bin {diff[0]}'}")
+        fOut.Close()
+        fRef.Close()
+    return ok
+
+
+if __name__ == "__main__":
+    import runner
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("module", help="Analysis module (z_mumu_xsec.py or z_mumu_afb.py)")
+    parser.add_argument("-j", "--nProcs", type=int, default=8, help="Number of processes")
+    parser.add_argument("--step", type=int, default=500000, help="Number of events per chunk")
+    parser.add_argument("--outputDir", type=str, default=None, help="Output directory (default: outputDir of the module)")
+    parser.add_argument("--compare", type=str, default=None, help="Compare the histograms bin by bin with the outputs in this directory")
+    args = parser.parse_args()
+
+    module = runner.load_module(args.module)
+    if args.outputDir is not None:
+        module.outputDir = os.path.abspath(args.outputDir)
+    run(module, args.nProcs, args.step)
+    if args.compare is not None and not compare(module, os.path.abspath(args.compare)):
+        raise SystemExit(1)
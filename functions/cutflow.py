@@ -0,0 +1,75 @@
+"""
+Weighted cut-flow accumulator for the analysis graphs.
+
+Instead of one 50-bin histogram per cut, a single TStatistic is booked per cut
+on the column "weight". It accumulates the raw count, the sum of weights and
+the sum of squared weights, and costs a few numbers per thread slot. The
+CutFlow object can be appended to the hists returned by build_graph like any
+booked histogram: GetValue() returns one histogram with a labelled bin per cut,
+holding the sum of weights with sqrt(sum of squared weights) as error. The raw
+counts of the same accumulators are written as {name}_raw when cutFlow.raw is
+appended as well:
+
+    cutFlow = CutFlow(["All events", "#geq 1 #mu"])
+    hists += [cutFlow, cutFlow.raw]
+    cutFlow.add(df, 0)
+    df = df.Filter("muons_no >= 1")
+    cutFlow.add(df, 1)
+
+Several CutFlow objects with the same name and labels (e.g. one per analysis
+stage) produce histograms that can be summed bin by bin.
+"""
+
+import ROOT
+
+
+class CutFlow:
+
+    def __init__(self, labels, name="cutFlow", weight="weight"):
+        self.labels = list(labels)
+        self.name = name
+        self.weight = weight
+        self.stats = {}
+        self.hist = None
+        self.raw = RawCounts(self)
+
+    def add(self, df, cut):
+        # book the accumulator for cut (index in labels) on the node df
+        self.stats[cut] = df.Stats(self.weight, self.weight)
+
+    def GetName(self):
+        return self.name
+
+    def histogram(self, name, content):
+        # labelled histogram with the (value, error) of content(stat) in the bin of each booked cut
+        n = len(self.labels)
+        h = ROOT.TH1D(name, "", n, 0, n)
+        h.SetDirectory(0)
+        for i, label in enumerate(self.labels):
+            h.GetXaxis().SetBinLabel(i+1, label)
+        for cut, stat in self.stats.items():
+            value, error = content(stat.GetValue())
+            h.SetBinContent(cut+1, value)
+            h.SetBinError(cut+1, error)
+        return h
+
+    def GetValue(self):
+        if self.hist is None:
+            self.hist = self.histogram(self.name, lambda s: (s.GetW(), s.GetW2()**0.5))
+        return self.hist
+
+
+class RawCounts:
+    # raw number of events per cut of a CutFlow, from the same accumulators, with sqrt(N) as error
+
+    def __init__(self, cutFlow):
+        self.cutFlow = cutFlow
+        self.hist = None
+
+    def GetName(self):
+        return f"{self.cutFlow.name}_raw"
+
+    def GetValue(self):
+        if self.hist is None:
+            self.hist = self.cutFlow.histogram(self.GetName(), lambda s: (s.GetN(), s.GetN()**0.5))
+        return self.hist
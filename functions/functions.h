@@ -28,6 +28,18 @@ Vec_tlv makeLorentzVectors(Vec_f jets_px, Vec_f jets_py, Vec_f jets_pz, Vec_f je
 }
 
 
+// make Lorentz vectors from momentum components and masses
+Vec_tlv makeLorentzVectorsPxPyPzM(Vec_f px, Vec_f py, Vec_f pz, Vec_f m) {
+    Vec_tlv result;
+    for(int i=0; i<px.size(); i++) {
+        TLorentzVector tlv;
+        tlv.SetXYZM(px[i], py[i], pz[i], m[i]);
+        result.push_back(tlv);
+    }
+    return result;
+}
+
+
 // acolinearity between two reco particles
 float acolinearity(Vec_rp in) {
     if(in.size() < 2) return -999;
@@ -43,6 +55,57 @@ float acolinearity(Vec_rp in) {
     return std::acos(v1.Dot(v2)/(v1.Mag()*v2.Mag())*(-1.));
 }
 
+// acolinearity between two particles, given their momentum components
+float acolinearity(Vec_f px, Vec_f py, Vec_f pz) {
+    if(px.size() < 2) return -999;
+
+    TVector3 v1(px[0], py[0], pz[0]);
+    TVector3 v2(px[1], py[1], pz[1]);
+    return std::acos(v1.Dot(v2)/(v1.Mag()*v2.Mag())*(-1.));
+}
+
+// per-event terms of the unbinned A_FB estimators, for each |cos(theta)| window in windows:
+// N_F, N_B, sum c, sum c^2 and sum t^k (k = 1..order) with t = c/(3(1+c^2)/8).
+// operator() returns the weights filled at the bin centers given by index()
+struct afb_moments {
+    afb_moments(Vec_f arg_windows, int arg_order = 10);
+    Vec_f windows;
+    int order = 10;
+    int size() const;
+    ROOT::VecOps::RVec<double> index() const;
+    ROOT::VecOps::RVec<double> operator() (float c, double w) const;
+};
+
+afb_moments::afb_moments(Vec_f arg_windows, int arg_order) : windows(arg_windows), order(arg_order) {};
+
+int afb_moments::size() const {
+    return windows.size()*(4 + order);
+}
+
+ROOT::VecOps::RVec<double> afb_moments::index() const {
+    ROOT::VecOps::RVec<double> result(size());
+    for(int i = 0; i < size(); ++i) result[i] = i + 0.5;
+    return result;
+}
+
+ROOT::VecOps::RVec<double> afb_moments::operator() (float c, double w) const {
+    ROOT::VecOps::RVec<double> result(size(), 0.);
+    const double t = c/(3.*(1. + c*c)/8.);
+    for(size_t iw = 0; iw < windows.size(); ++iw) {
+        if(std::abs(c) > windows[iw]) continue;
+        double * r = &result[iw*(4 + order)];
+        r[c >= 0 ? 0 : 1] = w;
+        r[2] = w*c;
+        r[3] = w*c*c;
+        double tk = w;
+        for(int k = 0; k < order; ++k) {
+            tk *= t;
+            r[4 + k] = tk;
+        }
+    }
+    return result;
+}
+
 // acoplanarity between two reco particles
 float acoplanarity(Vec_rp in) {
     if(in.size() < 2) return -999;
@@ -144,71 +207,101 @@ float get_cosTheta_miss(Vec_rp met){
 
 
 // compute the cone isolation for reco particles
+// eta, phi and p are computed once per particle and the particles are sorted into an eta-phi grid whose
+// cells are at least as large as the largest cone, so each lepton only visits the 3x3 neighbouring cells
+// several cone sizes can be given, isolations() then returns one result per cone from a single scan
 struct coneIsolation {
 
     coneIsolation(float arg_dr_min, float arg_dr_max);
-    double deltaR(double eta1, double phi1, double eta2, double phi2) { return TMath::Sqrt(TMath::Power(eta1-eta2, 2) + (TMath::Power(phi1-phi2, 2))); };
+    coneIsolation(float arg_dr_min, Vec_f arg_dr_max);
+    double deltaR(double eta1, double phi1, double eta2, double phi2) {
+        double deta = eta1 - eta2;
+        double dphi = std::remainder(phi1 - phi2, 2*M_PI);
+        return std::sqrt(deta*deta + dphi*dphi);
+    };
 
     float dr_min = 0;
-    float dr_max = 0.4;
-    Vec_f operator() (Vec_rp in, Vec_rp rps) ;
+    Vec_f dr_max = {0.4};
+    Vec_f operator() (Vec_rp in, Vec_rp rps);
+    ROOT::VecOps::RVec<Vec_f> isolations(const Vec_rp & in, const Vec_rp & rps);
 };
 
-coneIsolation::coneIsolation(float arg_dr_min, float arg_dr_max) : dr_min(arg_dr_min), dr_max( arg_dr_max ) { };
-Vec_f coneIsolation::coneIsolation::operator() (Vec_rp in, Vec_rp rps) {
-
-    Vec_f result;
-    result.reserve(in.size());
-
-    std::vector<ROOT::Math::PxPyPzEVector> lv_reco;
-    std::vector<ROOT::Math::PxPyPzEVector> lv_charged;
-    std::vector<ROOT::Math::PxPyPzEVector> lv_neutral;
-
-    for(size_t i = 0; i < rps.size(); ++i) {
-        ROOT::Math::PxPyPzEVector tlv;
-        tlv.SetPxPyPzE(rps.at(i).momentum.x, rps.at(i).momentum.y, rps.at(i).momentum.z, rps.at(i).energy);
+coneIsolation::coneIsolation(float arg_dr_min, float arg_dr_max) : dr_min(arg_dr_min), dr_max({arg_dr_max}) { };
+coneIsolation::coneIsolation(float arg_dr_min, Vec_f arg_dr_max) : dr_min(arg_dr_min), dr_max(arg_dr_max) { };
 
-        if(rps.at(i).charge == 0) lv_neutral.push_back(tlv);
-        else lv_charged.push_back(tlv);
-    }
+Vec_f coneIsolation::coneIsolation::operator() (Vec_rp in, Vec_rp rps) {
+    // isolation in the first cone, zero without any cone
+    if(dr_max.size() == 0) return Vec_f(in.size(), 0.);
+    return isolations(in, rps)[0];
+}
 
-    for(size_t i = 0; i < in.size(); ++i) {
-        ROOT::Math::PxPyPzEVector tlv;
-        tlv.SetPxPyPzE(in.at(i).momentum.x, in.at(i).momentum.y, in.at(i).momentum.z, in.at(i).energy);
-        lv_reco.push_back(tlv);
+ROOT::VecOps::RVec<Vec_f> coneIsolation::isolations(const Vec_rp & in, const Vec_rp & rps) {
+
+    int nCones = dr_max.size();
+    ROOT::VecOps::RVec<Vec_f> result(nCones, Vec_f(in.size(), 0.));
+    if(in.size() == 0 || nCones == 0) return result;
+
+    // grid definition, phi cells wrap around
+    float cell = std::max(*std::max_element(dr_max.begin(), dr_max.end()), 1e-3f);
+    int nPhi = std::max(1, int(2*M_PI/cell));
+    float phiWidth = 2*M_PI/nPhi;
+    auto etaCell = [&](float eta) { return (long long)std::floor(eta/cell); };
+    auto phiCell = [&](float phi) { return std::min(nPhi-1, std::max(0, int((phi+M_PI)/phiWidth))); };
+
+    // eta, phi, p computed once per particle, sorted by grid cell (see https://github.com/delphes/delphes/blob/master/modules/Isolation.cc#L154)
+    int n = rps.size();
+    Vec_f eta(n), phi(n), p(n);
+    std::vector<std::pair<long long, int>> cells(n);
+    for(int i = 0; i < n; ++i) {
+        ROOT::Math::PxPyPzEVector lv(rps[i].momentum.x, rps[i].momentum.y, rps[i].momentum.z, rps[i].energy);
+        eta[i] = lv.Eta();
+        phi[i] = lv.Phi();
+        p[i] = lv.P();
+        cells[i] = {etaCell(eta[i])*nPhi + phiCell(phi[i]), i};
     }
-
-    // compute the isolation (see https://github.com/delphes/delphes/blob/master/modules/Isolation.cc#L154) 
-    for (auto & lv_reco_ : lv_reco) {
-        double sumNeutral = 0.0;
-        double sumCharged = 0.0;
-
-        // charged
-        for (auto & lv_charged_ : lv_charged) {
-            double dr = coneIsolation::deltaR(lv_reco_.Eta(), lv_reco_.Phi(), lv_charged_.Eta(), lv_charged_.Phi());
-            if(dr > dr_min && dr < dr_max) sumCharged += lv_charged_.P();
-        }
-
-        // neutral
-        for (auto & lv_neutral_ : lv_neutral) {
-            double dr = coneIsolation::deltaR(lv_reco_.Eta(), lv_reco_.Phi(), lv_neutral_.Eta(), lv_neutral_.Phi());
-            if(dr > dr_min && dr < dr_max) sumNeutral += lv_neutral_.P();
+    std::sort(cells.begin(), cells.end());
+
+    std::vector<int> phiCells;
+    for(size_t j = 0; j < in.size(); ++j) {
+        ROOT::Math::PxPyPzEVector lv(in[j].momentum.x, in[j].momentum.y, in[j].momentum.z, in[j].energy);
+        float eta_j = lv.Eta(), phi_j = lv.Phi();
+        long long ce = etaCell(eta_j);
+        int cp = phiCell(phi_j);
+
+        phiCells.clear();
+        if(nPhi < 3) for(int k = 0; k < nPhi; ++k) phiCells.push_back(k);
+        else phiCells = {(cp+nPhi-1) % nPhi, cp, (cp+1) % nPhi};
+
+        std::vector<double> sum(nCones, 0.);
+        for(long long e = ce-1; e <= ce+1; ++e) {
+            for(int c : phiCells) {
+                long long key = e*nPhi + c;
+                auto it = std::lower_bound(cells.begin(), cells.end(), std::make_pair(key, -1));
+                for(; it != cells.end() && it->first == key; ++it) {
+                    int i = it->second;
+                    double dr = deltaR(eta_j, phi_j, eta[i], phi[i]);
+                    if(dr <= dr_min) continue;
+                    for(int k = 0; k < nCones; ++k) {
+                        if(dr < dr_max[k]) sum[k] += p[i];
+                    }
+                }
+            }
         }
-
-        double sum = sumCharged + sumNeutral;
-        double ratio= sum / lv_reco_.P();
-        result.emplace_back(ratio);
+        double p_j = lv.P();
+        for(int k = 0; k < nCones; ++k) result[k][j] = sum[k] / p_j;
     }
     return result;
 }
 
 // filter reconstructed particles (in) based a property (prop) within a defined range (m_min, m_max)
+// mask(prop) returns the selection as a boolean mask, without copying the particles
 struct sel_range {
     sel_range(float arg_min, float arg_max, bool arg_abs = false);
     float m_min = 0.;
     float m_max = 1.;
     bool m_abs = false;
     Vec_rp operator() (Vec_rp in, Vec_f prop);
+    ROOT::VecOps::RVec<bool> mask(const Vec_f & prop);
 };
 
 sel_range::sel_range(float arg_min, float arg_max, bool arg_abs) : m_min(arg_min), m_max(arg_max), m_abs(arg_abs) {};
@@ -223,9 +316,244 @@ Vec_rp sel_range::operator() (Vec_rp in, Vec_f prop) {
     return result;
 }
 
+ROOT::VecOps::RVec<bool> sel_range::mask(const Vec_f & prop) {
+    ROOT::VecOps::RVec<bool> result(prop.size());
+    for (size_t i = 0; i < prop.size(); ++i) {
+        float val = (m_abs) ? std::abs(prop[i]) : prop[i];
+        result[i] = (val > m_min && val < m_max);
+    }
+    return result;
+}
+
+
+// kinematics of a particle collection as a struct of arrays, filled in a single pass into one buffer:
+// one allocation per event instead of one per array. The arrays are read through px(), ..., q(),
+// non-owning read-only views on the buffer of the column: like the column itself, a view is only valid
+// for the current entry, so it must be defined from the column (e.g. "muons_kin.p()") and not be written to
+struct ParticleKinematics {
+    enum { PX, PY, PZ, M, P, THETA, COSTHETA, PHI, Q, NARRAYS };
+    std::vector<float> data;
+    int n = 0;
+    int stride = 0;  // number of particles the buffer has room for, >= n
+
+    void reserve(int size) {
+        stride = size;
+        data.resize(NARRAYS*size);
+    }
+    float* array(int k) { return data.data() + k*stride; }
+    Vec_f view(int k) const { return Vec_f(const_cast<float*>(data.data()) + k*stride, n); }
+
+    Vec_f px() const { return view(PX); }
+    Vec_f py() const { return view(PY); }
+    Vec_f pz() const { return view(PZ); }
+    Vec_f m() const { return view(M); }
+    Vec_f p() const { return view(P); }
+    Vec_f theta() const { return view(THETA); }
+    Vec_f costheta() const { return view(COSTHETA); }
+    Vec_f phi() const { return view(PHI); }
+    Vec_f q() const { return view(Q); }
+};
+
+ParticleKinematics get_kinematics(const Vec_rp & in) {
+    ParticleKinematics result;
+    result.reserve(in.size());
+    result.n = in.size();
+    float *px = result.array(result.PX), *py = result.array(result.PY), *pz = result.array(result.PZ);
+    float *m = result.array(result.M), *p = result.array(result.P), *q = result.array(result.Q);
+    float *theta = result.array(result.THETA), *costheta = result.array(result.COSTHETA), *phi = result.array(result.PHI);
+    for(int i = 0; i < result.n; ++i) {
+        const auto & mom = in[i].momentum;
+        float pt2 = mom.x*mom.x + mom.y*mom.y;
+        p[i] = std::sqrt(pt2 + mom.z*mom.z);
+        px[i] = mom.x;
+        py[i] = mom.y;
+        pz[i] = mom.z;
+        m[i] = in[i].mass;
+        theta[i] = (p[i] == 0) ? 0.f : std::atan2(std::sqrt(pt2), mom.z);
+        costheta[i] = (p[i] == 0) ? 1.f : mom.z/p[i];
+        phi[i] = (pt2 == 0) ? 0.f : std::atan2(mom.y, mom.x);
+        q[i] = in[i].charge;
+    }
+    return result;
+}
+
+// kinematics of the particles selected by mask (e.g. from sel_range::mask), in one pass over the mask:
+// the buffer has room for all particles of in
+ParticleKinematics get_kinematics(const ParticleKinematics & in, const ROOT::VecOps::RVec<bool> & mask) {
+    ParticleKinematics result;
+    result.reserve(in.n);
+    int j = 0;
+    for(int i = 0; i < in.n; ++i) {
+        if(!mask[i]) continue;
+        for(int k = 0; k < result.NARRAYS; ++k) result.data[k*result.stride + j] = in.data[k*in.stride + i];
+        ++j;
+    }
+    result.n = j;
+    return result;
+}
+
+// seed of the random numbers of an event, from its identity: the event number (EventHeader.eventNumber) and the
+// name of its input file (rdfsampleinfo_.GetSampleName(), "{path}/{tree}"), since event numbers may restart in every
+// file of a sample. Unlike rdfentry_, it does not depend on how the events are read (one or several files per event
+// loop, --incremental, shards, prescan entry lists), so it is computed once and stored in skims
+template <typename T>
+unsigned long long event_seed(const ROOT::VecOps::RVec<T> & eventNumber, const std::string & sample) {
+    // FNV-1a of the file name, without the directory and the tree name
+    auto end = sample.rfind('/');
+    auto begin = (end == std::string::npos || end == 0) ? 0 : sample.rfind('/', end - 1);
+    begin = (begin == std::string::npos) ? 0 : begin + 1;
+    end = (end == std::string::npos) ? sample.size() : end;
+    unsigned long long h = 0xcbf29ce484222325ULL;
+    for(auto i = begin; i < end; ++i) h = (h ^ (unsigned char)sample[i]) * 0x100000001b3ULL;
+    unsigned long long number = eventNumber.empty() ? 0 : (unsigned long long)eventNumber[0];
+    return h ^ (number * 0x9e3779b97f4a7c15ULL);
+}
+
+// momentum scale factors of n particles for the momentum scale and resolution variations: scale*(1 + smear*g),
+// with g a standard normal drawn from (seed, particle index), seed = event_seed(...), so a variation is reproducible
+Vec_f momentum_factors(int n, float scale, float smear, unsigned long long seed) {
+    Vec_f result(n, scale);
+    if(smear == 0) return result;
+    auto next = [&seed]() {
+        // splitmix64
+        unsigned long long z = (seed += 0x9e3779b97f4a7c15ULL);
+        z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+        z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+        return ((z ^ (z >> 31)) >> 11) * 0x1.0p-53;
+    };
+    seed *= 0x9e3779b97f4a7c15ULL;
+    for(int i = 0; i < n; ++i) {
+        double u1 = 1 - next(), u2 = next();
+        result[i] *= 1 + smear*std::sqrt(-2*std::log(u1))*std::cos(2*M_PI*u2);
+    }
+    return result;
+}
+
+
+// reco->MC association index, built once per event from MCRecoAssociations0/1
+// entry t is the MC index associated to the reco particle whose first track is t (first association wins), -1 if none
+// same matching as ReconstructedParticle2MC::getTrack2MC_index, without scanning the associations for each particle
+Vec_i getTrack2MC_indices(const Vec_i & recind, const Vec_i & mcind, const Vec_rp & reco) {
+    int n = 0;
+    for(auto & i : recind) n = std::max(n, int(reco[i].tracks_begin) + 1);
+    Vec_i result(n, -1);
+    for(size_t i = 0; i < recind.size(); ++i) {
+        int track_index = reco[recind[i]].tracks_begin;
+        if(result[track_index] < 0) result[track_index] = mcind[i];
+    }
+    return result;
+}
+
+// MC index of a track from the association index, -1 if not associated
+int getTrack2MC_index(int track_index, const Vec_i & track2mc) {
+    if(track_index < 0 || track_index >= track2mc.size()) return -1;
+    return track2mc[track_index];
+}
+
+
+// resonance candidates built from pairs of legs, sorted by increasing chi2
+// status: 0 = ok, 1 = fewer than two legs, 2 = no opposite-charge pair
+struct ResonanceCandidates {
+    Vec_rp resonances;
+    Vec_i leg1;
+    Vec_i leg2;
+    Vec_f chi2;
+    Vec_f recoil_mass;
+    int status = 0;
+};
+
+// build resonance candidates from all n(n-1)/2 opposite-charge pairs of legs
+// the leg four-vectors (reco or MC-matched) are computed once per event, and the chi2 is
+//   (1-chi2_recoil_frac)*((m-m_resonance)/sigma_mass)^2 + chi2_recoil_frac*((m_recoil-m_recoil_target)/sigma_recoil)^2
+// only the top_k best candidates are kept (all if top_k <= 0); bad events are reported through status
+struct resonanceBuilder_pairs {
+    float m_resonance_mass;
+    float m_recoil_mass;
+    float chi2_recoil_frac;
+    float ecm;
+    bool m_use_MC_Kinematics;
+    int m_top_k;
+    float m_sigma_mass;
+    float m_sigma_recoil;
+    resonanceBuilder_pairs(float arg_resonance_mass, float arg_recoil_mass, float arg_chi2_recoil_frac, float arg_ecm, bool arg_use_MC_Kinematics, int arg_top_k = 1, float arg_sigma_mass = 1., float arg_sigma_recoil = 1.);
+    ResonanceCandidates operator()(const Vec_rp & legs, const Vec_i & track2mc, const Vec_mc & mc);
+    ResonanceCandidates operator()(const Vec_rp & legs, const Vec_i & recind, const Vec_i & mcind, const Vec_rp & reco, const Vec_mc & mc);
+};
+
+resonanceBuilder_pairs::resonanceBuilder_pairs(float arg_resonance_mass, float arg_recoil_mass, float arg_chi2_recoil_frac, float arg_ecm, bool arg_use_MC_Kinematics, int arg_top_k, float arg_sigma_mass, float arg_sigma_recoil) : m_resonance_mass(arg_resonance_mass), m_recoil_mass(arg_recoil_mass), chi2_recoil_frac(arg_chi2_recoil_frac), ecm(arg_ecm), m_use_MC_Kinematics(arg_use_MC_Kinematics), m_top_k(arg_top_k), m_sigma_mass(arg_sigma_mass), m_sigma_recoil(arg_sigma_recoil) {};
+
+ResonanceCandidates resonanceBuilder_pairs::operator()(const Vec_rp & legs, const Vec_i & recind, const Vec_i & mcind, const Vec_rp & reco, const Vec_mc & mc) {
+    if(!m_use_MC_Kinematics) return (*this)(legs, Vec_i(), mc);
+    return (*this)(legs, getTrack2MC_indices(recind, mcind, reco), mc);
+}
+
+// track2mc is the association index from getTrack2MC_indices, only used with MC kinematics
+ResonanceCandidates resonanceBuilder_pairs::operator()(const Vec_rp & legs, const Vec_i & track2mc, const Vec_mc & mc) {
+    ResonanceCandidates result;
+    int n = legs.size();
+    if(n < 2) {
+        result.status = 1;
+        return result;
+    }
+
+    // leg four-vectors, computed once
+    std::vector<TLorentzVector> lv(n);
+    for(int i = 0; i < n; ++i) {
+        if(m_use_MC_Kinematics) { // MC kinematics, zero if the leg is not matched
+            int mc_index = getTrack2MC_index(legs[i].tracks_begin, track2mc);
+            if(mc_index >= 0 && mc_index < mc.size()) {
+                lv[i].SetXYZM(mc[mc_index].momentum.x, mc[mc_index].momentum.y, mc[mc_index].momentum.z, mc[mc_index].mass);
+            }
+        }
+        else { // reco kinematics
+            lv[i].SetXYZM(legs[i].momentum.x, legs[i].momentum.y, legs[i].momentum.z, legs[i].mass);
+        }
+    }
+
+    struct Candidate { float chi2; float recoil; int i; int j; TLorentzVector lv; };
+    std::vector<Candidate> cands;
+    cands.reserve(n*(n-1)/2);
+    TLorentzVector initial(0, 0, 0, ecm);
+    for(int i = 0; i < n; ++i) {
+        for(int j = i+1; j < n; ++j) {
+            if(legs[i].charge + legs[j].charge != 0) continue; // neglect non-zero charge pairs
+            TLorentzVector reso_lv = lv[i] + lv[j];
+            float recoil = (initial - reso_lv).M();
+            float dm = (reso_lv.M() - m_resonance_mass)/m_sigma_mass;
+            float drec = (recoil - m_recoil_mass)/m_sigma_recoil;
+            float chi2 = (1.0-chi2_recoil_frac)*dm*dm + chi2_recoil_frac*drec*drec;
+            cands.push_back({chi2, recoil, i, j, reso_lv});
+        }
+    }
+    if(cands.empty()) {
+        result.status = 2;
+        return result;
+    }
+
+    size_t k = (m_top_k > 0) ? std::min<size_t>(m_top_k, cands.size()) : cands.size();
+    std::partial_sort(cands.begin(), cands.begin()+k, cands.end(), [](const Candidate & a, const Candidate & b) { return a.chi2 < b.chi2; });
+    for(size_t c = 0; c < k; ++c) {
+        rp reso;
+        reso.charge = 0;
+        reso.momentum.x = cands[c].lv.Px();
+        reso.momentum.y = cands[c].lv.Py();
+        reso.momentum.z = cands[c].lv.Pz();
+        reso.mass = cands[c].lv.M();
+        result.resonances.push_back(reso);
+        result.leg1.push_back(cands[c].i);
+        result.leg2.push_back(cands[c].j);
+        result.chi2.push_back(cands[c].chi2);
+        result.recoil_mass.push_back(cands[c].recoil);
+    }
+    return result;
+}
+
 
 // build the Z resonance based on the available leptons. Returns the best lepton pair compatible with the Z mass and recoil at 125 GeV
 // technically, it returns a ReconstructedParticleData object with index 0 the di-lepton system, index and 2 the leptons of the pair
+// as in the original permutation loop, an event with a single opposite-charge pair returns legs 0 and 1 after the resonance, and
+// one without such a pair only legs 0 and 1; resonanceBuilder_pairs gives the legs of the pair in all cases.
+// Events with fewer than two legs, which used to exit the process, return an empty collection
 struct resonanceBuilder_mass_recoil {
     float m_resonance_mass;
     float m_recoil_mass;
@@ -240,106 +568,20 @@ resonanceBuilder_mass_recoil::resonanceBuilder_mass_recoil(float arg_resonance_m
 
 Vec_rp resonanceBuilder_mass_recoil::resonanceBuilder_mass_recoil::operator()(Vec_rp legs, Vec_i recind, Vec_i mcind, Vec_rp reco, Vec_mc mc, Vec_i parents, Vec_i daugthers) {
     Vec_rp result;
+    // the two best candidates, to tell events with a single pair apart
+    auto cands = resonanceBuilder_pairs(m_resonance_mass, m_recoil_mass, chi2_recoil_frac, ecm, m_use_MC_Kinematics, 2)(legs, recind, mcind, reco, mc);
+    if(cands.status == 1) return result;
     result.reserve(3);
-    std::vector<std::vector<int>> pairs; // for each permutation, add the indices of the muons
-    int n = legs.size();
-
-    if(n > 1) {
-        ROOT::VecOps::RVec<bool> v(n);
-        std::fill(v.end() - 2, v.end(), true); // helper variable for permutations
-        do {
-            std::vector<int> pair;
-            rp reso;
-            reso.charge = 0;
-            TLorentzVector reso_lv; 
-            for(int i = 0; i < n; ++i) {
-                if(v[i]) {
-                    pair.push_back(i);
-                    reso.charge += legs[i].charge;
-                    TLorentzVector leg_lv;
-
-                    if(m_use_MC_Kinematics) { // MC kinematics
-                        int track_index = legs[i].tracks_begin;   // index in the Track array
-                        int mc_index = ReconstructedParticle2MC::getTrack2MC_index(track_index, recind, mcind, reco);
-                        if (mc_index >= 0 && mc_index < mc.size()) {
-                            leg_lv.SetXYZM(mc.at(mc_index).momentum.x, mc.at(mc_index).momentum.y, mc.at(mc_index).momentum.z, mc.at(mc_index).mass);
-                        }
-                    }
-                    else { // reco kinematics
-                         leg_lv.SetXYZM(legs[i].momentum.x, legs[i].momentum.y, legs[i].momentum.z, legs[i].mass);
-                    }
-                    reso_lv += leg_lv;
-                }
-            }
-
-            if(reso.charge != 0) continue; // neglect non-zero charge pairs
-            reso.momentum.x = reso_lv.Px();
-            reso.momentum.y = reso_lv.Py();
-            reso.momentum.z = reso_lv.Pz();
-            reso.mass = reso_lv.M();
-            result.emplace_back(reso);
-            pairs.push_back(pair);
-
-        } while(std::next_permutation(v.begin(), v.end()));
+    if(cands.status == 0) result.push_back(cands.resonances[0]);
+    if(cands.resonances.size() > 1) {
+        result.push_back(legs[cands.leg1[0]]);
+        result.push_back(legs[cands.leg2[0]]);
     }
     else {
-        std::cout << "ERROR: resonanceBuilder_mass_recoil, at least two leptons required." << std::endl;
-        exit(1);
-    }
-
-    if(result.size() > 1) {
-
-        Vec_rp bestReso;
-        int idx_min = -1;
-        float d_min = 9e9;
-        for (int i = 0; i < result.size(); ++i) {
-            
-            // calculate recoil
-            auto recoil_p4 = TLorentzVector(0, 0, 0, ecm);
-            TLorentzVector tv1;
-            tv1.SetXYZM(result.at(i).momentum.x, result.at(i).momentum.y, result.at(i).momentum.z, result.at(i).mass);
-            recoil_p4 -= tv1;
-
-            auto recoil_fcc = edm4hep::ReconstructedParticleData();
-            recoil_fcc.momentum.x = recoil_p4.Px();
-            recoil_fcc.momentum.y = recoil_p4.Py();
-            recoil_fcc.momentum.z = recoil_p4.Pz();
-            recoil_fcc.mass = recoil_p4.M();
-
-            TLorentzVector tg;
-            tg.SetXYZM(result.at(i).momentum.x, result.at(i).momentum.y, result.at(i).momentum.z, result.at(i).mass);
-
-            float boost = tg.P();
-            float mass = std::pow(result.at(i).mass - m_resonance_mass, 2); // mass
-            float rec = std::pow(recoil_fcc.mass - m_recoil_mass, 2); // recoil
-            float d = (1.0-chi2_recoil_frac)*mass + chi2_recoil_frac*rec;
-
-            if(d < d_min) {
-                d_min = d;
-                idx_min = i;
-            }
-
-        }
-        if(idx_min > -1) { 
-            bestReso.push_back(result.at(idx_min));
-            auto & l1 = legs[pairs[idx_min][0]];
-            auto & l2 = legs[pairs[idx_min][1]];
-            bestReso.emplace_back(l1);
-            bestReso.emplace_back(l2);
-        }
-        else {
-            std::cout << "ERROR: resonanceBuilder_mass_recoil, no mininum found." << std::endl;
-            exit(1);
-        }
-        return bestReso;
-    }
-    else {
-        auto & l1 = legs[0];
-        auto & l2 = legs[1];
-        result.emplace_back(l1);
-        result.emplace_back(l2);
-        return result;
+        result.push_back(legs[0]);
+        result.push_back(legs[1]);
     }
+    return result;
 }
 
 
@@ -364,12 +606,99 @@ Vec_f energy_imbalance(Vec_rp in) {
     return result;
 }
 
+
+// event-level quantities of a reco particle collection, filled by eventSummary in one pass over the particles.
+// Each member is equal to the result of the corresponding function
+struct EventSummary {
+    float visible_energy = 0;  // visibleEnergy(in, p_cutoff)
+    float visible_mass = 0;    // visibleMass(in, p_cutoff)
+    float missing_mass = 0;    // missingMass(ecm, in, p_cutoff)
+    float missing_px = 0, missing_py = 0, missing_pz = 0, missing_e = 0;  // missingEnergy(ecm, in, p_cutoff)
+    float e_tot = 0, e_trans = 0, e_long = 0;  // energy_imbalance(in), all particles
+    float acolinearity = -999;  // acolinearity(in), first two particles
+    float acoplanarity = -999;  // acoplanarity(in), first two particles
+
+    Vec_rp missing() const;
+    Vec_f imbalance() const;
+};
+
+// same as missingEnergy
+Vec_rp EventSummary::missing() const {
+    Vec_rp ret;
+    rp res;
+    res.momentum.x = missing_px;
+    res.momentum.y = missing_py;
+    res.momentum.z = missing_pz;
+    res.energy = missing_e;
+    ret.emplace_back(res);
+    return ret;
+}
+
+// same as energy_imbalance
+Vec_f EventSummary::imbalance() const {
+    return Vec_f{e_tot, e_trans, e_long};
+}
+
+// visibleEnergy, missingEnergy, visibleMass, missingMass, energy_imbalance, acolinearity and acoplanarity
+// of the collection, with the same arithmetic as these functions
+EventSummary eventSummary(float ecm, const Vec_rp & in, float p_cutoff = 0.0) {
+    EventSummary result;
+    float px = 0, py = 0, pz = 0, e = 0;     // visible, particles above p_cutoff
+    float mpx = 0, mpy = 0, mpz = 0;         // missing, summed as in missingEnergy
+    float e_tot = 0, e_trans = 0, e_long = 0;  // energy imbalance, all particles
+    for(auto &p : in) {
+        float mag = std::sqrt(p.momentum.x*p.momentum.x + p.momentum.y*p.momentum.y + p.momentum.z*p.momentum.z);
+        float cost = p.momentum.z / mag;
+        float sint =  std::sqrt(p.momentum.x*p.momentum.x + p.momentum.y*p.momentum.y) / mag;
+        if(p.momentum.y < 0) sint *= -1.0;
+        e_tot += p.energy;
+        e_long += cost*p.energy;
+        e_trans += sint*p.energy;
+
+        if (std::sqrt(p.momentum.x * p.momentum.x + p.momentum.y*p.momentum.y) < p_cutoff) continue;
+        px += p.momentum.x;
+        py += p.momentum.y;
+        pz += p.momentum.z;
+        mpx += -p.momentum.x;
+        mpy += -p.momentum.y;
+        mpz += -p.momentum.z;
+        e += p.energy;
+    }
+
+    result.visible_energy = e;
+    result.missing_px = mpx;
+    result.missing_py = mpy;
+    result.missing_pz = mpz;
+    result.missing_e = ecm-e;
+    result.e_tot = e_tot;
+    result.e_trans = std::abs(e_trans);
+    result.e_long = std::abs(e_long);
+
+    float ptot2 = std::pow(px, 2) + std::pow(py, 2) + std::pow(pz, 2);
+    float de2 = std::pow(e, 2);
+    result.visible_mass = (de2 < ptot2) ? -999. : std::sqrt(de2 - ptot2);
+    float dm2 = std::pow(ecm - e, 2);
+    if(ecm < e) result.missing_mass = -99.;
+    else result.missing_mass = (dm2 < ptot2) ? -999. : std::sqrt(dm2 - ptot2);
+
+    if(in.size() >= 2) {
+        TVector3 v1(in[0].momentum.x, in[0].momentum.y, in[0].momentum.z);
+        TVector3 v2(in[1].momentum.x, in[1].momentum.y, in[1].momentum.z);
+        result.acolinearity = std::acos(v1.Dot(v2)/(v1.Mag()*v2.Mag())*(-1.));
+        float acop = abs(v1.Phi() - v2.Phi());
+        if(acop > M_PI) acop = 2 * M_PI - acop;
+        acop = M_PI - acop;
+        result.acoplanarity = acop;
+    }
+    return result;
+}
+
 Vec_f get_costheta(Vec_rp in) {
-    Vec_f result;
-    for (auto & p: in) {
-        TLorentzVector tlv;
-        tlv.SetXYZM(p.momentum.x, p.momentum.y, p.momentum.z, p.mass);
-        result.push_back(std::cos(tlv.Theta()));
+    Vec_f result(in.size());
+    for (size_t i = 0; i < in.size(); ++i) {
+        const auto & mom = in[i].momentum;
+        float p = std::sqrt(mom.x*mom.x + mom.y*mom.y + mom.z*mom.z);
+        result[i] = (p == 0) ? 1.f : mom.z/p;
     }
     return result;
 }
@@ -16,21 +16,34 @@ Vec_tlv makeLorentzVectors(Vec_mc in) {
     return result;
 }
 
-Vec_mc getRP2MC(Vec_rp in, ROOT::VecOps::RVec<int> recind, ROOT::VecOps::RVec<int> mcind, ROOT::VecOps::RVec<edm4hep::ReconstructedParticleData> reco, ROOT::VecOps::RVec<edm4hep::MCParticleData> mc) {
+// gen-level particles matched to the reco particles, using the association index from getTrack2MC_indices
+// unmatched particles are skipped, see getRP2MC_unmatched
+Vec_mc getRP2MC(Vec_rp in, const Vec_i & track2mc, const Vec_mc & mc) {
     Vec_mc result;
+    result.reserve(in.size());
     for (auto & p: in) {
-        int track_index = p.tracks_begin;
-        int mc_index = ReconstructedParticle2MC::getTrack2MC_index(track_index, recind, mcind, reco);
+        int mc_index = getTrack2MC_index(p.tracks_begin, track2mc);
         if(mc_index >= 0 && mc_index < mc.size() ) {
-            result.push_back(mc.at(mc_index));
-        }
-        else {
-            cout << "MC track not found!" << endl;
+            result.push_back(mc[mc_index]);
         }
     }
     return result;
 }
 
+Vec_mc getRP2MC(Vec_rp in, ROOT::VecOps::RVec<int> recind, ROOT::VecOps::RVec<int> mcind, ROOT::VecOps::RVec<edm4hep::ReconstructedParticleData> reco, ROOT::VecOps::RVec<edm4hep::MCParticleData> mc) {
+    return getRP2MC(in, getTrack2MC_indices(recind, mcind, reco), mc);
+}
+
+// number of reco particles without a gen-level match
+int getRP2MC_unmatched(Vec_rp in, const Vec_i & track2mc, const Vec_mc & mc) {
+    int result = 0;
+    for (auto & p: in) {
+        int mc_index = getTrack2MC_index(p.tracks_begin, track2mc);
+        if(mc_index < 0 || mc_index >= mc.size()) result++;
+    }
+    return result;
+}
+
 }
 
 
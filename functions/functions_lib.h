@@ -0,0 +1,24 @@
+#ifndef FCCPhysicsFunctionsLib_H
+#define FCCPhysicsFunctionsLib_H
+
+// functions.h and functions_gen.h with the headers they need, compiled into a shared library by library.py;
+// when JIT-compiled, these come with libFCCAnalyses
+
+#include <algorithm>
+#include <cmath>
+#include <numeric>
+#include <utility>
+#include <vector>
+
+#include "TLorentzVector.h"
+#include "TVector3.h"
+#include "Math/Vector4D.h"
+#include "ROOT/RVec.hxx"
+#include "edm4hep/MCParticleData.h"
+#include "edm4hep/ReconstructedParticleData.h"
+#include "FCCAnalyses/defines.h"
+
+#include "functions.h"
+#include "functions_gen.h"
+
+#endif
@@ -0,0 +1,224 @@
+#ifndef FCCPhysicsHistFill_H
+#define FCCPhysicsHistFill_H
+
+#include <atomic>
+#include <cstdint>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <vector>
+
+#include "TH1D.h"
+#include "ROOT/RDataFrame.hxx"
+#include "ROOT/RDF/RActionImpl.hxx"
+#include "ROOT/TThreadExecutor.hxx"
+
+namespace FCCAnalyses { namespace SharedHist {
+
+// statistics of the in-range fills of one thread slot, padded to avoid false sharing between slots
+struct alignas(64) SlotStats {
+    double sumw = 0, sumw2 = 0, sumwx = 0, sumwx2 = 0;
+    long long entries = 0;
+};
+
+// 1D histogram with fixed bins filled by all thread slots into nGroups shared copies (slot % nGroups),
+// instead of one TH1D (contents and sum of squared weights) per slot:
+//   - unit weights are counted in 32-bit integers, 4 bytes per bin and group
+//   - weights are summed in doubles, with the sum of squared weights
+// bins are updated atomically, and the groups are summed with a parallel tree reduction at the end.
+// The result is the TH1D RDataFrame's Histo1D fills from the same model, with the same contents and statistics.
+class Histo1D : public ROOT::Detail::RDF::RActionImpl<Histo1D> {
+
+public:
+    using Result_t = TH1D;
+
+private:
+    std::shared_ptr<TH1D> result;
+    int nbins;
+    double xmin, xmax;
+    unsigned int nGroups;
+    bool weighted;
+    std::unique_ptr<std::atomic<uint32_t>[]> counts;  // nGroups*(nbins+2), unit weights
+    std::unique_ptr<std::atomic<double>[]> sumw, sumw2;  // nGroups*(nbins+2), weighted
+    std::map<size_t, unsigned long long> wrapped;  // 2^32 multiples of the counts that wrapped around
+    std::unique_ptr<std::mutex> wrappedMutex;
+    std::vector<SlotStats> stats;
+
+    void allocate(unsigned int nSlots) {
+        size_t n = size_t(nGroups)*(nbins + 2);
+        if(weighted) {
+            sumw.reset(new std::atomic<double>[n]);
+            sumw2.reset(new std::atomic<double>[n]);
+            for(size_t i = 0; i < n; ++i) sumw[i] = sumw2[i] = 0;
+        }
+        else {
+            counts.reset(new std::atomic<uint32_t>[n]);
+            for(size_t i = 0; i < n; ++i) counts[i] = 0;
+        }
+        wrappedMutex.reset(new std::mutex);
+        stats.assign(nSlots, SlotStats());
+    }
+
+    // same as TAxis::FindBin for fixed bins
+    int bin_of(double x) const {
+        if(x < xmin) return 0;
+        if(!(x < xmax)) return nbins + 1;
+        return 1 + int(nbins*(x - xmin)/(xmax - xmin));
+    }
+
+    static void add(std::atomic<double> & a, double v) {
+        double old = a.load(std::memory_order_relaxed);
+        while(!a.compare_exchange_weak(old, old + v, std::memory_order_relaxed));
+    }
+
+    void fill(unsigned int slot, double x) {
+        int bin = bin_of(x);
+        size_t i = size_t(slot % nGroups)*(nbins + 2) + bin;
+        if(counts[i].fetch_add(1, std::memory_order_relaxed) == UINT32_MAX) {
+            std::lock_guard<std::mutex> lock(*wrappedMutex);
+            wrapped[i] += 1;
+        }
+        auto & s = stats[slot];
+        s.entries += 1;
+        if(bin == 0 || bin > nbins) return;
+        s.sumw += 1;
+        s.sumw2 += 1;
+        s.sumwx += x;
+        s.sumwx2 += x*x;
+    }
+
+    void fill(unsigned int slot, double x, double w) {
+        int bin = bin_of(x);
+        size_t i = size_t(slot % nGroups)*(nbins + 2) + bin;
+        add(sumw[i], w);
+        add(sumw2[i], w*w);
+        auto & s = stats[slot];
+        s.entries += 1;
+        if(bin == 0 || bin > nbins) return;
+        s.sumw += w;
+        s.sumw2 += w*w;
+        s.sumwx += w*x;
+        s.sumwx2 += w*x*x;
+    }
+
+public:
+    Histo1D(const std::shared_ptr<TH1D> & arg_result, unsigned int nSlots, unsigned int arg_nGroups, bool arg_weighted) :
+        result(arg_result), nbins(arg_result->GetNbinsX()), xmin(arg_result->GetXaxis()->GetXmin()),
+        xmax(arg_result->GetXaxis()->GetXmax()), nGroups(std::max(1u, std::min(arg_nGroups, nSlots))), weighted(arg_weighted) {
+        allocate(nSlots);
+    }
+
+    Histo1D(const std::string & name, const std::string & title, int arg_nbins, double arg_xmin, double arg_xmax,
+            unsigned int nSlots, unsigned int arg_nGroups, bool arg_weighted) :
+        Histo1D(std::make_shared<TH1D>(name.c_str(), title.c_str(), arg_nbins, arg_xmin, arg_xmax), nSlots, arg_nGroups, arg_weighted) {
+        result->SetDirectory(nullptr);
+    }
+
+    Histo1D(Histo1D &&) = default;
+    Histo1D(const Histo1D &) = delete;
+
+    std::shared_ptr<TH1D> GetResultPtr() const { return result; }
+    void Initialize() {}
+    void InitTask(TTreeReader *, unsigned int) {}
+    std::string GetActionName() { return "SharedHisto1D"; }
+
+    template <typename X>
+    void Exec(unsigned int slot, const X & x) { fill(slot, x); }
+
+    template <typename X>
+    void Exec(unsigned int slot, const ROOT::VecOps::RVec<X> & xs) {
+        for(auto & x : xs) fill(slot, x);
+    }
+
+    template <typename X, typename W>
+    void Exec(unsigned int slot, const X & x, const W & w) { fill(slot, x, w); }
+
+    template <typename X, typename W>
+    void Exec(unsigned int slot, const ROOT::VecOps::RVec<X> & xs, const W & w) {
+        for(auto & x : xs) fill(slot, x, w);
+    }
+
+    template <typename X, typename W>
+    void Exec(unsigned int slot, const ROOT::VecOps::RVec<X> & xs, const ROOT::VecOps::RVec<W> & ws) {
+        for(size_t i = 0; i < xs.size(); ++i) fill(slot, xs[i], ws[i]);
+    }
+
+    void Finalize() {
+        // tree reduction of the groups into group 0: in each round, group g + stride is added to group g
+        size_t n = nbins + 2;
+        ROOT::TThreadExecutor pool;
+        for(unsigned int stride = 1; stride < nGroups; stride *= 2) {
+            std::vector<unsigned int> targets;
+            for(unsigned int g = 0; g + stride < nGroups; g += 2*stride) targets.push_back(g);
+            pool.Foreach([&](unsigned int g) {
+                for(size_t i = 0; i < n; ++i) {
+                    size_t a = size_t(g)*n + i, b = size_t(g + stride)*n + i;
+                    if(weighted) {
+                        sumw[a] = sumw[a] + sumw[b];
+                        sumw2[a] = sumw2[a] + sumw2[b];
+                    }
+                    else {
+                        // counts of group 0 can exceed 32 bits, the carries are kept in wrapped
+                        uint32_t ca = counts[a], cb = counts[b];
+                        counts[a] = ca + cb;
+                        if(uint32_t(ca + cb) < ca) {
+                            std::lock_guard<std::mutex> lock(*wrappedMutex);
+                            wrapped[a] += 1;
+                        }
+                    }
+                }
+            }, targets);
+        }
+
+        std::vector<unsigned long long> carry(n, 0);
+        for(auto & [i, c] : wrapped) carry[i % n] += c;
+        bool sumw2Stored = result->GetSumw2N() > 0;
+        for(size_t i = 0; i < n; ++i) {
+            double content = weighted ? double(sumw[i]) : double(counts[i]) + 4294967296.*carry[i];
+            result->SetBinContent(i, content);
+            if(sumw2Stored) result->GetSumw2()->fArray[i] = weighted ? double(sumw2[i]) : content;
+        }
+
+        double s[4] = {0, 0, 0, 0};
+        long long entries = 0;
+        for(auto & st : stats) {
+            s[0] += st.sumw;
+            s[1] += st.sumw2;
+            s[2] += st.sumwx;
+            s[3] += st.sumwx2;
+            entries += st.entries;
+        }
+        result->PutStats(s);
+        result->SetEntries(entries);
+
+        counts.reset();
+        sumw.reset();
+        sumw2.reset();
+    }
+
+    // copy for a systematic variation (see variations.py)
+    Histo1D MakeNew(void * newResult, std::string_view = "nominal") {
+        auto & h = *static_cast<std::shared_ptr<TH1D> *>(newResult);
+        h->Reset();
+        return Histo1D(h, stats.size(), nGroups, weighted);
+    }
+};
+
+// book a Histo1D on df, for column types X (and W)
+template <typename X>
+ROOT::RDF::RResultPtr<TH1D> book(ROOT::RDF::RNode df, const std::string & name, const std::string & title, int nbins,
+                                 double xmin, double xmax, const std::string & column, unsigned int nGroups) {
+    return df.Book<X>(Histo1D(name, title, nbins, xmin, xmax, df.GetNSlots(), nGroups, false), {column});
+}
+
+template <typename X, typename W>
+ROOT::RDF::RResultPtr<TH1D> book_weighted(ROOT::RDF::RNode df, const std::string & name, const std::string & title, int nbins,
+                                          double xmin, double xmax, const std::string & column, const std::string & weight,
+                                          unsigned int nGroups) {
+    return df.Book<X, W>(Histo1D(name, title, nbins, xmin, xmax, df.GetNSlots(), nGroups, true), {column, weight});
+}
+
+}}
+
+#endif
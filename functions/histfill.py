@@ -0,0 +1,55 @@
+"""
+Low-memory filling of large 1D histograms for many-core event loops.
+
+RDataFrame fills one TH1D per thread slot and merges them after the event
+loop: with nCPUS = 128 and the 20000-bin histograms of z_mumu_afb.py, that is
+16 bytes per bin (contents and sum of squared weights) times 128 replicas per
+histogram, and a serial merge at the end. With a SharedFiller attached to a
+Graph (runner.py --sharedHists), Histo1D nodes with fixed bins and at least
+minBins bins are booked with FCCAnalyses::SharedHist (histfill.h) instead:
+
+  - all slots fill nGroups shared copies with atomic updates, so the memory
+    does not grow with the number of threads (1 group: a single copy),
+  - unit weights are counted in 32-bit integers (4 bytes per bin and group),
+  - the copies are summed with a parallel tree reduction.
+
+The result is a TH1D with the contents and statistics of Histo1D.
+"""
+
+import os
+
+import ROOT
+
+
+class SharedFiller:
+
+    def __init__(self, nGroups=4, minBins=1000):
+        self.nGroups = nGroups
+        self.minBins = minBins
+        self.included = False
+
+    def include(self):
+        if not self.included:
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "histfill.h")
+            if not ROOT.gInterpreter.Declare(f'#include "{path}"'):
+                raise RuntimeError(f"Cannot include {path}")
+            self.included = True
+
+    def supports(self, node):
+        # Histo1D with a (name, title, nbins, xmin, xmax) model and enough bins
+        if node.op != "Histo1D" or not isinstance(node.args[0], tuple) or len(node.args[0]) != 5:
+            return False
+        return node.args[0][2] >= self.minBins
+
+    def book(self, node, rdf):
+        if not self.supports(node):
+            return getattr(rdf, node.op)(*node.args)
+        self.include()
+        (name, title, nbins, xmin, xmax), column, *weight = node.args
+        nodeRdf = ROOT.RDF.AsRNode(rdf)
+        types = [str(rdf.GetColumnType(c)) for c in [column] + weight]
+        if weight:
+            book = ROOT.FCCAnalyses.SharedHist.book_weighted[types[0], types[1]]
+            return book(nodeRdf, name, title, nbins, xmin, xmax, column, weight[0], self.nGroups)
+        book = ROOT.FCCAnalyses.SharedHist.book[types[0]]
+        return book(nodeRdf, name, title, nbins, xmin, xmax, column, self.nGroups)
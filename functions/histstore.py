@@ -0,0 +1,128 @@
+"""
+In-memory store of the histograms written by the analysis (output/{proc}.root).
+
+All requested histograms and the metadata (crossSection, eventsProcessed) of
+all processes are read once into NumPy arrays. The arrays are also written to
+a memory-mapped cache next to the ROOT files, keyed on the file modification
+time and size, so later scripts read them back without opening the ROOT files.
+
+    store = HistStore(procs, ["cutFlow", "invariant_mass"])
+    values, edges = store.get(procs[0], "cutFlow")
+    values, edges = store.get(procs[0], "cutFlow", lumi=44.84)  # normalized
+    stacked, edges = store.stack("invariant_mass", lumi=44.84)   # shape (len(procs), nbins)
+
+The contents of 2D histograms are stored flattened (x major), with the x-axis
+edges.
+"""
+
+import os
+import json
+
+import numpy as np
+
+
+class HistStore:
+
+    def __init__(self, procs, hNames, inputDir="output", cacheDir=None):
+        self.procs = list(procs)
+        self.hNames = list(hNames)
+        self.inputDir = inputDir
+        self.cacheDir = cacheDir if cacheDir is not None else os.path.join(inputDir, ".histcache")
+        self.hists = {}  # (proc, hName) -> {"values", "variances", "edges", "labels"}
+        self.meta = {}  # proc -> {"crossSection", "eventsProcessed"}
+        self.normalized = {}
+        for proc in self.procs:
+            self.load(proc)
+
+    def file_key(self, proc):
+        st = os.stat(f"{self.inputDir}/{proc}.root")
+        return [st.st_mtime_ns, st.st_size]
+
+    def load(self, proc):
+        if not self.load_cache(proc):
+            self.load_root(proc)
+            self.write_cache(proc)
+
+    def load_root(self, proc):
+        import uproot
+        with uproot.open(f"{self.inputDir}/{proc}.root") as f:
+            self.meta[proc] = {"crossSection": float(f["crossSection"].value), "eventsProcessed": int(f["eventsProcessed"].value)}
+            for hName in self.hNames:
+                h = f[hName]
+                labels = h.axis().labels()
+                self.hists[(proc, hName)] = {
+                    "values": np.asarray(h.values(), dtype=np.float64).ravel(),
+                    "variances": np.asarray(h.variances(), dtype=np.float64).ravel(),
+                    "edges": np.asarray(h.axis().edges(), dtype=np.float64),
+                    "labels": list(labels) if labels is not None else None,
+                }
+
+    def cache_paths(self, proc):
+        return f"{self.cacheDir}/{proc}.npy", f"{self.cacheDir}/{proc}.json"
+
+    def load_cache(self, proc):
+        dataPath, indexPath = self.cache_paths(proc)
+        if not os.path.isfile(dataPath) or not os.path.isfile(indexPath):
+            return False
+        with open(indexPath) as f:
+            index = json.load(f)
+        if index["file"] != self.file_key(proc) or not set(self.hNames) <= set(index["hists"]):
+            return False
+        data = np.load(dataPath, mmap_mode="r")
+        self.meta[proc] = index["meta"]
+        for hName in self.hNames:
+            entry = index["hists"][hName]
+            h = {"labels": entry["labels"]}
+            for key in ("values", "variances", "edges"):
+                start, stop = entry[key]
+                h[key] = data[start:stop]
+            self.hists[(proc, hName)] = h
+        return True
+
+    def write_cache(self, proc):
+        # all arrays of a process concatenated into one file, the index holds the offsets
+        dataPath, indexPath = self.cache_paths(proc)
+        os.makedirs(self.cacheDir, exist_ok=True)
+        index = {"file": self.file_key(proc), "meta": self.meta[proc], "hists": {}}
+        arrays, offset = [], 0
+        for hName in self.hNames:
+            h = self.hists[(proc, hName)]
+            entry = {"labels": h["labels"]}
+            for key in ("values", "variances", "edges"):
+                entry[key] = [offset, offset+len(h[key])]
+                offset += len(h[key])
+                arrays.append(h[key])
+            index["hists"][hName] = entry
+        np.save(dataPath, np.concatenate(arrays) if arrays else np.zeros(0))
+        with open(indexPath, "w") as f:
+            json.dump(index, f)
+
+    def xsec(self, proc):
+        return self.meta[proc]["crossSection"]
+
+    def nevents(self, proc):
+        return self.meta[proc]["eventsProcessed"]
+
+    def scale(self, proc, lumi):
+        return lumi * self.xsec(proc) / self.nevents(proc)
+
+    def get(self, proc, hName, lumi=None, variances=False):
+        # (values, edges), normalized to lumi if given; with variances=True (values, variances, edges)
+        h = self.hists[(proc, hName)]
+        values, var = h["values"], h["variances"]
+        if lumi is not None:
+            key = (proc, hName, lumi)
+            if key not in self.normalized:
+                sf = self.scale(proc, lumi)
+                self.normalized[key] = (values*sf, var*sf**2)
+            values, var = self.normalized[key]
+        return (values, var, h["edges"]) if variances else (values, h["edges"])
+
+    def labels(self, proc, hName):
+        return self.hists[(proc, hName)]["labels"]
+
+    def stack(self, hName, procs=None, lumi=None):
+        # process-indexed array of shape (len(procs), nbins)
+        procs = self.procs if procs is None else procs
+        values = np.stack([self.get(proc, hName, lumi)[0] for proc in procs])
+        return values, self.hists[(procs[0], hName)]["edges"]
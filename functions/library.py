@@ -0,0 +1,133 @@
+"""
+Precompiled shared library of the C++ helpers in functions/.
+
+Every job including functions.h and functions_gen.h through includePaths
+parses and JIT-compiles them, with the ROOT and EDM4hep headers they need,
+before the first event. Built once with ACLiC,
+
+    python functions/library.py
+
+they are compiled with their dictionary into functions/build/libFCCPhysicsFunctions.so.
+The module configurations call include_paths() at import: it loads the
+library and leaves the headers it replaces out of includePaths, so the runner,
+its batch workers and `fccanalysis run` all skip their JIT compilation. When
+the library is missing, or older than one of the headers, the headers are
+JIT-compiled as before.
+
+--check measures the time to the first event of a graph calling the helpers,
+JIT-compiling the headers and with the library, each in a fresh process, and
+checks that with the library Cling resolves the helpers from its dictionary
+without parsing the headers:
+
+    python functions/library.py --check
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import ROOT
+
+baseDir = os.path.dirname(os.path.abspath(__file__))
+
+SOURCE = "functions_lib.h"
+HEADERS = ["functions.h", "functions_gen.h"]
+NAME = "libFCCPhysicsFunctions"
+
+
+def default_path():
+    return os.path.join(baseDir, "build", f"{NAME}.{ROOT.gSystem.GetSoExt()}")
+
+
+def headers():
+    # the headers compiled into the library
+    return [os.path.realpath(os.path.join(baseDir, h)) for h in [SOURCE] + HEADERS]
+
+
+def build(path=None, debug=False):
+    path = os.path.abspath(path or default_path())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ROOT.gSystem.Load("libFCCAnalyses")
+    # k: keep the library after the session, f: always rebuild, O/g: optimized/debug
+    opt = "kfg" if debug else "kfO"
+    if not ROOT.gSystem.CompileMacro(os.path.join(baseDir, SOURCE), opt, path, os.path.dirname(path)):
+        raise RuntimeError(f"Cannot build {path}")
+    return path
+
+
+def load(path):
+    # load the library at path, returns the headers it replaces, none if it cannot be used
+    if not os.path.isfile(path):
+        print(f"--> {path} not built, JIT-compiling the headers (python {os.path.relpath(__file__)} builds it)")
+        return []
+    if any(os.path.getmtime(h) > os.path.getmtime(path) for h in headers()):
+        print(f"--> {path} is older than the headers, JIT-compiling them (python {os.path.relpath(__file__)} rebuilds it)")
+        return []
+    ROOT.gSystem.Load("libFCCAnalyses")
+    if ROOT.gSystem.Load(path) < 0:
+        print(f"--> Cannot load {path}, JIT-compiling the headers")
+        return []
+    return headers()
+
+
+def include_paths(paths, path, moduleFile):
+    # the includePaths of a module without the headers replaced by the library at path, which is loaded;
+    # relative paths are relative to the directory of moduleFile
+    moduleDir = os.path.dirname(os.path.abspath(moduleFile))
+    replaced = set(load(os.path.normpath(os.path.join(moduleDir, path))))
+    return [p for p in paths if os.path.realpath(os.path.join(moduleDir, p)) not in replaced]
+
+
+def first_event(path=None):
+    # seconds from the start of the process to the first event of a graph calling the helpers, with the
+    # library at path (JIT-compiling the headers if None), and whether Cling parsed the headers
+    start = time.perf_counter()
+    ROOT.gSystem.Load("libFCCAnalyses")
+    if path is None or not load(path):
+        for h in HEADERS:
+            if not ROOT.gInterpreter.Declare(f'#include "{os.path.join(baseDir, h)}"'):
+                raise RuntimeError(f"Cannot include {h}")
+    df = ROOT.RDataFrame(1)
+    df = df.Define("factors", "FCCAnalyses::momentum_factors(2, 1.0001, 0.001, rdfentry_)")
+    df = df.Define("selected", "FCCAnalyses::sel_range(0, 1.1, false).mask(factors)")
+    df = df.Define("kin", "FCCAnalyses::get_kinematics(ROOT::VecOps::RVec<edm4hep::ReconstructedParticleData>(2))")
+    count = df.Filter("selected.size() == 2 && kin.n == 2").Count()
+    if count.GetValue() != 1:
+        raise RuntimeError("Unexpected result of the helpers")
+    parsed = [h for h in HEADERS if ROOT.gInterpreter.IsLoaded(os.path.join(baseDir, h))]
+    return {"time": time.perf_counter() - start, "parsed": parsed}
+
+
+def check(path=None):
+    # first_event() JIT-compiling the headers and with the library, each in a fresh process
+    path = os.path.abspath(path or default_path())
+    results = {}
+    for name, args in (("jit", []), ("library", ["--out", path])):
+        out = subprocess.run([sys.executable, __file__, "--first-event"] + args, check=True, capture_output=True, text=True).stdout
+        results[name] = json.loads(out.strip().splitlines()[-1])
+    print(f"--> time to the first event: {results['jit']['time']:.2f} s JIT-compiling the headers, "
+          f"{results['library']['time']:.2f} s with {path}")
+    parsed = results["library"]["parsed"]
+    print(f"--> headers parsed with the library: {', '.join(parsed) if parsed else 'none'}")
+    return not parsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", type=str, default=None, help="Path of the library (default: functions/build/libFCCPhysicsFunctions.so)")
+    parser.add_argument("--debug", action="store_true", help="Build with debug symbols instead of optimizations")
+    parser.add_argument("--check", action="store_true", help="Measure the time to the first event with and without the library, and check that it avoids parsing the headers")
+    parser.add_argument("--first-event", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    ROOT.gROOT.SetBatch(True)
+    if args.first_event:
+        print(json.dumps(first_event(args.out)))
+    elif args.check:
+        if not check(args.out):
+            raise SystemExit(1)
+    else:
+        print(f"--> written {build(args.out, args.debug)}")
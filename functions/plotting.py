@@ -0,0 +1,269 @@
+"""
+Parallel plot rendering with a cache of the figures already on disk.
+
+A Plot bundles a name, a draw function, the NumPy data it shows and its style.
+render() saves every plot in every format as an independent job in a pool of
+worker processes. The data is loaded once in the parent and inherited by the
+forked workers, only (plot index, format) is sent to them. A manifest in the
+output directory records a hash of the data, the style and the draw function
+per figure, so figures whose inputs are unchanged since the last run are not
+rendered again.
+
+    plots = [Plot("invariant_mass", draw_invariant_mass, {"values": values, "edges": edges}, style)]
+    render(plots, outDir)
+
+The draw function takes (data, style) and returns a matplotlib figure or a
+ROOT canvas. Run as a script, the module renders a plotting configuration in
+the format of `fccanalysis plots` (e.g. plots_root.py) with ROOT:
+
+    python ../functions/plotting.py plots_root.py -j 8
+"""
+
+import os
+import json
+import hashlib
+import inspect
+import argparse
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from histstore import HistStore
+
+MANIFEST = ".plots.json"
+
+_plots = []  # plots of the current render() call, inherited by the forked workers
+
+
+def update_hash(h, obj):
+    if isinstance(obj, np.ndarray):
+        h.update(str((obj.dtype, obj.shape)).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for k in sorted(obj, key=str):
+            h.update(repr(k).encode())
+            update_hash(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"{type(obj).__name__}{len(obj)}".encode())
+        for o in obj:
+            update_hash(h, o)
+    else:
+        h.update(repr(obj).encode())
+
+
+class Plot:
+
+    def __init__(self, name, draw, data, style=None, formats=("png", "pdf")):
+        self.name = name
+        self.draw = draw
+        self.data = data
+        self.style = style if style is not None else {}
+        self.formats = list(formats)
+
+    def key(self):
+        h = hashlib.sha1()
+        try:
+            h.update(inspect.getsource(self.draw).encode())
+        except (OSError, TypeError):
+            h.update(self.draw.__qualname__.encode())
+        update_hash(h, self.data)
+        update_hash(h, self.style)
+        return h.hexdigest()
+
+    def path(self, outDir, fmt):
+        return os.path.join(outDir, f"{self.name}.{fmt}")
+
+
+def save(fig, path):
+    if hasattr(fig, "savefig"):
+        import matplotlib.pyplot as plt
+        fig.savefig(path, bbox_inches="tight")
+        plt.close(fig)
+    else:
+        fig.SaveAs(path)
+
+
+def render_job(index, fmt, outDir):
+    plot = _plots[index]
+    path = plot.path(outDir, fmt)
+    save(plot.draw(plot.data, plot.style), path)
+    return path
+
+
+def load_manifest(outDir):
+    path = os.path.join(outDir, MANIFEST)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(outDir, manifest):
+    path = os.path.join(outDir, MANIFEST)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def render(plots, outDir, nProcs=None, force=False):
+    # render the plots whose inputs changed since the last run, returns the written paths
+    global _plots
+    os.makedirs(outDir, exist_ok=True)
+    manifest = {} if force else load_manifest(outDir)
+
+    jobs = []
+    keys = [plot.key() for plot in plots]
+    for i, plot in enumerate(plots):
+        for fmt in plot.formats:
+            out = f"{plot.name}.{fmt}"
+            if manifest.get(out) != keys[i] or not os.path.isfile(plot.path(outDir, fmt)):
+                jobs.append((i, fmt))
+    nSkipped = sum(len(plot.formats) for plot in plots) - len(jobs)
+    print(f"--> {len(jobs)} figures to render, {nSkipped} unchanged")
+    if not jobs:
+        return []
+
+    _plots = plots
+    written, failed = [], []
+    nProcs = min(nProcs or os.cpu_count(), len(jobs))
+    with ProcessPoolExecutor(nProcs, mp_context=multiprocessing.get_context("fork")) as pool:
+        futures = {pool.submit(render_job, i, fmt, outDir): (i, fmt) for i, fmt in jobs}
+        for future in as_completed(futures):
+            i, fmt = futures[future]
+            out = f"{plots[i].name}.{fmt}"
+            try:
+                written.append(future.result())
+            except Exception as e:
+                print(f"----> failed to render {out}: {e!r}")
+                manifest.pop(out, None)
+                failed.append(out)
+                continue
+            manifest[out] = keys[i]
+    _plots = []
+    write_manifest(outDir, manifest)
+    if failed:
+        raise RuntimeError(f"Failed to render {', '.join(sorted(failed))}")
+    return written
+
+
+def load_config(path):
+    path = os.path.abspath(path)
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+    config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+    return config
+
+
+def rebin(values, edges, factor):
+    n = len(values) // factor * factor
+    return values[:n].reshape(-1, factor).sum(axis=1), edges[:n+1:factor]
+
+
+def draw_root(data, style):
+    # stacked (or overlaid) histograms of the plotting configuration, drawn with ROOT
+    import ROOT
+    ROOT.gROOT.SetBatch(True)
+    ROOT.gStyle.SetOptStat(0)
+    ROOT.gStyle.SetOptTitle(0)
+
+    edges = np.asarray(data["edges"], dtype=np.float64)
+    canvas = ROOT.TCanvas("c", "c", 800, 800)
+    canvas.SetLogy(style.get("logy", False))
+    canvas.SetLeftMargin(0.14)
+    canvas.SetBottomMargin(0.15 if isinstance(style.get("xtitle"), list) else 0.12)
+
+    stack = ROOT.THStack("stack", "")
+    leg = ROOT.TLegend(0.6, 0.7, 0.9, 0.88)
+    leg.SetBorderSize(0)
+    leg.SetFillStyle(0)
+    keep = [stack, leg]
+    for group, values in zip(data["groups"], data["values"]):
+        h = ROOT.TH1D(f"h_{group}", "", len(edges)-1, edges)
+        h.SetDirectory(0)
+        for b, v in enumerate(values):
+            h.SetBinContent(b+1, v)
+        color = style["colors"].get(group, ROOT.kBlack)
+        h.SetLineColor(ROOT.kBlack if style.get("stack", False) else color)
+        h.SetLineWidth(1 if style.get("stack", False) else 2)
+        if style.get("stack", False):
+            h.SetFillColor(color)
+        stack.Add(h)
+        leg.AddEntry(h, style["legend"].get(group, group), "F" if style.get("stack", False) else "L")
+        keep.append(h)
+
+    stack.Draw("HIST" if style.get("stack", False) else "HIST NOSTACK")
+    stack.GetXaxis().SetRangeUser(style.get("xmin", edges[0]), style.get("xmax", edges[-1]))
+    if "ymin" in style:
+        stack.SetMinimum(style["ymin"])
+    if "ymax" in style:
+        stack.SetMaximum(style["ymax"])
+    xtitle = style.get("xtitle", "")
+    if isinstance(xtitle, list):
+        for b, label in enumerate(xtitle):
+            stack.GetXaxis().SetBinLabel(b+1, label)
+    else:
+        stack.GetXaxis().SetTitle(xtitle)
+    stack.GetYaxis().SetTitle(style.get("ytitle", "Events"))
+    stack.GetYaxis().SetTitleOffset(1.5)
+    leg.Draw()
+
+    latex = ROOT.TLatex()
+    latex.SetNDC()
+    latex.SetTextSize(0.035)
+    latex.DrawLatex(0.15, 0.91, f"#bf{{{style['collider']}}} #it{{Simulation}}")
+    latex.DrawLatex(0.6, 0.91, f"{style['intLumiLabel']} ({style['energy']} GeV)")
+    latex.DrawLatex(0.18, 0.84, style["ana_tex"])
+    canvas.keep = keep
+    return canvas
+
+
+def config_plots(config, store, lumi=None):
+    # one Plot per entry of config.hists, the process groups are summed in the parent.
+    # Without lumi the histograms are multiplied by config.intLumi (i.e. assumed to be scaled
+    # already), with lumi the unscaled histograms are normalized to lumi (in pb-1)
+    groups = {**config.procs.get("signal", {}), **config.procs.get("backgrounds", {})}
+    plots = []
+    for name, cfg in config.hists.items():
+        hName = cfg.get("output", name)
+        perGroup = []
+        for group, procList in groups.items():
+            values, edges = store.stack(hName, procList, lumi=lumi)
+            values = values.sum(axis=0) * (config.intLumi if lumi is None else 1)
+            if cfg.get("rebin", 1) > 1:
+                values, edges = rebin(values, edges, cfg["rebin"])
+            perGroup.append(values)
+        # signal on top of the stack
+        data = {"groups": list(groups)[::-1], "values": perGroup[::-1], "edges": edges}
+        style = {k: v for k, v in cfg.items() if k not in ("output", "rebin")}
+        style.update(colors=config.colors, legend=config.legend, collider=config.collider, energy=config.energy,
+                     ana_tex=config.ana_tex, intLumiLabel=config.intLumiLabel if lumi is None else f"L = {lumi:g} pb^{{-1}}")
+        plots.append(Plot(name, draw_root, data, style, config.formats))
+    return plots
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", help="Plotting configuration (e.g. plots_root.py)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--force", action="store_true", help="Render all figures, also the unchanged ones")
+    parser.add_argument("--lumi", type=float, nargs="+", help="Normalize the (unscaled) histograms to these luminosities in pb-1, one set of figures in outdir/lumi_{value} per value")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    groups = {**config.procs.get("signal", {}), **config.procs.get("backgrounds", {})}
+    procs = sorted({proc for procList in groups.values() for proc in procList})
+    outputs = sorted({cfg.get("output", name) for name, cfg in config.hists.items()})
+    store = HistStore(procs, outputs, inputDir=config.inputDir.rstrip("/"))
+
+    if args.lumi:
+        plots = []
+        for lumi in args.lumi:
+            for plot in config_plots(config, store, lumi):
+                plot.name = f"lumi_{lumi:g}/{plot.name}"
+                plots.append(plot)
+            os.makedirs(os.path.join(config.outdir, f"lumi_{lumi:g}"), exist_ok=True)
+    else:
+        plots = config_plots(config, store)
+    render(plots, config.outdir, nProcs=args.jobs, force=args.force)
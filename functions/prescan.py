@@ -0,0 +1,147 @@
+"""
+Entry lists of the candidate events of every input file, from a cheap prescan.
+
+Most background events have no reconstructed muon, yet the event loop reads
+ReconstructedParticles and builds the muon collection for each of them. A
+module that declares
+
+    prescan = ("Muon#0.index", 1)
+
+guarantees that events with fewer elements in this collection fail its first
+cut and fill no histogram. With runner.py --prescan, the sizes of the
+collection are read once per input file (only this light branch) and the
+entries with enough elements are stored as a TEntryList in prescanDir
+(default prescan/ next to the module), keyed on the file identity. The event
+loop then only reads the listed entries through a TChain with the entry list.
+
+The skipped events are still counted: they are added to eventsProcessed, to
+the sum of weights (the modules use unit weights) and to the cut-flow stages
+booked before any filter.
+"""
+
+import os
+import hashlib
+
+import numpy as np
+import ROOT
+
+from cutflow import CutFlow
+
+
+def spec_of(modules):
+    # the prescan common to all modules reading the same graph, None if they do not all declare the same
+    specs = {tuple(getattr(module, "prescan", ())) for module in modules}
+    if len(specs) != 1 or not next(iter(specs)):
+        return None
+    return next(iter(specs))
+
+
+def list_path(prescanDir, proc, identity, spec):
+    key = hashlib.sha1(f"{identity}:{spec!r}".encode()).hexdigest()[:16]
+    return f"{prescanDir}/{proc}/{key}.root"
+
+
+def scan(paths, spec):
+    # (entries with at least spec[1] elements in the collection spec[0], number of entries) of each file,
+    # in one event loop per file run concurrently
+    column, minSize = spec
+    results = []
+    for path in paths:
+        df = ROOT.RDataFrame("events", path).Alias("prescan_collection", column)
+        entries = df.Filter(f"prescan_collection.size() >= {int(minSize)}").Take["ULong64_t"]("rdfentry_")
+        results.append((entries, df.Count()))
+    ROOT.RDF.RunGraphs([count for entries, count in results])
+    return [(np.sort(np.array(entries.GetValue(), dtype=np.int64)), count.GetValue()) for entries, count in results]
+
+
+def write(path, inputPath, entries, nEntries):
+    elist = ROOT.TEntryList("entries", "", "events", inputPath)
+    for entry in entries:
+        elist.Enter(int(entry))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpPath = f"{path}.tmp{os.getpid()}"
+    fOut = ROOT.TFile(tmpPath, "RECREATE")
+    elist.Write("entries")
+    ROOT.TParameter(int)("nEntries", nEntries).Write()
+    fOut.Close()
+    os.replace(tmpPath, path)
+
+
+def chain(prescanDir, spec, proc, files, identity):
+    # TChain over files with the entry list of the candidate events, and the number of skipped events;
+    # files without a stored entry list are scanned first
+    paths = {path: list_path(prescanDir, proc, identity(path), spec) for path in files}
+    missing = [path for path in files if not os.path.isfile(paths[path])]
+    if missing:
+        print(f"--> {proc}: prescan of {len(missing)} files ({spec[0]} with >= {spec[1]} elements)")
+        for path, (entries, nEntries) in zip(missing, scan(missing, spec)):
+            write(paths[path], path, entries, nEntries)
+
+    ch = ROOT.TChain("events")
+    elist = ROOT.TEntryList("prescan", "")
+    nEntries, nListed = 0, 0
+    for path in files:
+        ch.Add(path)
+        fIn = ROOT.TFile(paths[path])
+        sub = fIn.Get("entries")
+        sub.SetTreeName("events")
+        sub.SetFileName(path)
+        elist.Add(sub)
+        nEntries += fIn.Get("nEntries").GetVal()
+        nListed += sub.GetN()
+        fIn.Close()
+    ch.SetEntryList(elist, "ne")
+    print(f"--> {proc}: reading {nListed} of {nEntries} events after the prescan")
+    return ch, elist, nEntries - nListed
+
+
+def filtered(node):
+    # whether a Filter is applied above node
+    parent = node.parent
+    while parent is not None:
+        if parent.op == "Filter":
+            return True
+        parent = parent.parent
+    return False
+
+
+class Skipped:
+    # result of the event loop plus the n skipped events of unit weight: a count, a sum of weights,
+    # or the TStatistic of a cut-flow stage (as N, W and W2)
+
+    def __init__(self, result, n):
+        self.result = result
+        self.n = n
+
+    def GetName(self):
+        return self.result.GetName()
+
+    def GetValue(self):
+        value = self.result.GetValue()
+        if isinstance(value, (int, float)):
+            return value + self.n
+        return SkippedStat(value, self.n)
+
+
+class SkippedStat:
+
+    def __init__(self, stat, n):
+        self.stat = stat
+        self.n = n
+
+    def GetN(self):
+        return self.stat.GetN() + self.n
+
+    def GetW(self):
+        return self.stat.GetW() + self.n
+
+    def GetW2(self):
+        return self.stat.GetW2() + self.n
+
+
+def add_skipped(hists, eventsProcessed, weightsum, n):
+    # count the skipped events in the results of a module
+    for h in hists:
+        if isinstance(h, CutFlow):
+            h.stats = {cut: s if filtered(s) else Skipped(s, n) for cut, s in h.stats.items()}
+    return hists, Skipped(eventsProcessed, n), Skipped(weightsum, n)
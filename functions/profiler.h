@@ -0,0 +1,64 @@
+#ifndef FCCPhysicsProfiler_H
+#define FCCPhysicsProfiler_H
+
+#include <chrono>
+#include <string>
+#include <vector>
+
+namespace FCCAnalyses { namespace Profiler {
+
+// counters of one graph node in one thread slot, padded to avoid false sharing between slots
+struct alignas(64) SlotStats {
+    long long ns = 0;      // time spent in the node
+    long long calls = 0;   // number of evaluations (events in)
+    long long passed = 0;  // events out (Filter nodes)
+    long long returned_bytes = 0;  // size of the returned values (Define nodes), see returned_bytes()
+};
+
+inline std::vector<std::string> names;
+inline std::vector<std::vector<SlotStats>> stats;
+
+// register a node before the event loop, returns its id
+inline int add(const std::string & name, unsigned int nSlots) {
+    names.push_back(name);
+    stats.emplace_back(nSlots);
+    return stats.size() - 1;
+}
+
+// size of a returned value: sizeof(T), or size()*sizeof(T) for the elements of a collection
+template <typename T> long long returned_bytes(const T &) { return sizeof(T); }
+template <typename T> long long returned_bytes(const ROOT::VecOps::RVec<T> & v) { return v.size()*sizeof(T); }
+
+// evaluate the expression of a Define node
+template <typename F> auto define(int id, unsigned int slot, F && f) {
+    auto & s = stats[id][slot];
+    auto start = std::chrono::steady_clock::now();
+    auto result = f();
+    s.ns += std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now() - start).count();
+    s.calls += 1;
+    s.returned_bytes += returned_bytes(result);
+    return result;
+}
+
+// evaluate the condition of a Filter node
+template <typename F> bool filter(int id, unsigned int slot, F && f) {
+    auto & s = stats[id][slot];
+    auto start = std::chrono::steady_clock::now();
+    bool result = f();
+    s.ns += std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now() - start).count();
+    s.calls += 1;
+    s.passed += result;
+    return result;
+}
+
+// count the events reaching an action (histograms), always passes
+inline bool count(int id, unsigned int slot) {
+    auto & s = stats[id][slot];
+    s.calls += 1;
+    s.passed += 1;
+    return true;
+}
+
+}}
+
+#endif
@@ -0,0 +1,130 @@
+"""
+Per-node profiling of the RDataFrame graphs built by the analysis modules.
+
+With a Profiler attached to a Graph (runner.py --profile), every Define and
+Filter expression is wrapped in a call to FCCAnalyses::Profiler (profiler.h)
+that measures, per thread slot, the time spent in the expression, the number
+of evaluations, the events passing (Filter) and the size of the returned
+values (Define, "returned_bytes": size()*sizeof(T) for collections, not the
+memory allocated while evaluating the expression). For histograms, the number
+of filled events is counted.
+
+The report is written as JSON, and in the folded format of flame graph tools
+(one line per node, the stack being the chain of filters above it). The runner
+writes one report per module, with the nodes the module requested; nodes
+shared by several modules (see rdfgraph.py) appear in the report of each, and
+list all their users under "modules":
+
+    python ../functions/runner.py z_mumu_xsec.py --profile
+    flamegraph.pl output/wzp6_ee_mumu_ecm91p2.profile.folded > profile.svg
+
+Expressions are evaluated lazily and before the expressions that use them, so
+the time of a node does not include the time of the columns it reads.
+"""
+
+import os
+import json
+
+import ROOT
+
+from rdfgraph import HISTOGRAMS
+
+PROFILED = ("Define", "Filter") + HISTOGRAMS
+
+
+def body(expr):
+    # expressions may be a single expression or a function body with return statements
+    return expr if "return" in expr else f"return {expr};"
+
+
+class Profiler:
+
+    def __init__(self, nSlots):
+        self.nSlots = nSlots
+        self.ids = {}  # node -> id in FCCAnalyses::Profiler
+        self.included = False
+
+    def label(self, node):
+        if node.op == "Define":
+            return f"Define {node.args[0]}"
+        if node.op == "Filter":
+            return f"Filter {node.args[0]}"
+        return f"{node.op} {node.GetName()}"
+
+    def register(self, node):
+        if not self.included:
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiler.h")
+            if not ROOT.gInterpreter.Declare(f'#include "{path}"'):
+                raise RuntimeError(f"Cannot include {path}")
+            self.included = True
+        self.ids[node] = int(ROOT.FCCAnalyses.Profiler.add(self.label(node), self.nSlots))
+        return self.ids[node]
+
+    def book(self, node, rdf):
+        # book node on rdf, instrumented
+        if node.op not in PROFILED:
+            return node.book(rdf)
+        id = self.register(node)
+        if node.op == "Define":
+            name, expr = node.args
+            return rdf.Define(name, f"FCCAnalyses::Profiler::define({id}, rdfslot_, [&]() {{ {body(expr)} }})")
+        if node.op == "Filter":
+            expr, name = node.args
+            return rdf.Filter(f"FCCAnalyses::Profiler::filter({id}, rdfslot_, [&]() -> bool {{ {body(expr)} }})", name)
+        rdf = rdf.Filter(f"FCCAnalyses::Profiler::count({id}, rdfslot_)")
+        return node.book(rdf)
+
+    def filters(self, node):
+        # labels of the profiled filters above node, outermost first
+        stack = []
+        parent = node.parent
+        while parent is not None:
+            if parent.op == "Filter" and parent in self.ids:
+                stack.append(self.label(parent))
+            parent = parent.parent
+        return stack[::-1]
+
+    def report(self, only=None):
+        # report of the profiled nodes, or of those in only (e.g. the nodes of one module)
+        stats = ROOT.FCCAnalyses.Profiler.stats
+        nodes = []
+        for node, id in self.ids.items():
+            if only is not None and node not in only:
+                continue
+            slots = [{"time": s.ns*1e-9, "calls": s.calls, "passed": s.passed, "returned_bytes": s.returned_bytes} for s in stats[id]]
+            entry = {
+                "id": id,
+                "op": node.op,
+                "label": self.label(node),
+                "expression": node.args[1] if node.op == "Define" else node.args[0] if node.op == "Filter" else None,
+                "filters": self.filters(node),
+                "modules": sorted(node.owners),
+                "time": sum(s["time"] for s in slots),
+                "events_in": sum(s["calls"] for s in slots),
+                "events_out": sum(s["passed"] for s in slots) if node.op != "Define" else None,
+                "returned_bytes": sum(s["returned_bytes"] for s in slots) if node.op == "Define" else None,
+                "slots": slots,
+            }
+            entry["time_per_event"] = entry["time"]/entry["events_in"] if entry["events_in"] else 0
+            nodes.append(entry)
+        nodes.sort(key=lambda n: -n["time"])
+        return {"nSlots": self.nSlots, "time": sum(n["time"] for n in nodes), "nodes": nodes}
+
+    def folded(self, report):
+        # one "frame;frame;... value" line per node, value in microseconds
+        lines = []
+        for node in report["nodes"]:
+            frames = node["filters"] + ([node["label"]] if node["op"] != "Filter" else [node["label"], "(self)"])
+            stack = ";".join(f.replace(";", ",") for f in frames)
+            lines.append(f"{stack} {int(round(node['time']*1e6))}")
+        return "\n".join(sorted(lines)) + "\n"
+
+    def write(self, base, only=None):
+        report = self.report(only)
+        with open(f"{base}.profile.json", "w") as f:
+            json.dump(report, f, indent=1)
+        with open(f"{base}.profile.folded", "w") as f:
+            f.write(self.folded(report))
+        print(f"--> written profile {base}.profile.json")
+        for node in report["nodes"][:10]:
+            print(f"    {node['time']:9.3f} s  {node['events_in']:>10} events  {node['label'][:80]}")
@@ -0,0 +1,212 @@
+"""
+Lazy, deduplicating front-end for RDataFrame graphs.
+
+The build_graph functions of the analysis modules are written against a plain
+RDataFrame node. A Graph hands them a Node instead: every call is recorded,
+and an identical call on the same parent returns the same child. Attaching
+several analysis modules to one Graph therefore shares their common selection
+prefix, and materialize() turns the recorded tree into one RDataFrame graph
+that is processed in a single event loop.
+
+Graph.prune() restricts the booking to the histograms downstream consumers
+need: the other histograms are not booked, and Define/Alias nodes whose
+columns are only used by them are skipped (and never JIT-compiled).
+
+A Graph created with a profiler (see profiling.py) books instrumented nodes,
+and one created with a filler (see histfill.py) books its histograms through it.
+While Graph.owner is set (e.g. to the name of the module being built), every
+node requested is tagged with it, so that shared nodes know all their users.
+
+Vary nodes (systematic variations, see variations.py) are kept as long as the
+column they vary is used below them.
+"""
+
+import re
+
+# operations that create a new node and those that book a result
+TRANSFORMATIONS = ("Define", "Filter", "Alias", "Vary")
+ACTIONS = ("Histo1D", "Histo2D", "Sum", "Count", "Stats", "Snapshot")
+HISTOGRAMS = ("Histo1D", "Histo2D")
+
+
+def identifiers(expr):
+    return set(re.findall(r"[A-Za-z_][A-Za-z0-9_]*", expr))
+
+
+def freeze(obj):
+    # make call arguments usable as a dictionary key
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(o) for o in obj)
+    if isinstance(obj, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in obj.items()))
+    return obj
+
+
+class Node:
+
+    def __init__(self, graph, parent=None, op=None, args=()):
+        self.graph = graph
+        self.parent = parent
+        self.op = op
+        self.args = args
+        self.children = {}
+        self.rdf = None
+        self.used = True
+        self.owners = set()
+
+    def _child(self, op, *args):
+        key = (op, freeze(args))
+        if key not in self.children:
+            self.children[key] = Node(self.graph, self, op, args)
+        if self.graph.owner is not None:
+            self.children[key].owners.add(self.graph.owner)
+        return self.children[key]
+
+    def Define(self, name, expr):
+        return self._child("Define", name, expr)
+
+    def Filter(self, expr, name=""):
+        return self._child("Filter", expr, name)
+
+    def Alias(self, alias, column):
+        return self._child("Alias", alias, column)
+
+    def Vary(self, column, expr, tags, name=""):
+        return self._child("Vary", column, expr, tags, name)
+
+    def Histo1D(self, model, column, weight=None):
+        args = (model, column) if weight is None else (model, column, weight)
+        return self._child("Histo1D", *args)
+
+    def Histo2D(self, model, xcolumn, ycolumn, weight=None):
+        args = (model, xcolumn, ycolumn) if weight is None else (model, xcolumn, ycolumn, weight)
+        return self._child("Histo2D", *args)
+
+    def Sum(self, column):
+        return self._child("Sum", column)
+
+    def Count(self):
+        return self._child("Count")
+
+    def Stats(self, column, weight=None):
+        args = (column,) if weight is None else (column, weight)
+        return self._child("Stats", *args)
+
+    def Snapshot(self, tree, fname, columns, options=None):
+        args = (tree, fname, columns) if options is None else (tree, fname, columns, options)
+        return self._child("Snapshot", *args)
+
+    def GetNSlots(self):
+        return self.graph.df.GetNSlots()
+
+    def is_action(self):
+        return self.op in ACTIONS
+
+    # result interface, mirrors the RResultPtr methods used by the runners
+    def GetName(self):
+        if self.op in ("Histo1D", "Histo2D"):
+            model = self.args[0]
+            return model[0] if isinstance(model, tuple) else model.fName
+        return self.GetValue().GetName()
+
+    def GetValue(self):
+        if self.rdf is None:
+            self.graph.materialize()
+        return self.rdf.GetValue()
+
+    def columns(self):
+        # columns read by this node
+        if self.op in ("Define", "Filter"):
+            return identifiers(self.args[1] if self.op == "Define" else self.args[0])
+        if self.op == "Alias":
+            return {self.args[1]}
+        if self.op == "Vary":
+            return identifiers(self.args[1]) | {self.args[0]}
+        if self.op == "Snapshot":
+            return set(self.args[2])
+        if self.op in ACTIONS:
+            return {a for a in self.args[1 if self.op in HISTOGRAMS else 0:] if isinstance(a, str)}
+        return set()
+
+    def requires(self, kept):
+        # columns needed at the input of this node by the kept actions below it, None if there are none
+        if self.is_action():
+            return self.columns() if self in kept else None
+        below = None
+        for child in self.children.values():
+            need = child.requires(kept)
+            if need is not None:
+                below = need if below is None else below | need
+        if below is None:
+            self.used = self.parent is None
+            return None
+        if self.op in ("Define", "Alias"):
+            self.used = self.args[0] in below
+            if not self.used:
+                return below
+            return (below - {self.args[0]}) | self.columns()
+        if self.op == "Vary":
+            self.used = self.args[0] in below
+            return below | self.columns() if self.used else below
+        return below | self.columns()
+
+    def book(self, rdf):
+        # book this node on rdf, histograms through the filler of the graph if any
+        if self.op in HISTOGRAMS and self.graph.filler is not None:
+            return self.graph.filler.book(self, rdf)
+        return getattr(rdf, self.op)(*self.args)
+
+    def materialize(self):
+        if self.rdf is None:
+            if self.parent is None:
+                self.rdf = self.graph.df
+            elif not self.used:
+                self.rdf = self.parent.materialize()
+            elif self.graph.profiler is not None:
+                self.rdf = self.graph.profiler.book(self, self.parent.materialize())
+            else:
+                self.rdf = self.book(self.parent.materialize())
+        return self.rdf
+
+    def walk(self):
+        yield self
+        for child in self.children.values():
+            yield from child.walk()
+
+
+class Graph:
+
+    def __init__(self, df, profiler=None, filler=None):
+        self.df = df
+        self.root = Node(self)
+        self.kept = None
+        self.owner = None
+        self.profiler = profiler
+        self.filler = filler
+
+    def nodes(self, owner=None):
+        nodes = list(self.root.walk())
+        return nodes if owner is None else [n for n in nodes if owner in n.owners]
+
+    def actions(self):
+        actions = [n for n in self.nodes() if n.is_action()]
+        if self.kept is not None:
+            actions = [n for n in actions if n in self.kept]
+        return actions
+
+    def prune(self, histograms):
+        # only book the given histogram nodes, the other actions (sums, counts, snapshots) are always kept
+        self.kept = set(histograms) | {n for n in self.nodes() if n.is_action() and n.op not in HISTOGRAMS}
+        self.root.requires(self.kept)
+
+    def materialize(self):
+        # book the recorded (or kept) actions on the underlying RDataFrame
+        for node in self.actions():
+            node.materialize()
+        return [node.rdf for node in self.actions()]
+
+    def summary(self):
+        nodes = self.nodes()
+        nActions = len(self.actions())
+        nTransformations = sum(1 for n in nodes[1:] if not n.is_action() and n.used)
+        return f"{nTransformations} transformations, {nActions} actions"
@@ -0,0 +1,577 @@
+"""
+Stand-alone runner for the histmaker-style analysis modules of the tutorials.
+
+It understands the same module attributes as `fccanalysis run` (processList,
+inputDir, procDict, includePaths, outputDir, nCPUS, doScale, intLumi and
+build_graph) and writes the same output/{proc}.root files. On top of that,
+several modules can be given at once: they are attached to one deduplicating
+Graph per sample (see rdfgraph.py), so their shared selection is evaluated
+once and every input file is read once, while each module still gets its own
+output files.
+
+    cd 03_CrossSection
+    python ../functions/runner.py z_mumu_xsec.py ../04_FBAsymmetry/z_mumu_afb.py
+
+With --skim, modules that split build_graph into build_skim/build_analysis
+cache the events passing the early selection: the skimColumns are written to
+skimDir together with the histograms booked by build_skim. The cache is keyed
+on a hash of build_skim, the globals it uses, the helpers imported from
+functions/, the included headers and the input files, so later runs with modified late cuts only process the skim.
+
+With --outputs (or an `outputs` list in the module), only the histograms
+consumers actually read are booked, e.g. the ones plotted by plots_root.py:
+
+    python ../functions/runner.py z_mumu_xsec.py --outputs plots_root.py
+    python ../functions/runner.py ../04_FBAsymmetry/z_mumu_afb.py --outputs cutFlow cosThetac
+
+Define chains that only feed the dropped histograms are not booked either.
+
+With --incremental, the results of every input file are kept in partialDir,
+keyed on the file identity (path, size, modification time) and on a hash of
+the module, the helpers it imports and the included headers. Only files
+without results are processed (a few at a time, so an interrupted run resumes
+where it stopped), and the per-file results are merged into output/{proc}.root.
+
+shards.py distributes the same per-file processing over worker processes or
+nodes through a work queue, and merges the results the same way.
+
+With --prescan, modules that declare a prescan collection (see prescan.py)
+only read the events with enough elements in it, through entry lists built
+once per input file from this light branch.
+
+With --profile, the Define/Filter/histogram nodes are instrumented (see
+profiling.py) and a report of the nodes of each module is written next to
+its output/{proc}.root.
+
+Modules with an includeLibrary load the precompiled helpers built by
+library.py at import, and leave the headers it replaces out of includePaths;
+the cache keys cover these headers all the same.
+
+With --sharedHists N, large 1D histograms are filled into N shared copies
+instead of one per thread (see histfill.py), which keeps the memory flat when
+running on many cores.
+
+Modules with systematic variations (see variations.py) get, for every
+histogram in their variedHists, one histogram per variation from the same
+event loop. A cached skim only holds the nominal skimColumns, so with --skim
+the variations of build_skim are not available.
+"""
+
+import os
+import glob
+import json
+import math
+import hashlib
+import inspect
+import argparse
+import importlib.util
+
+import ROOT
+
+import library
+import prescan
+from rdfgraph import Graph, Node
+from profiling import Profiler
+from histfill import SharedFiller
+from variations import variants
+
+ROOT.gROOT.SetBatch(True)
+
+
+def load_module(path):
+    path = os.path.abspath(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(path))  # modules may use paths relative to their own directory
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    module.baseDir = os.path.dirname(path)
+    return module
+
+
+def module_path(module, path):
+    return path if os.path.isabs(path) else os.path.join(module.baseDir, path)
+
+
+def get_files(inputDir, proc, fraction=1):
+    sampleDir = os.path.join(inputDir, proc)
+    if os.path.isdir(sampleDir):
+        files = sorted(glob.glob(f"{sampleDir}/*.root"))
+    elif os.path.isfile(f"{sampleDir}.root"):
+        files = [f"{sampleDir}.root"]
+    else:
+        raise FileNotFoundError(f"No input files found for {proc} in {inputDir}")
+    # fccanalysis selects the fraction on the number of events, we use the number of files
+    nFiles = max(1, int(math.ceil(fraction*len(files))))
+    return files[:nFiles]
+
+
+def file_identity(path):
+    st = os.stat(path)
+    return f"{os.path.realpath(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def skim_key(module, files):
+    h = hashlib.sha1()
+    h.update(inspect.getsource(module.build_skim).encode())
+    # globals used by the skim stage, e.g. the histogram binnings
+    for name, value in sorted(inspect.getclosurevars(module.build_skim).globals.items()):
+        if not callable(value):
+            h.update(f"{name}={value!r}".encode())
+    h.update(repr(module.skimColumns).encode())
+    # helpers the skim stage calls (e.g. cutflow.py, variations.py); the rest of the module is left
+    # out, so that changes to build_analysis keep the skim
+    for path in local_sources(module):
+        if path != os.path.realpath(module.__file__):
+            with open(path, "rb") as f:
+                h.update(f.read())
+    for path in headers(module):
+        with open(path, "rb") as f:
+            h.update(f.read())
+    for path in files:
+        h.update(file_identity(path).encode())
+    return h.hexdigest()[:16]
+
+
+def headers(module):
+    # the C++ headers of the module, with those its precompiled library replaces
+    paths = {os.path.realpath(module_path(module, path)) for path in getattr(module, "includePaths", [])}
+    if hasattr(module, "includeLibrary"):
+        paths.update(library.headers())
+    return sorted(paths)
+
+
+def local_sources(module):
+    # source files of the module and of the helpers it imports from this repository (e.g. cutflow.py)
+    repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sources = {os.path.realpath(module.__file__)}
+    for value in vars(module).values():
+        try:
+            path = inspect.getsourcefile(value)
+        except TypeError:
+            continue
+        if path and os.path.realpath(path).startswith(repoDir + os.sep):
+            sources.add(os.path.realpath(path))
+    return sorted(sources)
+
+
+def graph_key(module, outputs=None):
+    # hash of everything that defines the results of build_graph on a given input file
+    h = hashlib.sha1()
+    for path in local_sources(module):
+        with open(path, "rb") as f:
+            h.update(f.read())
+    for path in headers(module):
+        with open(path, "rb") as f:
+            h.update(f.read())
+    h.update(repr(sorted(getattr(module, "outputs", outputs) or [])).encode())
+    return h.hexdigest()[:16]
+
+
+def partial_path(module, proc, key, path):
+    partialDir = module_path(module, getattr(module, "partialDir", "partial/"))
+    fileKey = hashlib.sha1(file_identity(path).encode()).hexdigest()[:16]
+    return f"{partialDir}/{proc}/{key}/{fileKey}.root"
+
+
+class StoredResult:
+    # value read back from a skim file, mimics an RResultPtr
+
+    def __init__(self, value):
+        self.value = value
+
+    def GetName(self):
+        return self.value.GetName()
+
+    def GetValue(self):
+        return self.value
+
+
+def write_results(fOut, hists, eventsProcessed, weightsum):
+    # histograms (under unique keys, names may repeat) and counters of one module, see read_results
+    fOut.mkdir("hists").cd()
+    for i, hist in enumerate(hists):
+        hist.GetValue().Write(f"hist_{i}")
+    fOut.cd()
+    ROOT.TParameter(int)("eventsProcessed", eventsProcessed).Write()
+    ROOT.TParameter(float)("sumOfWeights", weightsum).Write()
+
+
+def read_results(path):
+    fIn = ROOT.TFile(path)
+    hists = []
+    for key in fIn.Get("hists").GetListOfKeys():
+        h = key.ReadObj()
+        h.SetDirectory(0)
+        hists.append(StoredResult(h))
+    eventsProcessed = fIn.Get("eventsProcessed").GetVal()
+    weightsum = fIn.Get("sumOfWeights").GetVal()
+    fIn.Close()
+    return hists, eventsProcessed, weightsum
+
+
+def load_outputs(specs):
+    # histogram names, or plotting configurations whose `hists` dict lists the outputs
+    outputs = set()
+    for spec in specs:
+        if spec.endswith(".py"):
+            outputs |= {cfg.get("output", name) for name, cfg in load_module(spec).hists.items()}
+        else:
+            outputs.add(spec)
+    return outputs
+
+
+def load_procdict(module):
+    procDict = getattr(module, "procDict", None)
+    if procDict is None:
+        return {}
+    with open(module_path(module, procDict)) as f:
+        return json.load(f)
+
+
+def setup_root(modules):
+    nCPUS = max(getattr(m, "nCPUS", 4) for m in modules)
+    if nCPUS == -1:
+        ROOT.EnableImplicitMT()
+    elif nCPUS > 1:
+        ROOT.EnableImplicitMT(nCPUS)
+
+    ROOT.gSystem.Load("libFCCAnalyses")
+    ROOT.gInterpreter.Declare("using namespace FCCAnalyses;")
+
+    # headers replaced by a precompiled library are already left out of includePaths (see library.py)
+    included = set()
+    for module in modules:
+        for path in getattr(module, "includePaths", []):
+            path = os.path.realpath(module_path(module, path))
+            if path in included:
+                continue
+            if not ROOT.gInterpreter.Declare(f'#include "{path}"'):
+                raise RuntimeError(f"Cannot include {path}")
+            included.add(path)
+
+
+def group_samples(modules):
+    # samples with the same inputs are processed by one graph
+    groups = {}
+    for module in modules:
+        for proc, cfg in module.processList.items():
+            fraction = cfg.get("fraction", 1)
+            key = (os.path.realpath(module.inputDir), proc, fraction)
+            groups.setdefault(key, []).append(module)
+    return groups
+
+
+def scale_factor(module, proc, weightsum):
+    if not getattr(module, "doScale", False):
+        return 1.
+    meta = module.procDictData.get(proc, {})
+    xsec = meta.get("crossSection", 1.)
+    kfactor = meta.get("kfactor", 1.)
+    matchingEfficiency = meta.get("matchingEfficiency", 1.)
+    return xsec*kfactor*matchingEfficiency*getattr(module, "intLumi", 1.)/weightsum
+
+
+def output_dir(module):
+    return module_path(module, getattr(module, "outputDir", "output/"))
+
+
+def write_output(module, proc, hists, eventsProcessed, weightsum):
+    outDir = output_dir(module)
+    os.makedirs(outDir, exist_ok=True)
+
+    # histograms booked several times under the same name (e.g. cutFlow) are summed
+    merged = {}
+    for hist in hists:
+        h = hist.GetValue()
+        name = h.GetName()
+        if name in merged:
+            merged[name].Add(h)
+        else:
+            merged[name] = h.Clone(name)  # results may be shared with other modules
+            merged[name].SetDirectory(0)
+
+    meta = module.procDictData.get(proc, {})
+    sf = scale_factor(module, proc, weightsum)
+    fOut = ROOT.TFile(f"{outDir}/{proc}.root", "RECREATE")
+    for name, h in merged.items():
+        # raw event counts (e.g. cutFlow_raw, see cutflow.py) stay unscaled
+        if not name.endswith("_raw"):
+            h.Scale(sf)
+        h.Write()
+    ROOT.TParameter(int)("eventsProcessed", eventsProcessed).Write()
+    ROOT.TParameter(float)("sumOfWeights", weightsum).Write()
+    ROOT.TParameter(float)("crossSection", meta.get("crossSection", 1.)).Write()
+    ROOT.TParameter(float)("kfactor", meta.get("kfactor", 1.)).Write()
+    ROOT.TParameter(float)("matchingEfficiency", meta.get("matchingEfficiency", 1.)).Write()
+    ROOT.TParameter(float)("intLumi", getattr(module, "intLumi", 1.)).Write()
+    ROOT.TParameter(bool)("scaled", bool(getattr(module, "doScale", False))).Write()
+    fOut.Close()
+    print(f"--> {module.__name__}: written {outDir}/{proc}.root")
+
+
+class Job:
+    # all modules processing one sample
+
+    def __init__(self, proc, files, profile=False, shared=None, prescanSpec=None):
+        self.proc = proc
+        self.files = files
+        self.prescanSpec = prescanSpec  # (prescanDir, spec) to read the input files through entry lists
+        self.inputs = None  # TChain and TEntryList of the input graph, kept alive during the event loop
+        self.skipped = 0  # events not read because of the prescan
+        self.profile = profile
+        self.profiler = None  # shared by the graphs of the job
+        self.filler = None if shared is None else SharedFiller(shared)
+        self.graphs = []
+        self.results = []  # (module, hists, eventsProcessed, weightsum)
+        self.skims = []  # (module, path, tmpPath, hists, eventsProcessed, weightsum)
+        self.inputGraph = None
+        self.keep = []  # histograms that are booked irrespective of the requested outputs
+
+    def new_graph(self, files, chain=None):
+        df = ROOT.RDataFrame("events", files) if chain is None else ROOT.RDataFrame(chain)
+        if self.profile and self.profiler is None:
+            self.profiler = Profiler(df.GetNSlots())
+        graph = Graph(df, self.profiler, self.filler)
+        graph.count = graph.root.Count()
+        self.graphs.append(graph)
+        return graph
+
+    def input_graph(self):
+        # graph over the input files, shared by all modules that need it
+        if self.inputGraph is None:
+            if self.prescanSpec is None:
+                self.inputGraph = self.new_graph(self.files)
+            else:
+                prescanDir, spec = self.prescanSpec
+                chain, entries, self.skipped = prescan.chain(prescanDir, spec, self.proc, self.files, file_identity)
+                self.inputs = (chain, entries)
+                self.inputGraph = self.new_graph(self.files, chain)
+        return self.inputGraph
+
+    def add_result(self, module, hists, eventsProcessed, weightsum):
+        # results of a module on the input graph, with the events skipped by the prescan
+        if self.skipped:
+            hists, eventsProcessed, weightsum = prescan.add_skipped(hists, eventsProcessed, weightsum, self.skipped)
+        self.results.append((module, hists, eventsProcessed, weightsum))
+        return eventsProcessed, weightsum
+
+    def add(self, module):
+        graph = self.input_graph()
+        graph.owner = module.__name__
+        hists, weightsum = module.build_graph(graph.root, self.proc)
+        graph.owner = None
+        self.add_result(module, hists, graph.count, weightsum)
+
+    def add_skimmed(self, module):
+        skimDir = module_path(module, getattr(module, "skimDir", "skim/"))
+        path = f"{skimDir}/{self.proc}_{skim_key(module, self.files)}.root"
+        if os.path.isfile(path):
+            print(f"--> {module.__name__}: using skim {path}")
+            hists, eventsProcessed, weightsum = read_results(path)
+            graph = self.new_graph([path])
+            graph.owner = module.__name__
+            module.build_analysis(graph.root, hists)
+            self.results.append((module, hists, StoredResult(eventsProcessed), StoredResult(weightsum)))
+            return
+
+        os.makedirs(skimDir, exist_ok=True)
+        graph = self.input_graph()
+        graph.owner = module.__name__
+        hists = []
+        df, weightsum = module.build_skim(graph.root, hists)
+        skimHists = list(hists)
+        self.keep += skimHists  # the skim stores all of them
+        tmpPath = f"{path}.tmp{os.getpid()}"
+        opts = ROOT.RDF.RSnapshotOptions()
+        opts.fLazy = True
+        df.Snapshot("events", tmpPath, module.skimColumns, opts)
+        module.build_analysis(df, hists)
+        graph.owner = None
+        eventsProcessed, weightsum = self.add_result(module, hists, graph.count, weightsum)
+        self.skims.append((module, path, tmpPath, skimHists, eventsProcessed, weightsum))
+
+    def nodes(self, module):
+        # the nodes module requested, shared ones included
+        return {node for graph in self.graphs for node in graph.nodes(module.__name__)}
+
+    def select_outputs(self, outputs):
+        # restrict the histograms of each module to the requested outputs, and book only those
+        if all(getattr(module, "outputs", outputs) is None for module, *_ in self.results):
+            return
+        kept = list(self.keep)
+        for i, (module, hists, eventsProcessed, weightsum) in enumerate(self.results):
+            moduleOutputs = getattr(module, "outputs", outputs)
+            if moduleOutputs is not None:
+                hists = [h for h in hists if h.GetName() in moduleOutputs]
+                self.results[i] = (module, hists, eventsProcessed, weightsum)
+            kept += hists
+        for graph in self.graphs:
+            graph.prune([h for h in kept if isinstance(h, Node) and h.graph is graph])
+
+    def add_variations(self):
+        # varied copies of the variedHists of each module, booked before the event loop
+        cache = {}
+        for i, (module, hists, eventsProcessed, weightsum) in enumerate(self.results):
+            names = getattr(module, "variedHists", None)
+            if names:
+                self.results[i] = (module, hists + variants(hists, names, cache), eventsProcessed, weightsum)
+
+    def write_skims(self):
+        for module, path, tmpPath, hists, eventsProcessed, weightsum in self.skims:
+            fOut = ROOT.TFile(tmpPath, "UPDATE")
+            write_results(fOut, hists, eventsProcessed.GetValue(), weightsum.GetValue())
+            fOut.Close()
+            os.replace(tmpPath, path)
+            print(f"--> {module.__name__}: written skim {path}")
+
+
+def prescan_spec(modules, enabled=True):
+    # (prescanDir, spec) for the graph read by modules, if they all declare the same prescan (see prescan.py)
+    spec = prescan.spec_of(modules) if enabled else None
+    if spec is None:
+        return None
+    return module_path(modules[0], getattr(modules[0], "prescanDir", "prescan/")), spec
+
+
+def build_jobs(modules, skim=False, outputs=None, profile=False, shared=None, usePrescan=False):
+    jobs = []
+    for (inputDir, proc, fraction), procModules in group_samples(modules).items():
+        job = Job(proc, get_files(inputDir, proc, fraction), profile, shared, prescan_spec(procModules, usePrescan))
+        for module in procModules:
+            if skim and hasattr(module, "build_skim"):
+                job.add_skimmed(module)
+            else:
+                job.add(module)
+        job.select_outputs(outputs)
+        summary = ", ".join(graph.summary() for graph in job.graphs)
+        print(f"--> {proc}: {len(job.files)} files, {len(procModules)} module(s), {summary}")
+        jobs.append(job)
+    return jobs
+
+
+def run(modules, skim=False, outputs=None, profile=False, shared=None, usePrescan=False):
+    setup_root(modules)
+    for module in modules:
+        module.procDictData = load_procdict(module)
+
+    jobs = build_jobs(modules, skim, outputs, profile, shared, usePrescan)
+    graphs = [graph for job in jobs for graph in job.graphs]
+    for graph in graphs:
+        graph.materialize()
+    for job in jobs:
+        job.add_variations()
+    ROOT.RDF.RunGraphs([graph.count.rdf for graph in graphs])
+
+    for job in jobs:
+        job.write_skims()
+        for module, hists, eventsProcessed, weightsum in job.results:
+            write_output(module, job.proc, hists, eventsProcessed.GetValue(), weightsum.GetValue())
+            if job.profiler is not None:
+                job.profiler.write(f"{output_dir(module)}/{job.proc}", job.nodes(module))
+
+
+def pending_results(modules, keys):
+    # the (module, proc, files) samples, and the (proc, file) -> modules without results for this file
+    samples = []
+    pending = {}
+    for (inputDir, proc, fraction), procModules in group_samples(modules).items():
+        files = get_files(inputDir, proc, fraction)
+        for module in procModules:
+            samples.append((module, proc, files))
+            for path in files:
+                if not os.path.isfile(partial_path(module, proc, keys[module.__name__], path)):
+                    pending.setdefault((proc, path), []).append(module)
+    return samples, pending
+
+
+def process_files(units, keys, outputs=None, shared=None, usePrescan=False):
+    # ((proc, file), modules) units in one event loop, the results of every module and file are kept
+    # in partialDir
+    jobs = []
+    for (proc, path), procModules in units:
+        job = Job(proc, [path], shared=shared, prescanSpec=prescan_spec(procModules, usePrescan))
+        for module in procModules:
+            job.add(module)
+        job.select_outputs(outputs)
+        jobs.append(job)
+    graphs = [graph for job in jobs for graph in job.graphs]
+    for graph in graphs:
+        graph.materialize()
+    for job in jobs:
+        job.add_variations()
+    ROOT.RDF.RunGraphs([graph.count.rdf for graph in graphs])
+
+    for job in jobs:
+        for module, hists, eventsProcessed, weightsum in job.results:
+            path = partial_path(module, job.proc, keys[module.__name__], job.files[0])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fOut = ROOT.TFile(f"{path}.tmp{os.getpid()}", "RECREATE")
+            write_results(fOut, hists, eventsProcessed.GetValue(), weightsum.GetValue())
+            fOut.Close()
+            os.replace(f"{path}.tmp{os.getpid()}", path)
+
+
+def merge_results(samples, keys):
+    # merge the per-file results of the current files into output/{proc}.root
+    for module, proc, files in samples:
+        merged, eventsProcessed, weightsum = {}, 0, 0.
+        for path in files:
+            hists, nEvents, sumw = read_results(partial_path(module, proc, keys[module.__name__], path))
+            eventsProcessed += nEvents
+            weightsum += sumw
+            for i, hist in enumerate(hists):
+                h = hist.GetValue()
+                if i in merged:
+                    merged[i].Add(h)
+                else:
+                    merged[i] = h
+        write_output(module, proc, [StoredResult(h) for h in merged.values()], eventsProcessed, weightsum)
+
+
+def run_incremental(modules, outputs=None, batch=16, shared=None, usePrescan=False):
+    # process every input file separately and keep its results, keyed on the file identity and
+    # on the graph definition; files with results from a previous (possibly interrupted) run are skipped
+    setup_root(modules)
+    for module in modules:
+        module.procDictData = load_procdict(module)
+    keys = {module.__name__: graph_key(module, outputs) for module in modules}
+
+    samples, pending = pending_results(modules, keys)
+    nFiles = sum(len(files) for _, _, files in samples)
+    nPending = sum(len(procModules) for procModules in pending.values())
+    print(f"--> {nPending} of {nFiles} (module, file) results to produce")
+
+    # a few files at a time, so that an interrupted run only loses the current batch
+    pending = list(pending.items())
+    for start in range(0, len(pending), batch):
+        process_files(pending[start:start+batch], keys, outputs, shared, usePrescan)
+        print(f"--> processed {min(start+batch, len(pending))}/{len(pending)} files")
+
+    merge_results(samples, keys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="+", help="Analysis modules (e.g. z_mumu_xsec.py), processed in one event loop per sample")
+    parser.add_argument("--skim", action="store_true", help="Cache the events passing build_skim and reuse the cache when the early selection is unchanged")
+    parser.add_argument("--outputs", nargs="+", help="Only book these histograms: names, or plot configurations (e.g. plots_root.py) whose hists dict lists them")
+    parser.add_argument("--profile", action="store_true", help="Measure time, calls and events per Define/Filter/histogram node, written to output/{proc}.profile.json/.folded")
+    parser.add_argument("--incremental", action="store_true", help="Keep the results per input file and only process new or changed files (resumes interrupted runs)")
+    parser.add_argument("--sharedHists", type=int, default=None, metavar="N", help="Fill 1D histograms with >= 1000 bins into N shared copies instead of one per thread")
+    parser.add_argument("--prescan", action="store_true", help="Only read the entries of the modules' prescan collection with enough elements, from stored entry lists")
+    parser.add_argument("--batch", type=int, default=16, help="Number of files processed at once with --incremental")
+    args = parser.parse_args()
+    if args.incremental and args.skim:
+        parser.error("--incremental and --skim cannot be combined")
+
+    outputs = load_outputs(args.outputs) if args.outputs else None
+    modules = [load_module(m) for m in args.modules]
+    if args.incremental:
+        run_incremental(modules, outputs=outputs, batch=args.batch, shared=args.sharedHists, usePrescan=args.prescan)
+    else:
+        run(modules, skim=args.skim, outputs=outputs, profile=args.profile, shared=args.sharedHists, usePrescan=args.prescan)
@@ -0,0 +1,297 @@
+"""
+Sharded execution of the analysis modules over a work queue.
+
+Every (sample, input file) of the modules is a work unit, written as a small
+JSON file to the todo/ directory of a queue directory. Workers, on this
+machine or on any node that sees the same filesystem, claim units by renaming
+them atomically to claimed/, process them like runner.py --incremental (the
+results of every module and file are kept in partialDir) and move them to
+done/. Once all units are done, the per-file results are merged into the usual
+output/{proc}.root files.
+
+    cd 03_CrossSection
+    python ../functions/shards.py run z_mumu_xsec.py ../04_FBAsymmetry/z_mumu_afb.py --workers 4 --threads 8
+
+runs the whole chain with 4 local worker processes. On several nodes:
+
+    python ../functions/shards.py submit z_mumu_xsec.py --queue /shared/queue
+    python ../functions/shards.py worker --queue /shared/queue --threads 32     # on every node
+    python ../functions/shards.py status --queue /shared/queue
+    python ../functions/shards.py merge --queue /shared/queue
+
+A unit that fails is put back in todo/ until it failed --retries times, then it
+is moved to failed/. Workers refresh the time stamp of their claims, so claims
+of crashed workers (a dead process on this host, or no update for --stale
+seconds) are put back in todo/ by `status --requeue` and by the local run.
+Submitting again only queues the units without results, so failed units can
+be retried without redoing the others.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import argparse
+import threading
+import subprocess
+import traceback
+
+import runner
+
+STATES = ["todo", "claimed", "done", "failed"]
+
+
+def unit_dir(queueDir, state):
+    return os.path.join(queueDir, state)
+
+
+def units(queueDir, state):
+    path = unit_dir(queueDir, state)
+    return sorted(f for f in os.listdir(path) if not f.startswith(".")) if os.path.isdir(path) else []
+
+
+def write_json(path, data):
+    # written under a temporary name and renamed, so that readers never see a partial file
+    tmpPath = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp{os.getpid()}")
+    with open(tmpPath, "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmpPath, path)
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_config(queueDir):
+    config = read_json(os.path.join(queueDir, "config.json"))
+    if config["outputs"] is not None:
+        config["outputs"] = set(config["outputs"])
+    modules = [runner.load_module(path) for path in config["modules"]]
+    return config, modules
+
+
+def submit(modules, queueDir, outputs=None, shared=None, retries=3, usePrescan=False):
+    # queue the (proc, file) units without results; the units of a previous submission are replaced
+    keys = {module.__name__: runner.graph_key(module, outputs) for module in modules}
+    samples, pending = runner.pending_results(modules, keys)
+    for state in STATES:
+        os.makedirs(unit_dir(queueDir, state), exist_ok=True)
+        for name in units(queueDir, state):
+            os.remove(os.path.join(unit_dir(queueDir, state), name))
+
+    config = {"modules": [os.path.join(m.baseDir, f"{m.__name__}.py") for m in modules], "keys": keys,
+              "outputs": sorted(outputs) if outputs else None, "shared": shared, "prescan": usePrescan, "retries": retries}
+    write_json(os.path.join(queueDir, "config.json"), config)
+    for (proc, path), procModules in pending.items():
+        name = f"{proc}_{hashlib.sha1(path.encode()).hexdigest()[:12]}.json"
+        unit = {"proc": proc, "path": path, "modules": [m.__name__ for m in procModules], "attempts": 0, "errors": []}
+        write_json(os.path.join(unit_dir(queueDir, "todo"), name), unit)
+    nFiles = sum(len(files) for _, _, files in samples)
+    print(f"--> {len(pending)} units queued in {queueDir}, {nFiles - len(pending)} (module, file) results already available")
+
+
+def claim(queueDir):
+    # move one unit from todo/ to claimed/, the rename fails if another worker was faster
+    for name in units(queueDir, "todo"):
+        claimed = os.path.join(unit_dir(queueDir, "claimed"), f"{name}@{socket.gethostname()}@{os.getpid()}")
+        try:
+            os.rename(os.path.join(unit_dir(queueDir, "todo"), name), claimed)
+        except FileNotFoundError:
+            continue
+        return name, claimed
+    return None, None
+
+
+def release(queueDir, name, claimed, error, retries):
+    # a failed unit goes back to todo/, or to failed/ after retries attempts; None if the claim
+    # was released meanwhile (e.g. taken for a stale one)
+    try:
+        unit = read_json(claimed)
+        os.remove(claimed)
+    except FileNotFoundError:
+        return None
+    unit["attempts"] += 1
+    unit["errors"].append(error)
+    state = "todo" if unit["attempts"] < retries else "failed"
+    write_json(os.path.join(unit_dir(queueDir, state), name), unit)
+    return state
+
+
+class Heartbeat:
+    # refreshes the time stamp of the current claim, so that it is not taken for a stale one
+
+    def __init__(self, interval=30):
+        self.interval = interval
+        self.path = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                if self.path is not None:
+                    os.utime(self.path)
+            except FileNotFoundError:
+                pass
+
+    def stop(self):
+        self.stopped.set()
+
+
+def worker(queueDir, threads=None):
+    # process units until the queue is empty
+    config, modules = load_config(queueDir)
+    byName = {module.__name__: module for module in modules}
+    if threads is not None:
+        for module in modules:
+            module.nCPUS = threads
+    runner.setup_root(modules)
+
+    heartbeat = Heartbeat()
+    nDone, nFailed = 0, 0
+    while True:
+        name, claimed = claim(queueDir)
+        if name is None:
+            break
+        heartbeat.path = claimed
+        unit = read_json(claimed)
+        start = time.time()
+        try:
+            procModules = [byName[m] for m in unit["modules"]]
+            runner.process_files([((unit["proc"], unit["path"]), procModules)], config["keys"], config["outputs"], config["shared"],
+                                 config.get("prescan", False))
+        except Exception:
+            heartbeat.path = None
+            state = release(queueDir, name, claimed, f"{socket.gethostname()}: {traceback.format_exc()}", config["retries"])
+            print(f"--> {name} failed" + (f", moved to {state}/" if state else ""))
+            nFailed += 1
+            continue
+        heartbeat.path = None
+        unit["host"] = socket.gethostname()
+        unit["time"] = time.time() - start
+        write_json(os.path.join(unit_dir(queueDir, "done"), name), unit)
+        # the claim may have been released meanwhile and the unit queued again
+        for path in (claimed, os.path.join(unit_dir(queueDir, "todo"), name)):
+            if os.path.exists(path):
+                os.remove(path)
+        nDone += 1
+        print(f"--> {name} done in {unit['time']:.1f} s")
+    heartbeat.stop()
+    print(f"--> worker {socket.gethostname()}:{os.getpid()}: {nDone} units done, {nFailed} failed")
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def requeue(queueDir, stale=300):
+    # release the claims of workers that died on this host, or that were not updated for stale seconds
+    config = read_json(os.path.join(queueDir, "config.json"))
+    host = socket.gethostname()
+    released = 0
+    for claimName in units(queueDir, "claimed"):
+        name, claimHost, pid = claimName.rsplit("@", 2)
+        claimed = os.path.join(unit_dir(queueDir, "claimed"), claimName)
+        try:
+            age = time.time() - os.path.getmtime(claimed)
+        except FileNotFoundError:
+            continue
+        dead = claimHost == host and not alive(int(pid))
+        if dead or age > stale:
+            reason = f"{claimHost}:{pid}: worker {'died' if dead else f'not responding for {age:.0f} s'}"
+            if release(queueDir, name, claimed, reason, config["retries"]) is not None:
+                released += 1
+    return released
+
+
+def status(queueDir):
+    counts = {state: len(units(queueDir, state)) for state in STATES}
+    print("--> " + ", ".join(f"{counts[state]} {state}" for state in STATES))
+    for name in units(queueDir, "failed"):
+        unit = read_json(os.path.join(unit_dir(queueDir, "failed"), name))
+        print(f"    failed: {unit['proc']} {unit['path']} after {unit['attempts']} attempts, last error:")
+        print("      " + unit["errors"][-1].strip().replace("\n", "\n      "))
+    return counts
+
+
+def merge(queueDir):
+    # merge the per-file results into output/{proc}.root, once every unit is done
+    counts = status(queueDir)
+    if counts["todo"] or counts["claimed"] or counts["failed"]:
+        print("--> not all units are done, not merging")
+        return False
+    config, modules = load_config(queueDir)
+    for module in modules:
+        module.procDictData = runner.load_procdict(module)
+    samples, pending = runner.pending_results(modules, config["keys"])
+    if pending:
+        print(f"--> {len(pending)} (proc, file) units have no results (files added since the submission?), submit again")
+        return False
+    runner.merge_results(samples, config["keys"])
+    return True
+
+
+def run_local(queueDir, nWorkers, threads=None, stale=300):
+    # nWorkers worker processes on this host, crashed workers are replaced while units are left
+    cmd = [sys.executable, os.path.abspath(__file__), "worker", "--queue", queueDir]
+    if threads is not None:
+        cmd += ["--threads", str(threads)]
+    workers = [subprocess.Popen(cmd) for _ in range(nWorkers)]
+    while workers:
+        time.sleep(1)
+        for w in [w for w in workers if w.poll() is not None]:
+            workers.remove(w)
+            requeue(queueDir, stale)
+            if w.returncode != 0 and units(queueDir, "todo"):
+                print(f"--> worker {w.pid} exited with code {w.returncode}, starting a new one")
+                workers.append(subprocess.Popen(cmd))
+    return merge(queueDir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["run", "submit", "worker", "status", "merge"],
+                        help="run: submit, process with local workers and merge; submit/worker/status/merge: the single steps")
+    parser.add_argument("modules", nargs="*", help="Analysis modules (run and submit)")
+    parser.add_argument("--queue", type=str, default="queue/", help="Queue directory, on a filesystem shared by the workers")
+    parser.add_argument("--workers", type=int, default=4, help="Number of local worker processes (run)")
+    parser.add_argument("--threads", type=int, default=None, help="Threads per worker, instead of nCPUS of the modules")
+    parser.add_argument("--retries", type=int, default=3, help="Attempts per unit before it is moved to failed/")
+    parser.add_argument("--stale", type=float, default=300, help="Seconds without update after which a claim is released (status --requeue, run)")
+    parser.add_argument("--requeue", action="store_true", help="Release the claims of dead or stale workers (status)")
+    parser.add_argument("--outputs", nargs="+", help="Only book these histograms, as in runner.py")
+    parser.add_argument("--sharedHists", type=int, default=None, metavar="N", help="Fill large 1D histograms into N shared copies, as in runner.py")
+    parser.add_argument("--prescan", action="store_true", help="Read the input files through the prescan entry lists, as in runner.py")
+    args = parser.parse_args()
+    queueDir = os.path.abspath(args.queue)
+
+    if args.command in ("run", "submit"):
+        if not args.modules:
+            parser.error(f"{args.command} needs the analysis modules")
+        outputs = runner.load_outputs(args.outputs) if args.outputs else None
+        submit([runner.load_module(m) for m in args.modules], queueDir, outputs, args.sharedHists, args.retries, args.prescan)
+    if args.command == "run":
+        ok = run_local(queueDir, args.workers, args.threads, args.stale)
+    elif args.command == "worker":
+        worker(queueDir, args.threads)
+        ok = True
+    elif args.command == "status":
+        if args.requeue:
+            print(f"--> {requeue(queueDir, args.stale)} claims released")
+        counts = status(queueDir)
+        ok = not counts["failed"]
+    elif args.command == "merge":
+        ok = merge(queueDir)
+    else:
+        ok = True
+    sys.exit(0 if ok else 1)
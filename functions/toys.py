@@ -0,0 +1,60 @@
+"""
+Pseudo-experiments (toys) on histograms, with NumPy.
+
+The expected (normalized) histograms are fluctuated bin by bin with Poisson
+statistics and every toy is passed to a vectorized estimator, one chunk of
+toys at a time: only the chunk and the per-toy results are kept in memory.
+
+    def estimator(toys):                       # toys: (n, nlumi, nbins)
+        res = afb.fit(toys, edges, window)
+        return {"fit": (res["afb"], res["afb_err"])}
+
+    results = run(expected, estimator, ntoys=10000)   # expected: (nlumi, nbins)
+    stats = summarize(*results["fit"], truth)         # bias, RMS, pulls per luminosity
+"""
+
+import numpy as np
+
+
+def generate(expected, ntoys, chunk=1000, seed=None):
+    # Poisson toys of the expected bin contents, in chunks of shape (n <= chunk,) + expected.shape
+    rng = np.random.default_rng(seed)
+    expected = np.asarray(expected, dtype=np.float64)
+    for start in range(0, ntoys, chunk):
+        n = min(chunk, ntoys - start)
+        yield rng.poisson(expected, size=(n,) + expected.shape).astype(np.float64)
+
+
+def run(expected, estimator, ntoys, chunk=1000, seed=None):
+    # estimator(toys) returns {name: (value, error)} with arrays of leading dimension len(toys)
+    results = {}
+    for toys in generate(expected, ntoys, chunk, seed):
+        for name, (value, error) in estimator(toys).items():
+            results.setdefault(name, ([], []))
+            results[name][0].append(value)
+            results[name][1].append(error)
+    return {name: (np.concatenate(values), np.concatenate(errors)) for name, (values, errors) in results.items()}
+
+
+def summarize(values, errors, truth):
+    # bias, spread and pulls over the toys (axis 0); toys without a valid result are not counted
+    ok = np.isfinite(values) & np.isfinite(errors) & (errors > 0)
+    n = ok.sum(axis=0)
+    values = np.where(ok, values, 0)
+    errors = np.where(ok, errors, 1)
+    pulls = np.where(ok, (values - truth)/errors, 0)
+
+    mean = values.sum(axis=0)/n
+    rms = np.sqrt((ok*(values - mean)**2).sum(axis=0)/(n - 1))
+    pull_mean = pulls.sum(axis=0)/n
+    return {
+        "ntoys": n,
+        "mean": mean,
+        "bias": mean - truth,
+        "bias_err": rms/np.sqrt(n),
+        "rms": rms,
+        "mean_err": (ok*errors).sum(axis=0)/n,
+        "pull_mean": pull_mean,
+        "pull_width": np.sqrt((ok*(pulls - pull_mean)**2).sum(axis=0)/(n - 1)),
+        "coverage": (ok*(np.abs(pulls) < 1)).sum(axis=0)/n,
+    }
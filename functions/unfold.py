@@ -0,0 +1,64 @@
+"""
+Unfolding of reco-level histograms to gen level, with NumPy.
+
+The response matrix is built from a 2D histogram of (gen, reco) filled for
+the same events, e.g. cosThetac_response booked by z_mumu_afb.py. It describes
+the migrations between bins of the selected events: reco = R @ gen.
+
+All functions are batched over the leading axes of the reco histograms (and
+of tau for the regularized unfolding), so many processes, luminosities or
+toy replicas are unfolded in one call:
+
+    R = response(h2)                               # h2: (ngen, nreco) contents
+    gen, cov = invert(R, reco)                     # reco: (..., nreco)
+    gen, cov = tikhonov(R, reco, tau=[0, 1e-3])    # (..., ntau, ngen)
+"""
+
+import numpy as np
+
+
+def response(values):
+    # R[reco, gen] = P(reco bin | gen bin) from the (gen, reco) histogram contents
+    values = np.asarray(values, dtype=np.float64)
+    gen = values.sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        R = np.where(gen[..., :, None] > 0, values / gen[..., :, None], 0)
+    return np.swapaxes(R, -1, -2)
+
+
+def curvature(n):
+    # second-derivative operator, used as regularization in tikhonov()
+    L = np.zeros((n - 2, n))
+    i = np.arange(n - 2)
+    L[i, i], L[i, i + 1], L[i, i + 2] = 1, -2, 1
+    return L
+
+
+def invert(R, reco, variances=None):
+    # matrix inversion (pseudo-inverse for gen bins without events), with the covariance
+    # propagated from the reco variances (the reco contents, i.e. Poisson, by default)
+    reco = np.asarray(reco, dtype=np.float64)
+    variances = reco if variances is None else np.asarray(variances, dtype=np.float64)
+    Rinv = np.linalg.pinv(R)
+    gen = np.einsum("...ij,...j->...i", Rinv, reco)
+    cov = np.einsum("...ij,...j,...kj->...ik", Rinv, variances, Rinv)
+    return gen, cov
+
+
+def tikhonov(R, reco, tau, variances=None, L=None):
+    # minimizes (reco - R gen)^T V^-1 (reco - R gen) + tau^2 |L gen|^2 for every tau,
+    # V = diag(variances) (the reco contents by default, empty bins get unit variance).
+    # Returns gen and cov with shape reco.shape[:-1] + (len(tau), ngen[, ngen])
+    reco = np.asarray(reco, dtype=np.float64)
+    tau = np.atleast_1d(np.asarray(tau, dtype=np.float64))
+    variances = reco if variances is None else np.broadcast_to(np.asarray(variances, dtype=np.float64), reco.shape)
+    L = curvature(R.shape[-1]) if L is None else L
+    w = 1 / np.where(variances > 0, variances, 1)
+
+    RtW = np.swapaxes(R, -1, -2) * w[..., None, :]
+    RtWR = RtW @ R  # (..., ngen, ngen)
+    A = RtWR[..., None, :, :] + (tau**2)[:, None, None] * (L.T @ L)
+    M = np.linalg.solve(A, RtW[..., None, :, :])  # (..., ntau, ngen, nreco): gen = M @ reco
+    gen = np.einsum("...tij,...j->...ti", M, reco)
+    cov = np.einsum("...tij,...j,...tkj->...tik", M, variances, M)
+    return gen, cov
@@ -0,0 +1,100 @@
+"""
+Systematic variations of the selection, booked in the same event loop.
+
+The cut values and corrections of a module are defined as columns with
+parameters(), and shifted with RDataFrame's Vary for every variation that
+refers to them. For the histograms listed in the module's variedHists, the
+runner (runner.py) then also writes one histogram per variation, named
+{name}_{variation}{Up,Down}:
+
+    selection = {"p_max_norm_min": 0.6}
+    variations = {"pMaxCut": ("p_max_norm_min", {"up": 0.65, "down": 0.55})}
+    variedHists = ["cutFlow", "invariant_mass"]
+
+    df = parameters(df, selection, variations, ["p_max_norm_min"])
+    df = df.Filter("muon_max_p_norm > p_max_norm_min")
+
+Only the nodes downstream of a varied parameter are evaluated again for its
+variations, in the same pass over the input files.
+"""
+
+import ROOT
+
+from cutflow import CutFlow
+from rdfgraph import Node
+
+
+def parameters(df, selection, variations, names):
+    # define the parameters names with their nominal value, and vary them
+    for name in names:
+        df = df.Define(name, f"double({float(selection[name])!r})")
+        for variation, (parameter, values) in variations.items():
+            if parameter == name:
+                expr = "ROOT::RVecD{" + ", ".join(f"{float(v)!r}" for v in values.values()) + "}"
+                df = df.Vary(name, expr, list(values), variation)
+    return df
+
+
+def suffix(key):
+    # "muonScale:up" -> "_muonScaleUp"
+    variation, tag = key.split(":")
+    return f"_{variation}{tag[:1].upper()}{tag[1:]}"
+
+
+def variations_for(result, cache):
+    # RResultMap of a booked result (None for results without variations, e.g. read from a skim),
+    # each result is varied once even if it is shared by several modules
+    ptr = result.rdf if isinstance(result, Node) else result
+    if not hasattr(ptr, "GetPtr"):
+        return None
+    if id(ptr) not in cache:
+        cache[id(ptr)] = (ptr, ROOT.RDF.Experimental.VariationsFor(ptr))
+    return cache[id(ptr)][1]
+
+
+class Varied:
+    # one variation of a booked result, mimics an RResultPtr; results that do not depend
+    # on the variation (e.g. the cuts above a varied parameter) give their nominal value
+
+    def __init__(self, result, results, key, name=None):
+        self.result = result
+        self.results = results
+        self.keys = set() if results is None else {str(k) for k in results.GetKeys()}
+        self.key = key
+        self.name = name
+        self.value = None
+
+    def GetName(self):
+        return self.name if self.name is not None else self.result.GetName()
+
+    def GetValue(self):
+        if self.value is None:
+            value = self.results[self.key] if self.key in self.keys else self.result.GetValue()
+            if self.name is not None:
+                value = value.Clone(self.name)
+                value.SetDirectory(0)
+            self.value = value
+        return self.value
+
+
+def variants(hists, names, cache=None):
+    # varied copies of the hists named in names, for every variation any of them depends on;
+    # to be called after booking and before the event loop
+    cache = {} if cache is None else cache
+    hists = [h for h in hists if h.GetName() in names]
+    results = {}
+    for h in hists:
+        for r in (h.stats.values() if isinstance(h, CutFlow) else [h]):
+            results[id(r)] = variations_for(r, cache)
+    keys = sorted({str(k) for m in results.values() if m is not None for k in m.GetKeys()} - {"nominal"})
+
+    varied = []
+    for key in keys:
+        for h in hists:
+            if isinstance(h, CutFlow):
+                v = CutFlow(h.labels, h.name + suffix(key), h.weight)
+                v.stats = {cut: Varied(s, results[id(s)], key) for cut, s in h.stats.items()}
+            else:
+                v = Varied(h, results[id(h)], key, h.GetName() + suffix(key))
+            varied.append(v)
+    return varied
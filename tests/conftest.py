@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the helpers in functions/ are flat modules, imported like the analysis modules do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "functions"))
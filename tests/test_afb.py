@@ -0,0 +1,161 @@
+import numpy as np
+import pytest
+
+import afb
+
+EDGES = np.linspace(-1, 1, 41)
+
+
+def expected(afb_true, norm=1000., edges=EDGES):
+    x = afb.centers(edges)
+    return norm*(3*(1 + x*x)/8 + afb_true*x)
+
+
+def reference_fit(y, edges):
+    # weighted least squares of y = a*f + b*x with weights 1/y on the non-empty bins
+    x = afb.centers(edges)
+    use = y > 0
+    X = np.stack([3*(1 + x*x)/8, x], axis=-1)[use]
+    W = np.diag(1/y[use])
+    cov = np.linalg.inv(X.T @ W @ X)
+    a, b = cov @ X.T @ W @ y[use]
+    grad = np.array([-b/a**2, 1/a])
+    return b/a, np.sqrt(grad @ cov @ grad), X @ [a, b], use
+
+
+def test_fit_exact_on_model():
+    res = afb.fit(expected(0.1), EDGES)
+    assert res["afb"] == pytest.approx(0.1, abs=1e-12)
+    assert res["chi2"] == pytest.approx(0, abs=1e-8)
+    assert res["ndf"] == len(EDGES) - 3
+
+
+def test_fit_matches_least_squares():
+    rng = np.random.default_rng(1)
+    y = rng.poisson(expected(0.05)).astype(float)
+    y[3] = 0  # empty bins do not enter the fit
+    value, error, model, use = reference_fit(y, EDGES)
+    res = afb.fit(y, EDGES)
+    assert res["afb"] == pytest.approx(value, rel=1e-10)
+    assert res["afb_err"] == pytest.approx(error, rel=1e-10)
+    assert res["chi2"] == pytest.approx(((y[use] - model)**2/y[use]).sum(), rel=1e-8)
+    assert res["ndf"] == use.sum() - 2
+
+
+def test_counting():
+    y = expected(0.08)
+    x = afb.centers(EDGES)
+    N_F, N_B = y[x >= 0].sum(), y[x < 0].sum()
+    res = afb.counting(y, EDGES)
+    assert res["afb"] == pytest.approx((N_F - N_B)/(N_F + N_B))
+    assert res["afb_err"] == pytest.approx(np.sqrt(4*N_F*N_B/(N_F + N_B)**3))
+
+
+def test_window():
+    y = expected(0.1)
+    x = np.abs(afb.centers(EDGES))
+    inside = x <= 0.5
+    res = afb.fit(y, EDGES, window=(0, 0.5))
+    assert res["afb"] == pytest.approx(0.1)
+    assert res["ndf"] == inside.sum() - 2
+    assert afb.counting(y, EDGES, window=(0, 0.5))["N_F"] == pytest.approx(y[inside & (afb.centers(EDGES) >= 0)].sum())
+
+
+def test_batched():
+    rng = np.random.default_rng(2)
+    y = rng.poisson(expected(0.05, 500.), size=(2, 3, len(EDGES) - 1)).astype(float)
+    res = afb.fit(y, EDGES)
+    assert res["afb"].shape == (2, 3)
+    for i in range(2):
+        for j in range(3):
+            assert res["afb"][i, j] == pytest.approx(afb.fit(y[i, j], EDGES)["afb"], rel=1e-12)
+            assert res["afb_err"][i, j] == pytest.approx(reference_fit(y[i, j], EDGES)[1], rel=1e-10)
+
+
+def test_rebin():
+    values, edges = afb.rebin(np.arange(10.), np.arange(11.), 3)
+    np.testing.assert_array_equal(values, [3., 12., 21.])
+    np.testing.assert_array_equal(edges, [0., 3., 6., 9.])
+
+
+def test_window_scan_matches_fit():
+    rng = np.random.default_rng(3)
+    y = rng.poisson(expected(0.05, 300.), size=(2, len(EDGES) - 1)).astype(float)
+    bounds = [0, 0.2, 0.45, 0.8, 1.]
+    count, fit = afb.window_scan(y, EDGES, bounds)
+    assert fit["afb"].shape == (2, len(bounds), len(bounds))
+    for i, lo in enumerate(bounds):
+        for j, hi in enumerate(bounds):
+            if i >= j:
+                assert np.isnan(fit["afb"][:, i, j]).all() and np.isnan(count["afb"][:, i, j]).all()
+                continue
+            ref = afb.fit(y, EDGES, window=(lo, hi))
+            np.testing.assert_allclose(fit["afb"][:, i, j], ref["afb"], rtol=1e-9)
+            np.testing.assert_allclose(fit["afb_err"][:, i, j], ref["afb_err"], rtol=1e-9)
+            np.testing.assert_allclose(fit["ndf"][:, i, j], ref["ndf"])
+            np.testing.assert_allclose(count["afb"][:, i, j], afb.counting(y, EDGES, window=(lo, hi))["afb"], rtol=1e-9)
+
+
+def test_scan_lumis_and_rebins():
+    y = np.random.default_rng(4).poisson(expected(0.05, 50.)).astype(float)
+    lumis = [1., 10.]
+    results = afb.scan(y, EDGES, lumis=lumis, rebins=[1, 4], window=(0, 0.9))
+    for factor, (count, fit) in results.items():
+        v, e = afb.rebin(y, EDGES, factor)
+        for iL, lumi in enumerate(lumis):
+            ref = afb.fit(v*lumi, e, window=(0, 0.9))
+            assert fit["afb"][iL] == pytest.approx(ref["afb"], rel=1e-10)
+            assert fit["afb_err"][iL] == pytest.approx(ref["afb_err"], rel=1e-10)
+    # the statistical error scales with 1/sqrt(lumi)
+    assert results[1][1]["afb_err"][1] == pytest.approx(results[1][1]["afb_err"][0]/np.sqrt(10))
+
+
+def moments_histogram(c, windows, order=10):
+    # contents of the moments histogram filled by FCCAnalyses::afb_moments with unit weights
+    t = c/(3*(1 + c*c)/8)
+    values = []
+    for m in windows:
+        inside = np.abs(c) <= m
+        ci, ti = c[inside], t[inside]
+        values += [(ci >= 0).sum(), (ci < 0).sum(), ci.sum(), (ci*ci).sum()] + [(ti**k).sum() for k in range(1, order + 1)]
+    return np.array(values, dtype=np.float64)
+
+
+@pytest.fixture(scope="module")
+def events():
+    # cos(theta) of events following 3(1+c^2)/8 + A c, with A = 0.08
+    rng = np.random.default_rng(5)
+    c = rng.uniform(-1, 1, 400000)
+    keep = rng.uniform(0, 0.75 + 0.08, len(c)) < 3*(1 + c*c)/8 + 0.08*c
+    return c[keep]
+
+
+def test_unbinned(events):
+    windows = [0.9, 1.0]
+    count, moments, likelihood = afb.unbinned(moments_histogram(events, windows), windows)
+    for iw, m in enumerate(windows):
+        c = events[np.abs(events) <= m]
+        t = c/(3*(1 + c*c)/8)
+        N_F, N_B = (c >= 0).sum(), (c < 0).sum()
+        assert count["afb"][iw] == pytest.approx((N_F - N_B)/(N_F + N_B))
+        for res in (count, moments, likelihood):
+            assert abs(res["afb"][iw] - 0.08) < 4*res["afb_err"][iw]
+
+        # maximum of sum log(1 + A t), and its error from the second derivative
+        A = likelihood["afb"][iw]
+        grid = A + np.linspace(-1e-3, 1e-3, 201)
+        logL = np.log1p(grid[:, None]*t[None, :]).sum(axis=1)
+        assert grid[np.argmax(logL)] == pytest.approx(A, abs=2e-5)
+        assert likelihood["afb_err"][iw] == pytest.approx(1/np.sqrt((t*t/(1 + A*t)**2).sum()), rel=1e-4)
+
+    # the likelihood is the most precise estimator, the counting the least
+    assert (likelihood["afb_err"] < moments["afb_err"]).all() and (moments["afb_err"] < count["afb_err"]).all()
+
+
+def test_unbinned_batched(events):
+    windows = [0.5, 1.0]
+    values = np.stack([moments_histogram(events[:50000], windows), moments_histogram(events[50000:], windows)])
+    results = afb.unbinned(values, windows)
+    for i in range(2):
+        for res, ref in zip(results, afb.unbinned(values[i], windows)):
+            np.testing.assert_allclose(res["afb"][i], ref["afb"], rtol=1e-12)
@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import subprocess
+
+import numpy as np
+import pytest
+
+pytest.importorskip("ROOT")
+
+import columnar
+
+SEL = dict(columnar.DEFAULTS)
+
+
+def events(muons, extra=0):
+    # select() inputs for events given as lists of muons (px, py, pz, q), each with extra other particles first
+    rp, index, rpCounts, muonCounts = [], [], [], []
+    for ev in muons:
+        particles = [(1., 0., 0., 0.13957, 1.)]*extra + [(px, py, pz, 0.10566, q) for px, py, pz, q in ev]
+        rp += particles
+        index += list(range(extra, len(particles)))
+        rpCounts.append(len(particles))
+        muonCounts.append(len(ev))
+    rp = [np.array([p[k] for p in rp], dtype=np.float32) for k in range(5)]
+    return rp, np.array(index), np.array(rpCounts), np.array(muonCounts)
+
+
+def leg(p, theta, phi, q):
+    return (p*np.sin(theta)*np.cos(phi), p*np.sin(theta)*np.sin(phi), p*np.cos(theta), q)
+
+
+def bins(x, nbins, xmin, xmax):
+    # TAxis::FindBin
+    x = np.asarray(x, dtype=np.float64)
+    return np.where(x < xmin, 0, np.where(x >= xmax, nbins + 1, 1 + np.floor(nbins*(x - xmin)/(xmax - xmin)).astype(np.int64)))
+
+
+def test_fill():
+    x = np.array([-2., -1., -0.5, 0., 0.999, 1., 3.])
+    counts, stats = columnar.fill(x, 4, -1., 1.)
+    np.testing.assert_array_equal(counts, [1, 1, 1, 1, 1, 2])
+    np.testing.assert_array_equal(counts, np.bincount(bins(x, 4, -1., 1.), minlength=6))
+    inside = x[1:5]
+    np.testing.assert_allclose(stats, [4, 4, inside.sum(), (inside*inside).sum(), 7])
+
+
+def test_select_stages():
+    muons = [
+        [],  # no muon
+        [leg(40., 1., 0., -1)],  # one muon
+        [leg(40., 1., 0., -1), leg(40., 2., 3., -1)],  # same sign
+        [leg(45., 1., 0., -1), leg(45., np.pi - 1., np.pi, 1)],  # back-to-back pair
+        [leg(45., 1., 0., -1), leg(45., np.pi - 1., np.pi, 1), leg(10., 0.1, 0., 1)],  # third muon outside the acceptance
+        [leg(20., 1., 0., -1), leg(20., np.pi - 1., np.pi, 1)],  # soft pair, fails the momentum cut
+        [leg(45., 1., 0., -1), leg(45., 1.5, 2., 1)],  # acolinear pair
+    ]
+    columns, event, masks, pairMasks = columnar.select(*events(muons, extra=2), SEL)
+    assert [m.sum() for m in masks] == [7, 6, 5, 4, 3, 2]
+    np.testing.assert_array_equal(masks[3], [False, False, False, True, True, True, True])
+    np.testing.assert_array_equal(masks[5], [False, False, False, True, True, False, False])
+    np.testing.assert_array_equal(pairMasks[5], [True, True, False, False])
+    np.testing.assert_allclose(columns["muon_max_p_norm"], np.array([45., 45., 20., 45.])/45.6, rtol=1e-6)
+    np.testing.assert_allclose(columns["acolinearity"][:3], 0, atol=1e-3)
+    np.testing.assert_allclose(columns["invariant_mass"][:2], 90., rtol=1e-5)
+    np.testing.assert_allclose(columns["cos_theta_minus"], np.cos(1.), rtol=1e-6)
+    assert len(columns["muons_all_costheta"]) == 2*len(muons) - 1 - 1
+
+
+def test_near_edge_recomputation():
+    # polar angles within float precision of the theta and cos(theta) bin edges: the columns of select(),
+    # computed with NumPy and again with the C math library close to the edges, fall in the same bins as
+    # with the C math library functions only
+    rng = np.random.default_rng(1)
+    n = 20000
+    edges = np.concatenate([np.arange(13, 145)*0.02, np.arccos(np.linspace(-0.96, 0.96, 97))])
+    thetas = rng.choice(edges, (n, 2)) + rng.uniform(-2e-7, 2e-7, (n, 2))
+    phis = rng.uniform(0, 2*np.pi, n)
+    muons = [[leg(45.6, t[0], phi, -1), leg(45.6, t[1], phi + np.pi, 1)] for t, phi in zip(thetas, phis)]
+    binnings = {"theta_plus": [(500, -5, 5)], "theta_minus": [(500, -5, 5)], "cos_theta_plus": [(100, -1, 1)],
+                "cos_theta_minus": [(100, -1, 1)], "cosThetac": [(100, -1, 1)], "acolinearity": [(800, -4, 4)]}
+    inputs = events(muons)
+    columns, event, masks, pairMasks = columnar.select(*inputs, SEL, binnings)
+
+    rp = inputs[0]  # the two muons of every event, in order
+    px, py, pz, q = (rp[k] for k in (0, 1, 2, 4))
+    pt = np.sqrt(px*px + py*py)
+    legs = (pt[0::2], pt[1::2]), (pz[0::2], pz[1::2]), (q[0::2], q[1::2])
+    reference = columnar.angles(*legs, columnar.exact)
+    approx = columnar.angles(*legs, columnar.approx)
+    differ = 0
+    for column, values in reference.items():
+        (nbins, xmin, xmax), = binnings[column]
+        np.testing.assert_array_equal(bins(columns[column], nbins, xmin, xmax), bins(values, nbins, xmin, xmax))
+        differ += (bins(approx[column], nbins, xmin, xmax) != bins(values, nbins, xmin, xmax)).sum()
+    # the case the recomputation is for does occur
+    assert differ > 0
+
+
+def test_approx_close_to_libm():
+    x = np.random.default_rng(2).uniform(-3, 3, 1000).astype(np.float32)
+    for name in ("cosf", "sinf"):
+        np.testing.assert_allclose(columnar.approx(name, x).astype(np.float32), columnar.exact(name, x), rtol=0, atol=1e-7)
+    np.testing.assert_array_equal(columnar.exact("acos", np.array([1., -1.])), [0., np.pi])
+
+
+@pytest.fixture(scope="module")
+def samples(tmp_path_factory):
+    pytest.importorskip("uproot")
+    pytest.importorskip("awkward")
+    outDir = tmp_path_factory.mktemp("samples")
+    generate = os.path.join(os.path.dirname(__file__), "../benchmark/generate.py")
+    subprocess.run([sys.executable, generate, "--outDir", str(outDir), "--events", "20000", "--files", "2",
+                    "--procs", "wzp6_ee_mumu_ecm91p2", "wzp6_ee_tautau_ecm91p2"], check=True)
+    return outDir
+
+
+@pytest.mark.parametrize("path", ["03_CrossSection/z_mumu_xsec.py", "04_FBAsymmetry/z_mumu_afb.py"])
+def test_matches_rdataframe(samples, path, tmp_path):
+    import ROOT
+    import uproot
+    import runner
+
+    with uproot.open(str(samples / "wzp6_ee_mumu_ecm91p2" / "events_000.root")) as f:
+        assert sorted(f["events"].arrays(filter_name=columnar.BRANCHES, entry_stop=10).fields) == sorted(columnar.BRANCHES)
+
+    module = runner.load_module(os.path.join(os.path.dirname(__file__), "..", path))
+    with open(samples / "samplesDict.json") as f:
+        procs = [proc for proc in module.processList if proc in json.load(f)]
+    module.processList = {proc: {"fraction": 1} for proc in procs}
+    module.inputDir = str(samples)
+    module.procDict = str(samples / "samplesDict.json")
+    module.nCPUS = 4
+    module.outputDir = str(tmp_path / "rdf")
+    runner.run([module])
+    module.outputDir = str(tmp_path / "columnar")
+    columnar.run(module, nProcs=2, step=7000)
+    assert columnar.compare(module, str(tmp_path / "rdf"))
+
+    # the histograms the backend computes are all written
+    hists, cutflows = columnar.booking(module, procs[0])
+    fOut = ROOT.TFile(str(tmp_path / "columnar" / f"{procs[0]}.root"))
+    names = {key.GetName() for key in fOut.GetListOfKeys()}
+    assert {h[0] for h in hists} | {"cutFlow", "cutFlow_raw"} <= names
+    fOut.Close()
@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip("ROOT")
+
+from cutflow import CutFlow
+
+LABELS = ["All events", "#geq 1 #mu", "#geq 2 #mu^{#pm}", "2 OS #mu", "p_{#mu}^{max} > 0.6 p_{beam}"]
+
+
+class Stat:
+    # booked TStatistic of a cut
+
+    def __init__(self, n, w, w2):
+        self.n, self.w, self.w2 = n, w, w2
+
+    def GetValue(self):
+        return self
+
+    def GetN(self):
+        return self.n
+
+    def GetW(self):
+        return self.w
+
+    def GetW2(self):
+        return self.w2
+
+
+class Node:
+
+    def Stats(self, column, weight):
+        return Stat(0, 0., 0.)
+
+
+def cutflow(cuts):
+    cutFlow = CutFlow(LABELS)
+    for cut in cuts:
+        cutFlow.add(Node(), cut)
+        cutFlow.stats[cut] = Stat(100 - 10*cut, 50. - 5*cut, 30. - cut)
+    return cutFlow
+
+
+def test_layout():
+    # analysis.py reads the bin contents of cut i at index i of the values without under/overflow
+    h = cutflow(range(5)).GetValue()
+    assert h.GetName() == "cutFlow"
+    assert h.GetNbinsX() == len(LABELS)
+    for cut, label in enumerate(LABELS):
+        assert h.GetXaxis().GetBinLabel(cut+1) == label
+        assert h.GetBinContent(cut+1) == 50. - 5*cut
+        assert h.GetBinError(cut+1) == pytest.approx((30. - cut)**0.5)
+
+
+def test_raw_counts():
+    cutFlow = cutflow(range(5))
+    raw = cutFlow.raw.GetValue()
+    assert cutFlow.raw.GetName() == "cutFlow_raw"
+    for cut, label in enumerate(LABELS):
+        assert raw.GetXaxis().GetBinLabel(cut+1) == label
+        assert raw.GetBinContent(cut+1) == 100 - 10*cut
+        assert raw.GetBinError(cut+1) == pytest.approx((100 - 10*cut)**0.5)
+
+
+def test_stages_sum():
+    # the cut flows of the skim and analysis stages fill different bins of the same layout
+    skim, analysis = cutflow(range(4)), cutflow([4])
+    h = skim.GetValue().Clone("sum")
+    h.Add(analysis.GetValue())
+    assert [h.GetBinContent(i+1) for i in range(5)] == [50., 45., 40., 35., 30.]
+    assert analysis.GetValue().GetBinContent(1) == 0
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from histstore import HistStore
+
+HISTS = {
+    "cutFlow": np.array([100., 80., 60.]),
+    "invariant_mass": np.array([1., 2., 3., 4.]),
+}
+
+
+class Store(HistStore):
+    # reads the histograms from HISTS instead of the ROOT files, and counts the reads
+
+    reads = []
+
+    def load_root(self, proc):
+        self.reads.append(proc)
+        self.meta[proc] = {"crossSection": 2., "eventsProcessed": 1000}
+        for hName in self.hNames:
+            values = HISTS[hName]
+            self.hists[(proc, hName)] = {"values": values, "variances": values/2, "edges": np.arange(len(values) + 1.), "labels": None}
+
+
+@pytest.fixture
+def outputs(tmp_path):
+    for proc in ("a", "b"):
+        (tmp_path / f"{proc}.root").write_bytes(b"histograms")
+    Store.reads = []
+    return tmp_path
+
+
+def test_cache_reused(outputs):
+    first = Store(["a", "b"], ["cutFlow"], inputDir=str(outputs))
+    second = Store(["a", "b"], ["cutFlow"], inputDir=str(outputs))
+    assert Store.reads == ["a", "b"]
+    assert os.path.isfile(outputs / ".histcache" / "a.npy")
+    for store in (first, second):
+        values, variances, edges = store.get("a", "cutFlow", variances=True)
+        np.testing.assert_array_equal(values, HISTS["cutFlow"])
+        np.testing.assert_array_equal(variances, HISTS["cutFlow"]/2)
+        np.testing.assert_array_equal(edges, [0., 1., 2., 3.])
+    assert second.nevents("b") == 1000 and second.xsec("b") == 2.
+
+
+def test_cache_invalidated_by_file_change(outputs):
+    Store(["a", "b"], ["cutFlow"], inputDir=str(outputs))
+    (outputs / "b.root").write_bytes(b"new histograms")
+    Store(["a", "b"], ["cutFlow"], inputDir=str(outputs))
+    assert Store.reads == ["a", "b", "b"]
+
+
+def test_cache_invalidated_by_new_histogram(outputs):
+    Store(["a"], ["cutFlow"], inputDir=str(outputs))
+    store = Store(["a"], ["cutFlow", "invariant_mass"], inputDir=str(outputs))
+    assert Store.reads == ["a", "a"]
+    np.testing.assert_array_equal(store.get("a", "invariant_mass")[0], HISTS["invariant_mass"])
+    # a subset of the cached histograms is read from the cache
+    Store(["a"], ["invariant_mass"], inputDir=str(outputs))
+    assert Store.reads == ["a", "a"]
+
+
+def test_normalization(outputs):
+    store = Store(["a", "b"], ["invariant_mass"], inputDir=str(outputs))
+    values, variances, edges = store.get("a", "invariant_mass", lumi=500., variances=True)
+    sf = 500.*2./1000
+    np.testing.assert_allclose(values, HISTS["invariant_mass"]*sf)
+    np.testing.assert_allclose(variances, HISTS["invariant_mass"]/2*sf**2)
+    stacked, edges = store.stack("invariant_mass", lumi=500.)
+    assert stacked.shape == (2, 4)
+    np.testing.assert_allclose(stacked[1], values)
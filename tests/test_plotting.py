@@ -0,0 +1,67 @@
+import json
+
+import numpy as np
+import pytest
+
+import plotting
+from plotting import Plot, render
+
+
+class Figure:
+    # stands in for a ROOT canvas
+
+    def __init__(self, text):
+        self.text = text
+
+    def SaveAs(self, path):
+        with open(path, "w") as f:
+            f.write(self.text)
+
+
+def draw(data, style):
+    return Figure(f"{data['values'].sum()} {style.get('color')}")
+
+
+def draw_failing(data, style):
+    raise ValueError("cannot draw")
+
+
+def plots(values=(1., 2.), color="red"):
+    data = {"values": np.array(values), "edges": np.array([0., 1., 2.])}
+    return [Plot("mass", draw, data, {"color": color}, ["png", "pdf"]),
+            Plot("costheta", draw, {"values": np.ones(3), "edges": np.arange(4.)}, {}, ["png"])]
+
+
+def test_unchanged_figures_skipped(tmp_path):
+    written = render(plots(), str(tmp_path), nProcs=2)
+    assert sorted(written) == sorted(str(tmp_path / f) for f in ("mass.png", "mass.pdf", "costheta.png"))
+    manifest = json.loads((tmp_path / plotting.MANIFEST).read_text())
+    assert sorted(manifest) == ["costheta.png", "mass.pdf", "mass.png"]
+    assert render(plots(), str(tmp_path), nProcs=2) == []
+
+
+def test_changed_inputs_rendered(tmp_path):
+    render(plots(), str(tmp_path), nProcs=2)
+    assert sorted(render(plots(values=(1., 3.)), str(tmp_path), nProcs=2)) == [str(tmp_path / "mass.pdf"), str(tmp_path / "mass.png")]
+    assert (tmp_path / "mass.png").read_text() == "4.0 red"
+    assert len(render(plots(values=(1., 3.), color="blue"), str(tmp_path), nProcs=2)) == 2
+    (tmp_path / "costheta.png").unlink()
+    assert render(plots(values=(1., 3.), color="blue"), str(tmp_path), nProcs=2) == [str(tmp_path / "costheta.png")]
+    assert len(render(plots(values=(1., 3.), color="blue"), str(tmp_path), nProcs=2, force=True)) == 3
+
+
+def test_failed_figures_not_recorded(tmp_path):
+    failing = plots()
+    failing[1].draw = draw_failing
+    with pytest.raises(RuntimeError, match="costheta.png"):
+        render(failing, str(tmp_path), nProcs=2)
+    manifest = json.loads((tmp_path / plotting.MANIFEST).read_text())
+    assert sorted(manifest) == ["mass.pdf", "mass.png"]
+    assert render(plots(), str(tmp_path), nProcs=2) == [str(tmp_path / "costheta.png")]
+
+
+def test_key_covers_draw_function():
+    plot = plots()[0]
+    key = plot.key()
+    plot.draw = draw_failing
+    assert plot.key() != key
@@ -0,0 +1,91 @@
+import pytest
+
+pytest.importorskip("ROOT")
+
+import prescan
+from cutflow import CutFlow
+from rdfgraph import Graph
+
+
+class Result:
+    # event loop result of a count, a sum of weights or a cut-flow TStatistic
+
+    def __init__(self, value, name="result"):
+        self.value = value
+        self.name = name
+
+    def GetName(self):
+        return self.name
+
+    def GetValue(self):
+        return self.value
+
+
+class Stat:
+
+    def __init__(self, n, w, w2):
+        self.n, self.w, self.w2 = n, w, w2
+
+    def GetN(self):
+        return self.n
+
+    def GetW(self):
+        return self.w
+
+    def GetW2(self):
+        return self.w2
+
+
+def test_skipped_values():
+    assert prescan.Skipped(Result(100), 30).GetValue() == 130
+    assert prescan.Skipped(Result(12.5), 30).GetValue() == pytest.approx(42.5)
+    assert prescan.Skipped(Result(0, "weightsum"), 30).GetName() == "weightsum"
+    stat = prescan.Skipped(Result(Stat(10, 5., 2.5)), 30).GetValue()
+    assert (stat.GetN(), stat.GetW(), stat.GetW2()) == (40, 35., 32.5)
+
+
+def test_add_skipped_only_before_filters():
+    graph = Graph(None)
+    df = graph.root.Define("weight", "1.0")
+    cutFlow = CutFlow(["All events", "#geq 1 #mu"])
+    cutFlow.add(df, 0)
+    df = df.Filter("muons_no >= 1")
+    cutFlow.add(df, 1)
+    assert not prescan.filtered(cutFlow.stats[0]) and prescan.filtered(cutFlow.stats[1])
+    unfiltered, passing = cutFlow.stats[0], cutFlow.stats[1]
+
+    hists, eventsProcessed, weightsum = prescan.add_skipped([cutFlow], Result(70), Result(70.), 30)
+    assert hists == [cutFlow]
+    assert isinstance(cutFlow.stats[0], prescan.Skipped) and cutFlow.stats[0].result is unfiltered
+    assert cutFlow.stats[1] is passing
+    assert eventsProcessed.GetValue() == 100 and weightsum.GetValue() == 100.
+
+
+def test_cut_flow_with_skipped_events():
+    # the skipped events enter the first stage of the cut flow and of its raw counts, the other stages are unchanged
+    cutFlow = CutFlow(["All events", "#geq 1 #mu"])
+    cutFlow.stats = {0: prescan.Skipped(Result(Stat(70, 70., 70.)), 30), 1: Result(Stat(50, 50., 50.))}
+    h = cutFlow.GetValue()
+    assert [h.GetBinContent(i) for i in (1, 2)] == [100., 50.]
+    assert h.GetBinError(1) == pytest.approx(10.)
+    raw = cutFlow.raw.GetValue()
+    assert [raw.GetBinContent(i) for i in (1, 2)] == [100., 50.]
+
+
+def test_spec_of():
+    class Module:
+        def __init__(self, spec=None):
+            if spec is not None:
+                self.prescan = spec
+
+    assert prescan.spec_of([Module(("Muon#0.index", 1)), Module(("Muon#0.index", 1))]) == ("Muon#0.index", 1)
+    assert prescan.spec_of([Module(("Muon#0.index", 1)), Module(("Muon#0.index", 2))]) is None
+    assert prescan.spec_of([Module(("Muon#0.index", 1)), Module()]) is None
+    assert prescan.spec_of([Module()]) is None
+
+
+def test_list_path():
+    path = prescan.list_path("prescan", "proc", "/data/events.root:10:1", ("Muon#0.index", 1))
+    assert path.startswith("prescan/proc/") and path.endswith(".root")
+    assert prescan.list_path("prescan", "proc", "/data/events.root:11:1", ("Muon#0.index", 1)) != path
+    assert prescan.list_path("prescan", "proc", "/data/events.root:10:1", ("Muon#0.index", 2)) != path
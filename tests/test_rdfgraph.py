@@ -0,0 +1,104 @@
+from rdfgraph import Graph
+
+
+class Recorder:
+    # stands in for an RDataFrame node, records the calls booked on it
+
+    def __init__(self, calls=None):
+        self.calls = [] if calls is None else calls
+
+    def __getattr__(self, op):
+        def call(*args):
+            self.calls.append((op,) + args)
+            return Recorder(self.calls)
+        return call
+
+
+def selection(df):
+    df = df.Define("weight", "1.0")
+    df = df.Define("muons_p", "get_p(muons)")
+    return df.Filter("muons_p.size() >= 2")
+
+
+def test_identical_calls_are_shared():
+    graph = Graph(Recorder())
+    a = selection(graph.root)
+    b = selection(graph.root)
+    assert a is b
+    assert graph.root.Define("weight", "2.0") is not graph.root.Define("weight", "1.0")
+    h1 = a.Histo1D(("m", "", 10, 0, 1), "m")
+    h2 = b.Histo1D(("m", "", 10, 0, 1), "m")
+    assert h1 is h2
+    assert len(graph.actions()) == 1
+
+
+def test_modules_share_prefix():
+    graph = Graph(Recorder())
+    df = selection(graph.root)
+    df.Define("m", "mass(muons)").Histo1D(("m", "", 10, 0, 1), "m")
+    df.Define("costheta", "cos(muons)").Histo1D(("costheta", "", 10, -1, 1), "costheta")
+    # weight, muons_p, the filter, two defines and two histograms
+    assert len(graph.nodes()) == 1 + 3 + 2 + 2
+    assert graph.summary() == "5 transformations, 2 actions"
+
+
+def test_materialize_books_once():
+    df = Recorder()
+    graph = Graph(df)
+    for _ in range(2):
+        selection(graph.root).Histo1D(("p", "", 10, 0, 1), "muons_p")
+    graph.materialize()
+    assert [c[0] for c in df.calls] == ["Define", "Define", "Filter", "Histo1D"]
+
+
+def test_prune_drops_unused_defines():
+    df = Recorder()
+    graph = Graph(df)
+    sel = selection(graph.root)
+    weightsum = graph.root.Define("weight", "1.0").Sum("weight")
+    mass = sel.Define("m", "mass(muons)").Histo1D(("m", "", 10, 0, 1), "m")
+    cos = sel.Define("costheta", "cos(muons)").Define("abscos", "abs(costheta)").Histo1D(("abscos", "", 10, 0, 1), "abscos")
+    graph.prune([mass])
+
+    assert set(graph.actions()) == {mass, weightsum}
+    assert not cos.parent.used and not cos.parent.parent.used
+    assert sel.used and mass.parent.used
+    graph.materialize()
+    defined = [c[1] for c in df.calls if c[0] == "Define"]
+    assert defined == ["weight", "muons_p", "m"]
+    assert ("Histo1D", ("abscos", "", 10, 0, 1), "abscos") not in df.calls
+
+
+def test_prune_keeps_defines_used_by_filters():
+    graph = Graph(Recorder())
+    df = graph.root.Define("n", "size(muons)").Define("unused", "f(n)")
+    h = df.Filter("n >= 2").Histo1D(("x", "", 10, 0, 1), "x")
+    graph.prune([h])
+    assert df.parent.used
+    assert not df.used
+
+
+def test_prune_vary_only_if_used():
+    graph = Graph(Recorder())
+    df = graph.root.Define("cut", "0.6").Vary("cut", "ROOT::RVecD{0.65, 0.55}", ["up", "down"], "pMaxCut")
+    used = df.Filter("p > cut").Histo1D(("p", "", 10, 0, 1), "p")
+    other = graph.root.Define("x", "1").Vary("x", "ROOT::RVecD{2}", ["up"], "xShift")
+    dropped = other.Histo1D(("y", "", 10, 0, 1), "y")
+    graph.prune([used, dropped])
+    assert df.used and df.parent.used
+    assert not other.used and not other.parent.used
+
+
+def test_owners():
+    graph = Graph(Recorder())
+    graph.owner = "xsec"
+    selection(graph.root).Histo1D(("p", "", 10, 0, 1), "muons_p")
+    graph.owner = "afb"
+    selection(graph.root).Define("costheta", "cos(muons)").Histo1D(("costheta", "", 10, -1, 1), "costheta")
+    graph.owner = None
+    graph.root.Count()
+    assert len(graph.nodes("xsec")) == 4 and len(graph.nodes("afb")) == 5
+    shared = set(graph.nodes("xsec")) & set(graph.nodes("afb"))
+    assert sorted(n.op for n in shared) == ["Define", "Define", "Filter"]
+    assert all(n.owners == {"xsec", "afb"} for n in shared)
+    assert len(graph.nodes()) == 1 + 3 + 1 + 2 + 1
@@ -0,0 +1,169 @@
+import os
+
+import pytest
+
+pytest.importorskip("ROOT")
+
+import runner
+
+MODULE = """
+import os
+import sys
+sys.path.append({functions!r})
+from cutflow import CutFlow
+
+bins = {bins!r}
+skimColumns = ["x"]
+
+def build_skim(df, hists):
+    hists.append(CutFlow(["All events"]))
+    hists.append(df.Histo1D(("x", "", *bins), "x"))
+    return df, df.Sum("weight")
+
+def build_analysis(df, hists):
+    df = df.Filter("x > {cut}")
+"""
+
+
+@pytest.fixture
+def make_module(tmp_path):
+    functions = runner.__file__.rsplit("/", 1)[0]
+
+    def make(name="mod", bins=(10, 0, 1), cut=0.5):
+        path = tmp_path / f"{name}.py"
+        path.write_text(MODULE.format(functions=functions, bins=bins, cut=cut))
+        return runner.load_module(str(path))
+    return make
+
+
+@pytest.fixture
+def files(tmp_path):
+    path = tmp_path / "events.root"
+    path.write_bytes(b"events")
+    return [str(path)]
+
+
+def test_skim_key_ignores_late_cuts(make_module, files):
+    key = runner.skim_key(make_module(), files)
+    assert runner.skim_key(make_module(cut=0.7), files) == key
+    assert runner.skim_key(make_module(bins=(20, 0, 1)), files) != key
+
+
+def test_skim_key_follows_input_files(make_module, files, tmp_path):
+    module = make_module()
+    key = runner.skim_key(module, files)
+    other = tmp_path / "other.root"
+    other.write_bytes(b"events")
+    assert runner.skim_key(module, files + [str(other)]) != key
+    with open(files[0], "ab") as f:
+        f.write(b"more events")
+    assert runner.skim_key(module, files) != key
+
+
+def test_skim_key_covers_helpers(make_module, files, tmp_path, monkeypatch):
+    module = make_module()
+    helper = tmp_path / "helper.py"
+    helper.write_text("def cut(): return 1\n")
+    monkeypatch.setattr(runner, "local_sources", lambda m: sorted([m.__file__, str(helper)]))
+    key = runner.skim_key(module, files)
+    helper.write_text("def cut(): return 2\n")
+    assert runner.skim_key(module, files) != key
+
+
+def test_local_sources(make_module):
+    sources = runner.local_sources(make_module())
+    assert any(path.endswith("/functions/cutflow.py") for path in sources)
+    assert not any(path.endswith("/pytest/__init__.py") for path in sources)
+
+
+def test_graph_key(make_module, tmp_path):
+    module = make_module()
+    key = runner.graph_key(module)
+    assert runner.graph_key(make_module()) == key
+    assert runner.graph_key(make_module(cut=0.7)) != key
+    assert runner.graph_key(module, outputs={"x"}) != key
+    assert runner.graph_key(module, outputs={"x", "y"}) == runner.graph_key(module, outputs={"y", "x"})
+    header = tmp_path / "functions.h"
+    header.write_text("int f() { return 1; }\n")
+    module.includePaths = ["functions.h"]
+    key = runner.graph_key(module)
+    header.write_text("int f() { return 2; }\n")
+    assert runner.graph_key(module) != key
+
+
+def test_partial_path_follows_file_identity(make_module, files):
+    module = make_module()
+    path = runner.partial_path(module, "proc", "key", files[0])
+    assert os.path.normpath(path).startswith(os.path.join(module.baseDir, "partial", "proc", "key", ""))
+    assert runner.partial_path(module, "proc", "other", files[0]) != path
+    with open(files[0], "ab") as f:
+        f.write(b"more events")
+    assert runner.partial_path(module, "proc", "key", files[0]) != path
+
+
+def test_pending_results(make_module, tmp_path):
+    sampleDir = tmp_path / "samples" / "proc"
+    sampleDir.mkdir(parents=True)
+    for i in range(3):
+        (sampleDir / f"events_{i}.root").write_bytes(b"events")
+    modules = [make_module("a"), make_module("b", cut=0.7)]
+    for module in modules:
+        module.inputDir = str(tmp_path / "samples")
+        module.processList = {"proc": {}}
+    keys = {module.__name__: runner.graph_key(module) for module in modules}
+    files = sorted(str(p) for p in sampleDir.glob("*.root"))
+
+    # a result of a previous run for the first file of module a
+    done = runner.partial_path(modules[0], "proc", keys["a"], files[0])
+    os.makedirs(os.path.dirname(done))
+    open(done, "w").close()
+
+    samples, pending = runner.pending_results(modules, keys)
+    assert samples == [(modules[0], "proc", files), (modules[1], "proc", files)]
+    assert {path: [m.__name__ for m in procModules] for (_, path), procModules in pending.items()} == \
+        {files[0]: ["b"], files[1]: ["a", "b"], files[2]: ["a", "b"]}
+
+
+def test_keys_cover_library_headers(make_module):
+    # the headers replaced by a loaded library are not in includePaths, the keys cover them all the same
+    module = make_module()
+    module.includeLibrary = "libFCCPhysicsFunctions.so"
+    assert runner.headers(module) == sorted(runner.library.headers())
+    key = runner.graph_key(module)
+    del module.includeLibrary
+    assert runner.graph_key(module) != key
+
+
+def test_raw_counts_unscaled(make_module, tmp_path):
+    from cutflow import CutFlow
+
+    class Stat:
+        def __init__(self, n, w):
+            self.n, self.w = n, w
+
+        def GetValue(self):
+            return self
+
+        def GetN(self):
+            return self.n
+
+        def GetW(self):
+            return self.w
+
+        def GetW2(self):
+            return self.w
+
+    module = make_module()
+    module.doScale = True
+    module.intLumi = 5e6
+    module.procDictData = {"proc": {"crossSection": 1000.}}
+    module.outputDir = str(tmp_path / "output")
+    cutFlow = CutFlow(["All events", "Cut"])
+    cutFlow.stats = {0: Stat(20, 20.), 1: Stat(7, 7.)}
+    runner.write_output(module, "proc", [cutFlow, cutFlow.raw], 20, 20.)
+
+    fOut = runner.ROOT.TFile(str(tmp_path / "output" / "proc.root"))
+    h, raw = fOut.Get("cutFlow"), fOut.Get("cutFlow_raw")
+    assert [raw.GetBinContent(i) for i in (1, 2)] == [20, 7]
+    assert [h.GetBinContent(i) for i in (1, 2)] == pytest.approx([5e9, 1.75e9])
+    fOut.Close()
@@ -0,0 +1,92 @@
+import os
+import json
+import socket
+
+import pytest
+
+pytest.importorskip("ROOT")
+
+import runner
+import shards
+
+MODULE = """
+processList = {{"proc": {{}}}}
+inputDir = {inputDir!r}
+
+def build_graph(df, dataset):
+    return [df.Histo1D(("x", "", 10, 0, 1), "x")], df.Sum("weight")
+"""
+
+
+@pytest.fixture
+def module(tmp_path):
+    sampleDir = tmp_path / "samples" / "proc"
+    sampleDir.mkdir(parents=True)
+    for i in range(3):
+        (sampleDir / f"events_{i}.root").write_bytes(b"events")
+    path = tmp_path / "mod.py"
+    path.write_text(MODULE.format(inputDir=str(tmp_path / "samples")))
+    return runner.load_module(str(path))
+
+
+def test_submit_with_outputs(module, tmp_path):
+    queueDir = str(tmp_path / "queue")
+    shards.submit([module], queueDir, outputs={"y", "x"})
+    with open(os.path.join(queueDir, "config.json")) as f:
+        assert json.load(f)["outputs"] == ["x", "y"]
+    config, modules = shards.load_config(queueDir)
+    assert config["outputs"] == {"x", "y"}
+    assert config["keys"] == {"mod": runner.graph_key(module, {"x", "y"})}
+    assert [m.__name__ for m in modules] == ["mod"]
+    assert len(shards.units(queueDir, "todo")) == 3
+
+    shards.submit([module], queueDir)
+    assert shards.load_config(queueDir)[0]["outputs"] is None
+
+
+def test_submit_skips_available_results(module, tmp_path):
+    queueDir = str(tmp_path / "queue")
+    key = runner.graph_key(module)
+    path = runner.partial_path(module, "proc", key, str(tmp_path / "samples" / "proc" / "events_1.root"))
+    os.makedirs(os.path.dirname(path))
+    open(path, "w").close()
+    shards.submit([module], queueDir)
+    todo = [shards.read_json(os.path.join(queueDir, "todo", name)) for name in shards.units(queueDir, "todo")]
+    assert sorted(os.path.basename(u["path"]) for u in todo) == ["events_0.root", "events_2.root"]
+    assert all(u["modules"] == ["mod"] and u["attempts"] == 0 for u in todo)
+
+
+def test_claim_and_release(module, tmp_path):
+    queueDir = str(tmp_path / "queue")
+    shards.submit([module], queueDir, retries=2)
+    claims = [shards.claim(queueDir) for _ in range(4)]
+    assert claims[3] == (None, None)
+    assert len(shards.units(queueDir, "claimed")) == 3 and not shards.units(queueDir, "todo")
+    name, claimed = claims[0]
+    assert claimed.endswith(f"{name}@{socket.gethostname()}@{os.getpid()}")
+
+    # a failed unit is queued again, until it failed retries times
+    assert shards.release(queueDir, name, claimed, "error 1", 2) == "todo"
+    name, claimed = shards.claim(queueDir)
+    assert name == claims[0][0]
+    assert shards.release(queueDir, name, claimed, "error 2", 2) == "failed"
+    unit = shards.read_json(os.path.join(queueDir, "failed", name))
+    assert unit["attempts"] == 2 and unit["errors"] == ["error 1", "error 2"]
+    # a claim released meanwhile
+    assert shards.release(queueDir, name, claimed, "error 3", 2) is None
+    assert shards.status(queueDir) == {"todo": 0, "claimed": 2, "done": 0, "failed": 1}
+
+
+def test_requeue(module, tmp_path):
+    queueDir = str(tmp_path / "queue")
+    shards.submit([module], queueDir)
+    (name, claimed), (other, live), (stale, old) = [shards.claim(queueDir) for _ in range(3)]
+    # a worker of this host that died, a live one and one on another host without update
+    os.rename(claimed, claimed.rsplit("@", 1)[0] + "@999999999")
+    os.rename(old, os.path.join(queueDir, "claimed", f"{stale}@otherhost@1"))
+    os.utime(os.path.join(queueDir, "claimed", f"{stale}@otherhost@1"), (0, 0))
+    assert shards.requeue(queueDir, stale=300) == 2
+    assert sorted(shards.units(queueDir, "todo")) == sorted([name, stale])
+    assert shards.units(queueDir, "claimed") == [os.path.basename(live)]
+    unit = shards.read_json(os.path.join(queueDir, "todo", name))
+    assert unit["attempts"] == 1 and "died" in unit["errors"][0]
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import toys
+
+
+def test_generate_chunks():
+    expected = np.array([[10., 20., 30.], [1., 2., 3.]])
+    chunks = list(toys.generate(expected, 2500, chunk=1000, seed=1))
+    assert [len(c) for c in chunks] == [1000, 1000, 500]
+    assert all(c.shape[1:] == expected.shape for c in chunks)
+    all_toys = np.concatenate(chunks)
+    np.testing.assert_allclose(all_toys.mean(axis=0), expected, rtol=0.05)
+    # reproducible with a seed, independent of the chunk size
+    np.testing.assert_array_equal(np.concatenate(list(toys.generate(expected, 2500, chunk=700, seed=1))), all_toys)
+
+
+def test_run_concatenates_chunks():
+    expected = np.full((2, 4), 100.)
+
+    def estimator(t):
+        total = t.sum(axis=-1)
+        return {"total": (total, np.sqrt(total)), "first": (t[..., 0], np.ones(t.shape[:-1]))}
+
+    results = toys.run(expected, estimator, 250, chunk=100, seed=2)
+    assert set(results) == {"total", "first"}
+    values, errors = results["total"]
+    assert values.shape == (250, 2)
+    np.testing.assert_array_equal(errors, np.sqrt(values))
+
+
+def test_summarize_gaussian():
+    rng = np.random.default_rng(3)
+    truth = np.array([1., 5.])
+    errors = np.array([0.1, 0.5])*np.ones((20000, 2))
+    values = truth + errors*rng.standard_normal((20000, 2))
+    stats = toys.summarize(values, errors, truth)
+    np.testing.assert_array_equal(stats["ntoys"], [20000, 20000])
+    assert np.all(np.abs(stats["bias"]) < 4*stats["bias_err"])
+    np.testing.assert_allclose(stats["rms"], [0.1, 0.5], rtol=0.02)
+    np.testing.assert_allclose(stats["mean_err"], [0.1, 0.5])
+    np.testing.assert_allclose(stats["pull_width"], 1, rtol=0.02)
+    np.testing.assert_allclose(stats["coverage"], 0.6827, atol=0.01)
+
+
+def test_summarize_skips_invalid_toys():
+    values = np.array([1., np.nan, 2., 3.])
+    errors = np.array([1., 1., 0., 1.])
+    stats = toys.summarize(values, errors, 2.)
+    assert stats["ntoys"] == 2
+    assert stats["mean"] == pytest.approx(2.)
+    assert stats["pull_mean"] == pytest.approx(0.)
+    assert stats["rms"] == pytest.approx(np.sqrt(2))
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+import unfold
+
+
+def migrations(n=6, stay=0.8):
+    # (gen, reco) contents: each gen bin keeps a fraction stay of its events, the rest migrates to the neighbours
+    gen = np.linspace(1000., 2000., n)
+    h2 = np.zeros((n, n))
+    for i in range(n):
+        h2[i, i] = stay*gen[i]
+        neighbours = [j for j in (i - 1, i + 1) if 0 <= j < n]
+        for j in neighbours:
+            h2[i, j] = (1 - stay)*gen[i]/len(neighbours)
+    return h2, gen
+
+
+def test_response():
+    h2, gen = migrations()
+    h2[2] = 0  # gen bin without events
+    R = unfold.response(h2)
+    assert R.shape == (6, 6)
+    np.testing.assert_allclose(R.sum(axis=0), [1, 1, 0, 1, 1, 1])
+    np.testing.assert_allclose(R @ np.where(np.arange(6) == 2, 0, gen), h2.sum(axis=0))
+    # batched over the leading axes
+    np.testing.assert_allclose(unfold.response(np.stack([h2, 2*h2]))[1], R)
+
+
+def test_invert():
+    h2, gen = migrations()
+    R = unfold.response(h2)
+    reco = R @ gen
+    values, cov = unfold.invert(R, reco)
+    np.testing.assert_allclose(values, gen)
+    Rinv = np.linalg.inv(R)
+    np.testing.assert_allclose(cov, Rinv @ np.diag(reco) @ Rinv.T)
+    # the unfolded covariance of the toys matches the propagated one
+    toys = np.random.default_rng(1).poisson(reco, size=(20000, 6)).astype(float)
+    values, _ = unfold.invert(R, toys)
+    assert values.shape == (20000, 6)
+    np.testing.assert_allclose(values.mean(axis=0), gen, rtol=0.01)
+    np.testing.assert_allclose(np.sqrt(np.diag(np.cov(values.T))), np.sqrt(np.diag(cov)), rtol=0.03)
+
+
+def test_curvature():
+    L = unfold.curvature(5)
+    assert L.shape == (3, 5)
+    np.testing.assert_array_equal(L[1], [0, 1, -2, 1, 0])
+    np.testing.assert_allclose(L @ np.arange(5.), 0)
+
+
+def test_tikhonov():
+    h2, gen = migrations()
+    R = unfold.response(h2)
+    reco = R @ gen
+    taus = [0, 1e-2, 1.]
+    values, cov = unfold.tikhonov(R, np.stack([reco, 2*reco]), tau=taus)
+    assert values.shape == (2, 3, 6) and cov.shape == (2, 3, 6, 6)
+    # no regularization: the matrix inversion
+    ref, ref_cov = unfold.invert(R, reco)
+    np.testing.assert_allclose(values[0, 0], ref)
+    np.testing.assert_allclose(cov[0, 0], ref_cov)
+    # a linear gen spectrum has no curvature, so it is unbiased for any tau
+    np.testing.assert_allclose(values[1], np.broadcast_to(2*gen, (3, 6)))
+    # the regularization reduces the variances
+    variances = np.diagonal(cov[0], axis1=-2, axis2=-1)
+    assert (variances[1:] <= variances[:-1]*(1 + 1e-9)).all()
+    for i, tau in enumerate(taus):
+        single, _ = unfold.tikhonov(R, reco, tau=tau)
+        np.testing.assert_allclose(single[0], values[0, i])
+
+
+def test_tikhonov_biases_curved_spectrum():
+    h2, _ = migrations()
+    R = unfold.response(h2)
+    gen = np.array([1000., 3000., 1000., 3000., 1000., 3000.])
+    values, _ = unfold.tikhonov(R, R @ gen, tau=[0, 10.])
+    np.testing.assert_allclose(values[0], gen)
+    L = unfold.curvature(6)
+    assert np.abs(L @ values[1]).sum() < np.abs(L @ gen).sum()